@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+'''This module sends each Site's Tasks to a dedicated group of workers.
+
+With the default executor, every worker process scrapes every Site, so each
+one keeps connections & cookies open to every host, and its caches only
+hold a thin slice of each Site. A :class:`SiteAffinityPool` instead gives
+each Site its own group of worker processes, and sends every batch of Tasks
+to the group of its Site, splitting any batch that mixes Sites. Each group
+keeps its Site's connection pool & cookie jar hot, and can be sized to what
+the Site tolerates using :data:`~settings.SITE_WORKER_COUNTS`.
+'''
+import collections
+from multiprocessing import Pool
+import queue
+import threading
+
+import settings
+from util import get_class
+
+
+class SiteAffinityPool(object):
+    '''The SiteAffinityPool runs each Site's batches in its own worker pool.
+
+    It can be used in place of a :class:`Pool
+    <multiprocessing.pool.Pool>` by the :class:`~pipeline.Pipeline` &
+    :func:`~workqueue.run_worker`, which only use
+    :meth:`imap_unordered`.
+    '''
+
+    def __init__(self, websites=None, worker_counts=None,
+                 default_worker_count=None, initializer=None, initargs=()):
+        '''The Constructor starts a worker pool for every Site.
+
+        :param websites: The paths of the Sites' classes, defaults to
+                         :data:`~settings.COMPANIES_TO_PROCESS`
+        :type websites: list
+        :param worker_counts: A dictionary mapping Site abbreviations to the
+                              number of worker processes in their group,
+                              defaults to
+                              :data:`~settings.SITE_WORKER_COUNTS`
+        :type worker_counts: dict
+        :param default_worker_count: The number of worker processes for
+                                     other Sites, defaults to
+                                     :data:`~settings.SITE_WORKER_COUNT`
+        :type default_worker_count: int
+        :param initializer: The function each worker process runs when it
+                            starts
+        :type initializer: function
+        :param initargs: The arguments to pass to the ``initializer``
+        :type initargs: tuple
+        :returns: :obj:`None`
+        '''
+        if websites is None:
+            websites = settings.COMPANIES_TO_PROCESS
+        if worker_counts is None:
+            worker_counts = settings.SITE_WORKER_COUNTS
+        if default_worker_count is None:
+            default_worker_count = settings.SITE_WORKER_COUNT
+        self.pools = {}
+        for website in websites:
+            abbreviation = get_class(website).ABBREVIATION
+            self.pools[abbreviation] = Pool(
+                worker_counts.get(abbreviation, default_worker_count),
+                initializer=initializer, initargs=initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.terminate()
+
+    def terminate(self):
+        '''Stop the worker processes of every group immediately.'''
+        for pool in self.pools.values():
+            pool.terminate()
+
+    def imap_unordered(self, function, batches):
+        '''Run the ``function`` on each batch in its Site's worker group,
+        yielding the results in the order they finish.
+
+        Each batch is split into the Tasks of each Site, which are sent to
+        the Site's group, so a batch mixing Sites gives a result for each of
+        its Sites. Like :meth:`Pool.imap_unordered
+        <multiprocessing.pool.Pool.imap_unordered>`, the ``batches`` are
+        consumed by a separate thread.
+
+        :param function: The function to run on each batch of Tasks
+        :type function: function
+        :param batches: The batches of Tasks to run
+        :type batches: iterable
+        :returns: A generator of the function's results
+        :raises Exception: Any error raised by the ``function`` or while
+                           reading the ``batches``
+        '''
+        results = queue.Queue()
+
+        def submit_batches():
+            submitted = 0
+            try:
+                for batch in batches:
+                    for abbreviation, site_batch in _split_by_site(batch):
+                        self.pools[abbreviation].apply_async(
+                            function, (site_batch,),
+                            callback=lambda result: results.put(
+                                (True, result)),
+                            error_callback=lambda error: results.put(
+                                (False, error)))
+                        submitted += 1
+            except Exception as error:
+                results.put((False, error))
+            results.put((None, submitted))
+
+        threading.Thread(target=submit_batches, daemon=True).start()
+        received = 0
+        submitted = None
+        while submitted is None or received < submitted:
+            succeeded, result = results.get()
+            if succeeded is None:
+                submitted = result
+            elif not succeeded:
+                raise result
+            else:
+                received += 1
+                yield result
+
+
+def _split_by_site(batch):
+    '''Return the abbreviation & Tasks of each Site in the batch, in the
+    order their first Task appears.
+    '''
+    site_batches = collections.OrderedDict()
+    for task in batch:
+        site_batches.setdefault(task.abbreviation, []).append(task)
+    return site_batches.items()
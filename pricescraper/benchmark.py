@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+'''
+This Script compares the speed of the name matching implementations.
+
+It matches randomly generated SESE names against a randomly generated
+catalog, first using the original loop of
+:meth:`~sites.base.BaseSite._prepend_name_match_amounts`, kept here as
+:func:`reference_scores`, then using a :class:`~matching.NameIndex` one SESE
+name at a time, and finally with :meth:`~matching.NameIndex.score_all`. The
+scores of every implementation are checked to be the same.
+'''
+import argparse
+import random
+import time
+
+import matching
+from util import remove_punctuation
+
+
+#: The words the generated names are made of.
+WORDS = ('tomato', 'cherry', 'sweet', 'red', 'yellow', 'green', 'pepper',
+         'hot', 'bell', 'bean', 'bush', 'pole', 'pea', 'snap', 'sugar',
+         'squash', 'summer', 'winter', 'lettuce', 'romaine', 'butterhead',
+         'carrot', 'nantes', 'beet', 'golden', 'early', 'giant', 'organic',
+         'heirloom', 'f1', 'hybrid', 'mix', 'seeds', 'brandywine', 'black',
+         'krim', 'san', 'marzano', 'cayenne', 'jalapeno', 'basil', 'thai',
+         'genovese', 'melon', 'water', 'moon', '&', 'stars', '(ov)')
+
+
+def reference_scores(sese_name, sese_category, names):
+    '''Score the names using the original name matching loop.
+
+    :param sese_name: The SESE Product's name
+    :type sese_name: str
+    :param sese_category: The SESE Product's category
+    :type sese_category: str
+    :param names: The names of the Products to score
+    :type names: list
+    :returns: The score of each name, in order
+    :rtype: :obj:`list`
+    '''
+    sese_words = [remove_punctuation(x) for x in
+                  sese_name.lower().split() +
+                  sese_category.lower().split()]
+    number_of_sese_words = len(sese_words)
+    output = []
+    for name in names:
+        number_of_matches = 0
+        site_words = [remove_punctuation(x) for x in name.lower().split()]
+        number_of_site_words = len(site_words)
+
+        for word in site_words:
+            if word in sese_words:
+                number_of_matches += 1
+
+        percent_site_words_matched = (
+            float(number_of_matches) / number_of_site_words * 100)
+        site_to_sese_word_ratio = (
+            float(number_of_site_words) / number_of_sese_words)
+        percent_sese_words_matched = min(
+            float(number_of_matches) / number_of_sese_words * 100, 100)
+        sese_to_site_word_ratio = (
+            float(number_of_sese_words) / number_of_site_words)
+
+        match_percentage = (
+            percent_site_words_matched * site_to_sese_word_ratio +
+            percent_sese_words_matched * sese_to_site_word_ratio
+        ) / 2
+        output.append(match_percentage)
+    return output
+
+
+def generate_names(count, generator):
+    '''Return ``count`` random names of two to six words.'''
+    return [' '.join(generator.choice(WORDS)
+                     for _ in range(generator.randint(2, 6)))
+            for _ in range(count)]
+
+
+def run_benchmark(product_count, catalog_size, seed=0):
+    '''Time each implementation, returning the seconds each one took.
+
+    :param product_count: The number of SESE names to match
+    :type product_count: int
+    :param catalog_size: The number of names in the catalog
+    :type catalog_size: int
+    :param seed: The seed of the random names
+    :type seed: int
+    :returns: A list of ``(Implementation, Seconds)`` tuples
+    :rtype: :obj:`list`
+    :raises ValueError: If an implementation's scores differ from the
+                        original's
+    '''
+    generator = random.Random(seed)
+    products = list(zip(generate_names(product_count, generator),
+                        generate_names(product_count, generator)))
+    names = generate_names(catalog_size, generator)
+    timings = []
+
+    started_at = time.perf_counter()
+    expected = [reference_scores(name, category, names)
+                for name, category in products]
+    timings.append(('Original loop', time.perf_counter() - started_at))
+
+    started_at = time.perf_counter()
+    name_index = matching.NameIndex(names)
+    scores = [name_index.score(matching.tokenize(name + ' ' + category))
+              for name, category in products]
+    timings.append(('NameIndex.score', time.perf_counter() - started_at))
+    if scores != expected:
+        raise ValueError('NameIndex.score gave different scores')
+
+    started_at = time.perf_counter()
+    name_index = matching.NameIndex(names)
+    scores = name_index.score_all(
+        [matching.tokenize(name + ' ' + category)
+         for name, category in products])
+    timings.append(('NameIndex.score_all', time.perf_counter() - started_at))
+    if [list(row) for row in scores] != expected:
+        raise ValueError('NameIndex.score_all gave different scores')
+    return timings
+
+
+def main():
+    '''Run the benchmark & print the timings.'''
+    parser = argparse.ArgumentParser(
+        description='Compare the speed of the name matching implementations')
+    parser.add_argument(
+        '--products', type=int, default=1000,
+        help='the number of SESE names to match')
+    parser.add_argument(
+        '--catalog', type=int, default=2000,
+        help='the number of names in the catalog')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='the seed of the random names')
+    arguments = parser.parse_args()
+    print('Matching {} names against {} names, {}'.format(
+        arguments.products, arguments.catalog,
+        'with NumPy' if matching.numpy is not None else 'without NumPy'))
+    for implementation, seconds in run_benchmark(
+            arguments.products, arguments.catalog, arguments.seed):
+        print('{:<20}{:>10.3f}s'.format(implementation, seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+'''This module defines the on-disk cache of fetched pages.
+
+The :class:`PageCache` stores each page's response in a SQLite database,
+keyed by the page's URL, so that re-running the scraper does not need to
+download every page again.
+
+Cached pages are fresh for :data:`~settings.CACHE_SEARCH_PAGE_TTL` or
+:data:`~settings.CACHE_PRODUCT_PAGE_TTL` seconds, depending on the kind of
+page. Stale pages are revalidated using the ``ETag`` & ``Last-Modified``
+headers the site originally sent, so unchanged pages do not need to be
+downloaded again. The least recently used pages are evicted once the cache
+grows past :data:`~settings.CACHE_MAX_BYTES`. The total size of the cached
+pages is kept up to date by the database's triggers, so it does not need to
+be added up each time a page is stored.
+
+Since the database is a file, the cache is shared by every worker process.
+Before fetching a page, a worker should :meth:`~PageCache.claim` it. If
+another worker has already claimed the page, the worker can
+:meth:`~PageCache.wait_for` that fetch to finish and reuse its result, so
+the same page is never downloaded by two workers at once.
+'''
+from http import client
+import json
+import sqlite3
+import threading
+import time
+
+import fetch
+import settings
+
+
+#: The kind of page returned by searching a Site.
+SEARCH_PAGE = 'search'
+
+#: The kind of page describing a single Product.
+PRODUCT_PAGE = 'product'
+
+#: The number of seconds between checks for a claimed page being fetched.
+CLAIM_POLL_INTERVAL = 0.1
+
+
+class CacheEntry(object):
+    '''A CacheEntry holds a single cached response.
+
+    .. attribute:: url
+
+        The URL of the cached page
+
+    .. attribute:: status
+
+        The HTTP status code of the cached response
+
+    .. attribute:: headers
+
+        The headers of the cached response
+
+    .. attribute:: body
+
+        The body of the cached response
+
+    .. attribute:: stored_at
+
+        The time the response was last stored or revalidated
+
+    .. attribute:: complete
+
+        Whether the whole body was downloaded
+    '''
+
+    def __init__(self, url, status, headers, body, stored_at, complete=True):
+        '''A CacheEntry is initialized with a row from the cache.'''
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+        self.complete = complete
+
+    def is_usable(self, stop=None):
+        '''Return whether the entry has enough of the page for the request.
+
+        :param stop: The request's condition for stopping the download
+        :type stop: :class:`~fetch.StopCondition`
+        :rtype: :obj:`bool`
+        '''
+        return self.complete or (stop is not None and stop.is_met(self.body))
+
+    def get_validators(self):
+        '''Return the headers used to make a conditional request for the page.
+
+        :returns: The ``If-None-Match`` & ``If-Modified-Since`` headers, if
+                  the original response had an ``ETag`` or ``Last-Modified``
+                  header
+        :rtype: :obj:`dict`
+        '''
+        validators = {}
+        if self.headers.get('ETag') is not None:
+            validators['If-None-Match'] = self.headers['ETag']
+        if self.headers.get('Last-Modified') is not None:
+            validators['If-Modified-Since'] = self.headers['Last-Modified']
+        return validators
+
+    def to_response(self):
+        '''Return the cached page as a Response.
+
+        :rtype: :class:`~fetch.Response`
+        '''
+        return fetch.Response(self.url, self.status, self.headers, self.body,
+                              self.complete, from_cache=True)
+
+
+class PageCache(object):
+    '''The PageCache stores fetched pages in a SQLite database.
+
+    A PageCache may be shared by the threads of a process, and every process
+    using the same ``path`` will share the same cached pages.
+    '''
+
+    def __init__(self, path=None, max_bytes=None, ttls=None,
+                 claim_timeout=None):
+        '''The Constructor opens the cache's database, creating it if
+        necessary.
+
+        :param path: The path to the database file, defaults to
+                     :data:`~settings.CACHE_PATH`
+        :type path: str
+        :param max_bytes: The maximum total size of the cached bodies,
+                          defaults to :data:`~settings.CACHE_MAX_BYTES`
+        :type max_bytes: int
+        :param ttls: A dictionary mapping each kind of page to the number of
+                     seconds it remains fresh, defaults to the
+                     :data:`~settings.CACHE_SEARCH_PAGE_TTL` &
+                     :data:`~settings.CACHE_PRODUCT_PAGE_TTL` settings
+        :type ttls: dict
+        :param claim_timeout: The number of seconds a claim lasts before
+                              other workers stop waiting on it, defaults to
+                              :data:`~settings.CACHE_CLAIM_TIMEOUT`
+        :type claim_timeout: float
+        :returns: :obj:`None`
+        '''
+        if path is None:
+            path = settings.CACHE_PATH
+        if max_bytes is None:
+            max_bytes = settings.CACHE_MAX_BYTES
+        if ttls is None:
+            ttls = {SEARCH_PAGE: settings.CACHE_SEARCH_PAGE_TTL,
+                    PRODUCT_PAGE: settings.CACHE_PRODUCT_PAGE_TTL}
+        if claim_timeout is None:
+            claim_timeout = settings.CACHE_CLAIM_TIMEOUT
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self.claim_timeout = claim_timeout
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            self._create_tables()
+        except Exception:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def _create_tables(self):
+        '''Create the cache's tables & the triggers that keep the total
+        size of the cached bodies, if they do not exist yet.
+        '''
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'url TEXT PRIMARY KEY, status INTEGER, headers TEXT, body BLOB, '
+            'complete INTEGER, size INTEGER, stored_at REAL, '
+            'accessed_at REAL)')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS pages_accessed_at '
+            'ON pages (accessed_at)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS claims ('
+            'url TEXT PRIMARY KEY, expires_at REAL)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS total_size ('
+            'id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER)')
+        self._connection.execute(
+            'INSERT OR IGNORE INTO total_size '
+            'SELECT 0, COALESCE(SUM(size), 0) FROM pages')
+        self._connection.execute(
+            'CREATE TRIGGER IF NOT EXISTS pages_inserted '
+            'AFTER INSERT ON pages BEGIN '
+            'UPDATE total_size SET size = size + new.size; END')
+        self._connection.execute(
+            'CREATE TRIGGER IF NOT EXISTS pages_updated '
+            'AFTER UPDATE OF size ON pages BEGIN '
+            'UPDATE total_size SET size = size + new.size - old.size; END')
+        self._connection.execute(
+            'CREATE TRIGGER IF NOT EXISTS pages_deleted '
+            'AFTER DELETE ON pages BEGIN '
+            'UPDATE total_size SET size = size - old.size; END')
+
+    def close(self):
+        '''Close the cache's database connection.'''
+        with self._lock:
+            self._connection.close()
+
+    def get(self, url):
+        '''Return the cached entry for the ``url``, marking it as used.
+
+        :param url: The URL of the page
+        :type url: str
+        :returns: The cached entry or :obj:`None` if the page is not cached
+        :rtype: :class:`CacheEntry`
+        '''
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT status, headers, body, stored_at, complete '
+                'FROM pages WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                'UPDATE pages SET accessed_at = ? WHERE url = ?',
+                (time.time(), url))
+        status, headers, body, stored_at, complete = row
+        return CacheEntry(url, status, _load_headers(headers), body,
+                          stored_at, bool(complete))
+
+    def is_fresh(self, entry, kind):
+        '''Return whether the ``entry`` is within the TTL for its ``kind``.
+
+        :param entry: The cached entry
+        :type entry: :class:`CacheEntry`
+        :param kind: The kind of page, :data:`SEARCH_PAGE` or
+                     :data:`PRODUCT_PAGE`
+        :type kind: str
+        :rtype: :obj:`bool`
+        '''
+        return time.time() - entry.stored_at < self.ttls[kind]
+
+    def store(self, url, response):
+        '''Store the ``response`` for the ``url``, evicting the least recently
+        used pages if the cache has grown too large.
+
+        :param url: The URL that was requested
+        :type url: str
+        :param response: The response to store
+        :type response: :class:`~fetch.Response`
+        '''
+        now = time.time()
+        headers = json.dumps(list(response.headers.items()))
+        with self._lock:
+            self._connection.execute(
+                'INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (url) DO UPDATE SET status = excluded.status, '
+                'headers = excluded.headers, body = excluded.body, '
+                'complete = excluded.complete, size = excluded.size, '
+                'stored_at = excluded.stored_at, '
+                'accessed_at = excluded.accessed_at',
+                (url, response.status, headers, response.body,
+                 response.complete, len(response.body), now, now))
+            self._evict()
+
+    def refresh(self, url):
+        '''Mark the cached page for the ``url`` as freshly revalidated.'''
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                'UPDATE pages SET stored_at = ?, accessed_at = ? '
+                'WHERE url = ?', (now, now, url))
+
+    def claim(self, url):
+        '''Claim the right to fetch the ``url``.
+
+        Claims that have expired, for example because the worker holding them
+        died, are replaced.
+
+        :param url: The URL of the page
+        :type url: str
+        :returns: Whether the claim was made, :obj:`False` if another worker
+                  is already fetching the page
+        :rtype: :obj:`bool`
+        '''
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                'DELETE FROM claims WHERE url = ? AND expires_at < ?',
+                (url, now))
+            cursor = self._connection.execute(
+                'INSERT OR IGNORE INTO claims VALUES (?, ?)',
+                (url, now + self.claim_timeout))
+            return cursor.rowcount == 1
+
+    def release(self, url):
+        '''Release the claim on the ``url``, allowing others to fetch it.'''
+        with self._lock:
+            self._connection.execute('DELETE FROM claims WHERE url = ?',
+                                     (url,))
+
+    def wait_for(self, url, since, timeout=None):
+        '''Wait for the current claim on the ``url`` to be released.
+
+        :param url: The URL of the page
+        :type url: str
+        :param since: The time the caller started waiting for the page
+        :type since: float
+        :param timeout: The longest time to wait, or :obj:`None` to wait
+                        until the claim is released or expires
+        :type timeout: float
+        :returns: The page stored or revalidated by the claim's holder, or
+                  :obj:`None` if they did not store the page before
+                  releasing their claim or the ``timeout`` passed first
+        :rtype: :class:`CacheEntry`
+        '''
+        if timeout is not None:
+            gives_up_at = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                row = self._connection.execute(
+                    'SELECT expires_at FROM claims WHERE url = ?',
+                    (url,)).fetchone()
+            if row is None or row[0] < time.time():
+                break
+            if timeout is None:
+                time.sleep(CLAIM_POLL_INTERVAL)
+                continue
+            remaining = gives_up_at - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(CLAIM_POLL_INTERVAL, remaining))
+        entry = self.get(url)
+        if entry is not None and entry.stored_at >= since:
+            return entry
+
+    def get_size(self):
+        '''Return the total size of every cached body in bytes.'''
+        with self._lock:
+            return self._get_size()
+
+    def _get_size(self):
+        '''Return the total size of every cached body, the lock must be held.
+        '''
+        return self._connection.execute(
+            'SELECT size FROM total_size').fetchone()[0]
+
+    def _evict(self):
+        '''Delete the least recently used pages until the cache fits in
+        ``max_bytes``, the lock must be held.
+        '''
+        excess = self._get_size() - self.max_bytes
+        if excess <= 0:
+            return
+        rows = self._connection.execute(
+            'SELECT url, size FROM pages ORDER BY accessed_at')
+        evicted = []
+        for url, size in rows:
+            if excess <= 0:
+                break
+            evicted.append((url,))
+            excess -= size
+        self._connection.executemany('DELETE FROM pages WHERE url = ?',
+                                     evicted)
+
+
+def _load_headers(serialized_headers):
+    '''Rebuild a response's headers from their serialized form.'''
+    headers = client.HTTPMessage()
+    for name, value in json.loads(serialized_headers):
+        headers[name] = value
+    return headers
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+'''This module stores snapshots of each competitor's catalog.
+
+Searching every Site for every Product sends tens of thousands of search
+requests per run, while each competitor only sells a few thousand seeds.
+Sites that set a :data:`~sites.base.BaseSite.CATALOG_URL` can instead have
+their whole catalog listed once, using :func:`crawl_catalogs`, and stored in
+a :class:`CatalogStore`.
+
+While a Site's snapshot is younger than :data:`~settings.CATALOG_MAX_AGE`,
+Products are matched against the snapshot returned by :func:`get_catalog`
+instead of searching the Site, so only the matching Product Pages are
+requested. The snapshot is searched & scored using the
+:class:`~matching.NameIndex` returned by :func:`get_catalog_index`, which is
+built once per process. Sites without a recent snapshot are searched as
+usual.
+'''
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+import matching
+import settings
+import stats
+from util import get_class
+
+
+class CatalogStore(object):
+    '''The CatalogStore holds the latest snapshot of each Site's catalog.
+
+    The store may be shared by the threads of a process.
+    '''
+
+    def __init__(self, path=None):
+        '''The Constructor opens the store's database, creating it if
+        necessary.
+
+        :param path: The path to the database file, defaults to
+                     :data:`~settings.CATALOG_PATH`
+        :type path: str
+        :returns: :obj:`None`
+        '''
+        if path is None:
+            path = settings.CATALOG_PATH
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS catalog ('
+            'site TEXT, position INTEGER, url TEXT, name TEXT, '
+            'crawled_at REAL, PRIMARY KEY (site, position))')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''Close the store's database connection.'''
+        with self._lock:
+            self._connection.close()
+
+    def replace(self, site, products):
+        '''Replace the Site's snapshot with a newly crawled catalog.
+
+        :param site: The Site's abbreviation
+        :type site: str
+        :param products: The ``(URL, Name)`` of each Product in the catalog
+        :type products: list
+        :returns: :obj:`None`
+        '''
+        crawled_at = time.time()
+        rows = [(site, position, url, name, crawled_at)
+                for position, (url, name) in enumerate(products)]
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._connection.execute(
+                    'DELETE FROM catalog WHERE site = ?', (site,))
+                self._connection.executemany(
+                    'INSERT INTO catalog VALUES (?, ?, ?, ?, ?)', rows)
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def get_crawled_at(self, site):
+        '''Return when the Site's snapshot was crawled.
+
+        :param site: The Site's abbreviation
+        :type site: str
+        :returns: The time of the crawl or :obj:`None` if there is no
+                  snapshot
+        :rtype: :obj:`float`
+        '''
+        with self._lock:
+            return self._connection.execute(
+                'SELECT MIN(crawled_at) FROM catalog WHERE site = ?',
+                (site,)).fetchone()[0]
+
+    def get_products(self, site):
+        '''Return the Products in the Site's snapshot, in catalog order.
+
+        :param site: The Site's abbreviation
+        :type site: str
+        :returns: The ``(URL, Name)`` of each Product
+        :rtype: :obj:`list`
+        '''
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT url, name FROM catalog WHERE site = ? '
+                'ORDER BY position', (site,)).fetchall()
+        return [tuple(row) for row in rows]
+
+
+_catalogs = {}
+_indexes = {}
+
+
+def get_catalog(site):
+    '''Return the current process's copy of the Site's catalog, if there is
+    a recent snapshot of it.
+
+    Snapshots are read from :data:`~settings.CATALOG_PATH` once per process.
+
+    :param site: The Site's abbreviation
+    :type site: str
+    :returns: The ``(URL, Name)`` of each Product in the catalog or
+              :obj:`None` if the Site should be searched instead
+    :rtype: :obj:`list`
+    '''
+    if not settings.CATALOG_ENABLED:
+        return None
+    if site not in _catalogs:
+        _catalogs[site] = _load_catalog(site)
+    return _catalogs[site]
+
+
+def get_catalog_index(site):
+    '''Return the current process's NameIndex of the names in the Site's
+    catalog, if there is a recent snapshot of it.
+
+    :param site: The Site's abbreviation
+    :type site: str
+    :returns: The index of the names, in catalog order, or :obj:`None` if
+              the Site should be searched instead
+    :rtype: :class:`~matching.NameIndex`
+    '''
+    products = get_catalog(site)
+    if products is None:
+        return None
+    if site not in _indexes or _indexes[site][0] is not products:
+        _indexes[site] = (
+            products, matching.NameIndex([name for _, name in products]))
+    return _indexes[site][1]
+
+
+def _load_catalog(site):
+    '''Read the Site's snapshot from the store, unless it is too old.'''
+    if not os.path.exists(settings.CATALOG_PATH):
+        return None
+    with CatalogStore() as catalog_store:
+        crawled_at = catalog_store.get_crawled_at(site)
+        if (crawled_at is None or
+                time.time() - crawled_at > settings.CATALOG_MAX_AGE):
+            return None
+        return catalog_store.get_products(site)
+
+
+async def crawl_catalogs(catalog_store, websites=None, max_pages=None):
+    '''Crawl every Site that has a catalog, storing each snapshot.
+
+    Sites are crawled at once. A Site whose crawl fails keeps its previous
+    snapshot, and is counted in the ``Catalog Crawl Failures`` statistic.
+
+    :param catalog_store: The store to save the snapshots in
+    :type catalog_store: :class:`CatalogStore`
+    :param websites: The paths of the Sites' classes, defaults to
+                     :data:`~settings.COMPANIES_TO_PROCESS`
+    :type websites: list
+    :param max_pages: The maximum number of pages to fetch from each Site,
+                      defaults to :data:`~settings.CATALOG_MAX_PAGES`
+    :type max_pages: int
+    :returns: :obj:`None`
+    '''
+    if websites is None:
+        websites = settings.COMPANIES_TO_PROCESS
+    site_classes = [get_class(website) for website in websites]
+    site_classes = [site_class for site_class in site_classes
+                    if site_class.CATALOG_URL is not None]
+    crawls = await asyncio.gather(
+        *[site_class('', '', False).crawl_catalog(max_pages)
+          for site_class in site_classes],
+        return_exceptions=True)
+    for site_class, products in zip(site_classes, crawls):
+        if isinstance(products, Exception):
+            stats.increment('Catalog Crawl Failures',
+                            site=site_class.ABBREVIATION)
+            continue
+        catalog_store.replace(site_class.ABBREVIATION, products)
+        stats.increment('Catalog Products', len(products),
+                        site=site_class.ABBREVIATION)
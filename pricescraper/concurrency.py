@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+'''This module adapts the number of requests in flight to each host.
+
+A fixed limit is always a guess, when a Site is fast it leaves throughput
+unused, and when the Site slows down it keeps piling requests onto it. Each
+host of a :class:`~fetch.FetchEngine` is given an :class:`AdaptiveLimit`
+instead, which adjusts the host's limit after every window of requests using
+additive increase & multiplicative decrease. The limit grows by one while
+the window's 95th percentile latency stays close to the host's usual
+latency, and is cut back when the latency or the error rate rises.
+
+A limit may be shared by threads that each run their own event loop, like
+the fetch threads of the hybrid executor sharing a single
+:class:`~fetch.FetchEngine`.
+
+Every change to a limit is counted in the ``Concurrency Limit`` statistic of
+its host's Site, so the statistic adds up to the current limits of every
+worker, as shown in the progress output & the run summary.
+'''
+import asyncio
+import threading
+
+import settings
+import stats
+
+
+#: The fraction of the way the usual latency of a host moves towards a
+#: slower window's latency, so that a Site that stays slow is eventually
+#: treated as normal again.
+BASELINE_DRIFT = 0.1
+
+
+class AdaptiveLimit(object):
+    '''The AdaptiveLimit limits the requests in flight to a single host.
+
+    Requests wait in :meth:`acquire` while the host has ``limit`` requests in
+    flight, and report their latency or failure to :meth:`release`.
+
+    .. attribute:: limit
+
+        The current number of requests allowed in flight, this may be
+        fractional, only its whole part is used.
+
+    .. attribute:: baseline
+
+        The usual 95th percentile latency of the host, or :obj:`None` before
+        the first window of requests has finished
+    '''
+
+    def __init__(self, host=None, initial=None, minimum=None, maximum=None,
+                 window=None, latency_tolerance=None, error_rate=None,
+                 backoff=None):
+        '''The Constructor sets the bounds of the limit & when it changes.
+
+        :param host: The host to count the limit's changes for, if any
+        :type host: str
+        :param initial: The starting limit, defaults to
+                        :data:`~settings.ADAPTIVE_INITIAL_CONCURRENCY`
+        :type initial: int
+        :param minimum: The lowest the limit may go, defaults to
+                        :data:`~settings.ADAPTIVE_MIN_CONCURRENCY`
+        :type minimum: int
+        :param maximum: The highest the limit may go, defaults to
+                        :data:`~settings.FETCH_HOST_CONCURRENCY`
+        :type maximum: int
+        :param window: The number of requests the limit is adjusted after,
+                       defaults to :data:`~settings.ADAPTIVE_WINDOW`
+        :type window: int
+        :param latency_tolerance: How many times slower than the baseline a
+                                  window's latency may be before the limit is
+                                  cut, defaults to
+                                  :data:`~settings.ADAPTIVE_LATENCY_TOLERANCE`
+        :type latency_tolerance: float
+        :param error_rate: The fraction of a window's requests that may fail
+                           before the limit is cut, defaults to
+                           :data:`~settings.ADAPTIVE_ERROR_RATE`
+        :type error_rate: float
+        :param backoff: The fraction of the limit kept when it is cut,
+                        defaults to :data:`~settings.ADAPTIVE_BACKOFF`
+        :type backoff: float
+        :returns: :obj:`None`
+        '''
+        if minimum is None:
+            minimum = settings.ADAPTIVE_MIN_CONCURRENCY
+        if maximum is None:
+            maximum = settings.FETCH_HOST_CONCURRENCY
+        if initial is None:
+            initial = settings.ADAPTIVE_INITIAL_CONCURRENCY
+        if window is None:
+            window = settings.ADAPTIVE_WINDOW
+        if latency_tolerance is None:
+            latency_tolerance = settings.ADAPTIVE_LATENCY_TOLERANCE
+        if error_rate is None:
+            error_rate = settings.ADAPTIVE_ERROR_RATE
+        if backoff is None:
+            backoff = settings.ADAPTIVE_BACKOFF
+        self.host = host
+        self.minimum = min(minimum, maximum)
+        self.maximum = maximum
+        self.window = window
+        self.latency_tolerance = latency_tolerance
+        self.error_rate = error_rate
+        self.backoff = backoff
+        self.limit = 0
+        self.baseline = None
+        self.in_flight = 0
+        self._latencies = []
+        self._failures = 0
+        self._waiters = []
+        self._lock = threading.Lock()
+        self._set_limit(initial)
+
+    async def acquire(self):
+        '''Wait until the host has fewer requests in flight than its limit,
+        then take a slot.
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            try:
+                await waiter[1]
+            finally:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+    def release(self, latency=None, failed=False):
+        '''Give back a slot, adjusting the limit once a window of requests
+        has finished.
+
+        :param latency: The number of seconds the request took, or
+                        :obj:`None` if it should not be measured, like when
+                        the page came from the cache
+        :type latency: float
+        :param failed: Whether the request failed in a way that suggests the
+                       host is overloaded
+        :type failed: bool
+        :returns: :obj:`None`
+        '''
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self._failures += 1
+            elif latency is not None:
+                self._latencies.append(latency)
+            if len(self._latencies) + self._failures >= self.window:
+                self._adjust()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_wake, future)
+
+    def _adjust(self):
+        '''Grow or cut the limit using the finished window of requests. The
+        lock must be held.
+        '''
+        error_rate = self._failures / (len(self._latencies) + self._failures)
+        latencies = sorted(self._latencies)
+        self._latencies = []
+        self._failures = 0
+        overloaded = error_rate > self.error_rate
+        if latencies:
+            latency = latencies[int(0.95 * (len(latencies) - 1))]
+            if self.baseline is None or latency < self.baseline:
+                self.baseline = latency
+            else:
+                overloaded |= (
+                    latency > self.baseline * self.latency_tolerance)
+                self.baseline += (latency - self.baseline) * BASELINE_DRIFT
+        if overloaded:
+            self._set_limit(self.limit * self.backoff)
+        else:
+            self._set_limit(self.limit + 1)
+
+    def _set_limit(self, limit):
+        '''Set the limit within its bounds, counting the change.'''
+        limit = max(self.minimum, min(self.maximum, limit))
+        change = int(limit) - int(self.limit)
+        self.limit = limit
+        if change and self.host is not None:
+            stats.increment('Concurrency Limit', change,
+                            site=stats.get_site(self.host))
+
+
+def _wake(future):
+    '''Let a request waiting for a slot check the limit again.'''
+    if not future.done():
+        future.set_result(None)
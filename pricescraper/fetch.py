@@ -0,0 +1,993 @@
+#!/usr/bin/env python3
+'''This module defines the asynchronous engine used to fetch pages.
+
+Every request made while scraping goes through a :class:`FetchEngine`. The
+engine runs on an :mod:`asyncio` event loop, allowing a single worker process
+to have many requests in flight at once, while the
+:data:`~settings.FETCH_CONCURRENCY` and
+:data:`~settings.FETCH_HOST_CONCURRENCY` settings keep the total number of
+requests, and the number of requests sent to any single host, bounded.
+Within that bound, each host's limit adapts to its latency & errors using a
+:class:`~concurrency.AdaptiveLimit`.
+
+Requests are sent through a :class:`Session`, which keeps a pool of
+keep-alive connections for each host so that repeated requests to a
+competitor's site do not need a new TCP connection & TLS handshake. Sites
+are asked to compress their responses, which are decompressed by a
+:class:`ContentDecoder` as they are read. Brotli compression is only used
+if the optional :mod:`brotli` package is installed. Pages that are not
+needed in full can be given a :class:`StopCondition`, the rest of the page
+is then not downloaded once the condition is met. A Response's text is
+decoded using the charset declared by its ``Content-Type`` header or by a
+``<meta>`` tag near the start of the page.
+
+When :data:`~settings.CACHE_ENABLED` is set, pages are first looked up in
+the on-disk :class:`~cache.PageCache`, which is shared by every worker
+process. A page that another worker is already fetching is not requested
+again, the worker waits for that fetch and reuses its result.
+
+Failed requests are retried according to the engine's
+:class:`~resilience.RetryPolicy`, and each host has a
+:class:`~resilience.CircuitBreaker` so that a failing Site is skipped
+quickly instead of slowing down the whole run.
+
+Every request is given a timeout of :data:`~settings.FETCH_TIMEOUT` seconds,
+shortened to the time left before the run's
+:class:`~resilience.Deadline`, if one is given. Waiting for a rate limit or
+for another worker's download is cut short at the deadline too. Requests
+that cannot start or finish before the deadline raise a
+:class:`~resilience.DeadlineExceededError`, and are not sent.
+
+Each worker process has its own event loop, session and engine. The fetch
+threads of the hybrid executor each run their own event loop, but share a
+single engine made by :func:`create_engine`, so the process has one set of
+limits, circuit breakers & request threads. Workers should call
+:func:`init_worker` when they start, the event loop and engine should then
+be accessed using the :func:`run` and :func:`get_engine` functions.
+'''
+import asyncio
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+from http import client, cookiejar
+import re
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import cache
+from concurrency import AdaptiveLimit
+from resilience import (CircuitBreaker, CircuitOpenError, Deadline,
+                        DeadlineExceededError, FetchFailedError, RetryPolicy)
+import settings
+import stats
+
+
+#: The maximum number of redirects to follow for a single request.
+MAX_REDIRECTS = 10
+
+#: The HTTP status codes that redirect to the response's ``Location``.
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+#: The number of bytes to read from a response at a time.
+READ_CHUNK_SIZE = 16 * 1024
+
+#: The number of bytes of complete lines that are searched again for a
+#: StopCondition's patterns on each check, so that a match spanning the
+#: lines of two checks is still found.
+PATTERN_OVERLAP = 1024
+
+#: The largest number of unread bytes that are read & discarded after a
+#: StopCondition is met, so that the connection can be reused. Connections
+#: with more unread bytes are closed instead.
+DRAIN_LIMIT = 64 * 1024
+
+#: The number of bytes at the start of a page searched for a ``<meta>`` tag
+#: declaring the page's charset.
+CHARSET_SNIFF_BYTES = 1024
+
+#: Matches the charset declared by a ``<meta charset>`` tag or a ``<meta
+#: http-equiv="Content-Type">`` tag.
+META_CHARSET_REGEX = re.compile(
+    rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+
+#: The content encodings the Session accepts.
+ACCEPT_ENCODING = ', '.join(
+    ['gzip', 'deflate'] + (['br'] if brotli is not None else []))
+
+
+class Response(object):
+    '''A Response holds the result of fetching a single URL.
+
+    .. attribute:: url
+
+        The URL that was requested
+
+    .. attribute:: status
+
+        The HTTP status code of the response
+
+    .. attribute:: headers
+
+        The headers of the response
+
+    .. attribute:: body
+
+        The raw bytes of the response's body
+
+    .. attribute:: complete
+
+        Whether the whole body was downloaded, this is :obj:`False` if the
+        download was stopped by a :class:`StopCondition`
+
+    .. attribute:: from_cache
+
+        Whether the Response was taken from the :class:`~cache.PageCache`
+        instead of being downloaded
+
+    .. attribute:: latency
+
+        The number of seconds spent sending the request & downloading the
+        Response, not counting any wait for a rate limit, or :obj:`None` if
+        it was not downloaded
+    '''
+
+    def __init__(self, url, status, headers, body, complete=True,
+                 from_cache=False, latency=None):
+        '''A Response is initialized with the details of a finished request.'''
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.complete = complete
+        self.from_cache = from_cache
+        self.latency = latency
+
+    def get_charset(self):
+        '''Return the charset the body is encoded with, if it is declared.
+
+        The ``Content-Type`` header's charset is used if it has one,
+        otherwise the start of the body is searched for a ``<meta>`` tag
+        declaring the charset. Unknown charsets are ignored.
+
+        :returns: The name of the charset or :obj:`None`
+        :rtype: :obj:`str`
+        '''
+        charset = None
+        if self.headers is not None and hasattr(self.headers, 'get_param'):
+            charset = self.headers.get_param('charset')
+        if charset is None:
+            match = META_CHARSET_REGEX.search(
+                self.body[:CHARSET_SNIFF_BYTES])
+            if match is not None:
+                charset = match.group(1).decode('ascii')
+        if charset is None:
+            return None
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            return None
+
+    def get_text(self):
+        '''Return the body decoded to a string.
+
+        Bodies without a declared charset are decoded as UTF-8 if they are
+        valid UTF-8, and as ISO-8859-1 otherwise.
+
+        :rtype: :obj:`str`
+        '''
+        charset = self.get_charset()
+        if charset is not None:
+            return self.body.decode(charset, 'replace')
+        try:
+            return self.body.decode('utf8')
+        except UnicodeDecodeError:
+            return self.body.decode('iso-8859-1')
+
+
+class StopCondition(object):
+    '''A StopCondition decides when enough of a page has been downloaded.
+
+    The condition is met once the page is at least ``max_bytes`` long, once
+    any of the ``markers`` have been found, or once every one of the
+    ``patterns`` has matched. Patterns are only matched against complete
+    lines, so a match is not cut short by the end of the downloaded data.
+
+    A page being downloaded should be checked using a :class:`StopScan`
+    from :meth:`start_scan`, which only searches the data read since its
+    last check.
+    '''
+
+    def __init__(self, max_bytes=None, patterns=(), markers=()):
+        '''The Constructor sets the limits of the condition.
+
+        :param max_bytes: The number of bytes to stop after
+        :type max_bytes: int
+        :param patterns: Regular Expressions that must all match
+        :type patterns: :obj:`tuple`
+        :param markers: Text, any of which ends the page early
+        :type markers: :obj:`tuple`
+        :returns: :obj:`None`
+        '''
+        self.max_bytes = max_bytes
+        self.patterns = [re.compile(pattern.encode('utf8'), re.M)
+                         for pattern in patterns]
+        self.markers = [marker.encode('utf8') for marker in markers]
+        self.marker_overlap = max(
+            [len(marker) - 1 for marker in self.markers], default=0)
+
+    def is_active(self):
+        '''Return whether the condition could stop a download at all.'''
+        return bool(self.max_bytes is not None or self.patterns or
+                    self.markers)
+
+    def start_scan(self):
+        '''Return a StopScan for checking a single download.
+
+        :rtype: :class:`StopScan`
+        '''
+        return StopScan(self)
+
+    def is_met(self, body):
+        '''Return whether the whole ``body`` is enough.
+
+        :param body: The decompressed bytes of the page
+        :type body: bytes
+        :rtype: :obj:`bool`
+        '''
+        return self.start_scan().is_met(body)
+
+
+class StopScan(object):
+    '''A StopScan checks a download against a StopCondition as it grows.
+
+    Each check only searches the data read since the previous check, along
+    with enough of the data before it to find a marker split between the
+    two, and :data:`PATTERN_OVERLAP` bytes of lines for the patterns.
+    Patterns that have matched are not searched for again.
+    '''
+
+    def __init__(self, condition):
+        '''The Constructor starts a scan of an empty download.
+
+        :param condition: The condition to check
+        :type condition: :class:`StopCondition`
+        :returns: :obj:`None`
+        '''
+        self.condition = condition
+        self._scanned = 0
+        self._lines_scanned = 0
+        self._unmatched = list(condition.patterns)
+
+    def is_met(self, body):
+        '''Return whether the ``body`` downloaded so far is enough.
+
+        :param body: The decompressed bytes of the page, which must start
+                     with the body given to the previous check
+        :type body: bytes
+        :rtype: :obj:`bool`
+        '''
+        condition = self.condition
+        if (condition.max_bytes is not None and
+                len(body) >= condition.max_bytes):
+            return True
+        start = max(0, self._scanned - condition.marker_overlap)
+        self._scanned = len(body)
+        if any(body.find(marker, start) != -1
+               for marker in condition.markers):
+            return True
+        if not condition.patterns:
+            return False
+        lines_end = body.rfind(b'\n') + 1
+        start = max(0, self._lines_scanned - PATTERN_OVERLAP)
+        self._lines_scanned = lines_end
+        self._unmatched = [pattern for pattern in self._unmatched
+                           if pattern.search(body, start, lines_end) is None]
+        return not self._unmatched
+
+
+class ContentDecoder(object):
+    '''The ContentDecoder decompresses a response's body as it is read.
+
+    The decoder is chosen by the response's ``Content-Encoding`` header,
+    bodies with no or an unknown encoding are returned unchanged.
+    '''
+
+    def __init__(self, content_encoding=None):
+        '''The Constructor creates the decompressor for the encoding.
+
+        :param content_encoding: The value of the ``Content-Encoding`` header
+        :type content_encoding: str
+        :returns: :obj:`None`
+        '''
+        self.content_encoding = (content_encoding or '').strip().lower()
+        self._decompressor = None
+        self._is_first_chunk = True
+        if self.content_encoding in ('gzip', 'x-gzip'):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.content_encoding == 'deflate':
+            self._decompressor = zlib.decompressobj()
+        elif self.content_encoding == 'br' and brotli is not None:
+            self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data):
+        '''Return the decompressed bytes of the next chunk of the body.
+
+        Some servers send ``deflate`` bodies without the zlib header, so if
+        the first chunk is not valid zlib data it is decoded as a raw deflate
+        stream instead.
+        '''
+        if self._decompressor is None:
+            return data
+        if self.content_encoding == 'br':
+            return self._decompressor.process(data)
+        if self.content_encoding == 'deflate' and self._is_first_chunk:
+            self._is_first_chunk = False
+            try:
+                return self._decompressor.decompress(data)
+            except zlib.error:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        '''Return any decompressed bytes remaining at the end of the body.'''
+        if self._decompressor is None or self.content_encoding == 'br':
+            return b''
+        return self._decompressor.flush()
+
+
+class ConnectionPool(object):
+    '''The ConnectionPool holds the idle keep-alive connections to a host.
+
+    Connections are taken from the pool using :meth:`acquire` and should be
+    given back using :meth:`release` once their response has been read.
+    Connections that have been idle for longer than the pool's
+    ``idle_timeout`` are closed instead of being reused, and no more than
+    ``size`` idle connections are kept open.
+    '''
+
+    def __init__(self, scheme, netloc, size=None, idle_timeout=None):
+        '''The Constructor sets the host & limits of the pool.
+
+        :param scheme: The scheme of the host, ``http`` or ``https``
+        :type scheme: str
+        :param netloc: The host & optional port to connect to
+        :type netloc: str
+        :param size: The maximum number of idle connections to keep, defaults
+                     to :data:`~settings.CONNECTION_POOL_SIZE`
+        :type size: int
+        :param idle_timeout: The number of seconds a connection may be idle
+                             before it is closed, defaults to
+                             :data:`~settings.CONNECTION_IDLE_TIMEOUT`
+        :type idle_timeout: float
+        :returns: :obj:`None`
+        '''
+        if size is None:
+            size = settings.CONNECTION_POOL_SIZE
+        if idle_timeout is None:
+            idle_timeout = settings.CONNECTION_IDLE_TIMEOUT
+        self.scheme = scheme
+        self.netloc = netloc
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Return an idle connection, or a new one if none are available.
+
+        :returns: The connection and whether it has been used before
+        :rtype: :obj:`tuple`
+        '''
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                connection, released_at = self._idle.pop()
+                if now - released_at <= self.idle_timeout:
+                    return connection, True
+                connection.close()
+        return self.connect(), False
+
+    def release(self, connection):
+        '''Return the ``connection`` to the pool, closing it if it is full.'''
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    def close(self):
+        '''Close every idle connection in the pool.'''
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            connection.close()
+
+    def connect(self):
+        '''Open a new connection to the pool's host.'''
+        if self.scheme == 'https':
+            return client.HTTPSConnection(
+                self.netloc, context=ssl.create_default_context())
+        return client.HTTPConnection(self.netloc)
+
+
+class Session(object):
+    '''The Session sends requests over pooled keep-alive connections.
+
+    A Session holds one :class:`ConnectionPool` for every host it has
+    requested, along with a cookie jar that is shared by every request, as
+    some Sites(like :class:`~sites.seed_savers.SeedSavers`) require cookies to
+    be kept between requests. Redirects are followed automatically.
+
+    If the Session is given rate limiters, every request to a host first
+    takes a token from the host's :class:`~ratelimit.TokenBucket`.
+
+    The number of bytes received & the number of bytes they decompress to are
+    counted for each host in the run summary, along with the number of pages
+    whose download was stopped early and the number of requests delayed by
+    the host's rate limit.
+    '''
+
+    def __init__(self, pool_size=None, idle_timeout=None,
+                 rate_limiters=None):
+        '''The Constructor sets the limits used for each host's pool.
+
+        :param pool_size: The size of each host's :class:`ConnectionPool`
+        :type pool_size: int
+        :param idle_timeout: The idle timeout of each host's
+                             :class:`ConnectionPool`
+        :type idle_timeout: float
+        :param rate_limiters: A dictionary mapping hosts to the TokenBucket
+                              limiting their requests
+        :type rate_limiters: dict
+        :returns: :obj:`None`
+        '''
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.rate_limiters = rate_limiters or {}
+        self.cookie_jar = cookiejar.LWPCookieJar()
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get_pool(self, scheme, netloc):
+        '''Return the ConnectionPool for the host, creating it if necessary.
+
+        :returns: The host's ConnectionPool
+        :rtype: :class:`ConnectionPool`
+        '''
+        with self._lock:
+            key = (scheme, netloc)
+            if key not in self._pools:
+                self._pools[key] = ConnectionPool(
+                    scheme, netloc, self.pool_size, self.idle_timeout)
+            return self._pools[key]
+
+    def close(self):
+        '''Close the idle connections of every pool.'''
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+    def request(self, url, headers=None, stop=None, timeout=None,
+                deadline=None):
+        '''Send a GET request for the ``url``, following any redirects.
+
+        :param url: The URL to request
+        :type url: str
+        :param headers: The headers to send with the request
+        :type headers: dict
+        :param stop: When to stop downloading the page, if ever
+        :type stop: :class:`StopCondition`
+        :param timeout: The number of seconds to wait for the server at each
+                        step of the request, if limited
+        :type timeout: float
+        :param deadline: The time the request must be finished by, if any,
+                         which also limits the ``timeout`` & the wait for
+                         the host's rate limit
+        :type deadline: :class:`~resilience.Deadline`
+        :returns: The server's Response, whose latency includes any redirects
+        :rtype: :class:`Response`
+        :raises urllib.error.HTTPError: If the server responds with an error
+        :raises resilience.DeadlineExceededError: If the ``deadline`` passes
+                                                  before the request is sent
+        '''
+        if deadline is None:
+            deadline = Deadline()
+        latency = 0
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request_once(url, headers, stop, timeout,
+                                          deadline)
+            latency += response.latency
+            response.latency = latency
+            location = response.headers.get('Location')
+            if response.status not in REDIRECT_STATUSES or location is None:
+                break
+            url = urllib.parse.urljoin(url, location)
+        if response.status >= 400:
+            raise urllib.error.HTTPError(
+                url, response.status, client.responses.get(response.status),
+                response.headers, None)
+        return response
+
+    def _request_once(self, url, headers, stop, timeout, deadline):
+        '''Send a single GET request for the ``url`` over a pooled
+        connection.
+
+        A reused connection may have been closed by the server while it was
+        idle, in which case the request is sent again over a new connection.
+        The Response's latency is timed once the rate limit's token has been
+        taken. If the token would not be available before the ``deadline``,
+        or the ``deadline`` has passed by then, the request is not sent.
+        '''
+        parts = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(
+            ('', '', parts.path or '/', parts.query, ''))
+        request = urllib.request.Request(url, headers=headers or {})
+        request.add_header('Accept-Encoding', ACCEPT_ENCODING)
+        self.cookie_jar.add_cookie_header(request)
+        pool = self.get_pool(parts.scheme, parts.netloc)
+        site = stats.get_site(parts.netloc)
+
+        rate_limiter = self.rate_limiters.get(parts.netloc)
+        if rate_limiter is not None:
+            delay = rate_limiter.acquire(deadline.get_remaining())
+            if delay is None:
+                raise DeadlineExceededError(
+                    'No time left to wait for the rate limit of {}'.format(
+                        parts.netloc))
+            if delay > 0:
+                stats.increment('Rate Limited Requests', site=site)
+        if deadline.has_expired():
+            raise DeadlineExceededError(
+                'No time left to fetch {}'.format(url))
+        timeout = deadline.get_timeout(timeout)
+
+        started_at = time.monotonic()
+        connection, reused = pool.acquire()
+        _set_timeout(connection, timeout)
+        try:
+            try:
+                connection.request('GET', path,
+                                   headers=dict(request.header_items()))
+                http_response = connection.getresponse()
+            except (client.RemoteDisconnected, ConnectionError):
+                if not reused:
+                    raise
+                connection.close()
+                connection = pool.connect()
+                _set_timeout(connection, timeout)
+                connection.request('GET', path,
+                                   headers=dict(request.header_items()))
+                http_response = connection.getresponse()
+            body, complete = self._read_body(http_response, site, stop)
+        except Exception:
+            connection.close()
+            raise
+
+        self.cookie_jar.extract_cookies(http_response, request)
+        if http_response.will_close or not http_response.isclosed():
+            connection.close()
+        else:
+            pool.release(connection)
+        return Response(url, http_response.status, http_response.headers,
+                        body, complete,
+                        latency=time.monotonic() - started_at)
+
+    def _read_body(self, http_response, site, stop=None):
+        '''Read & decompress the body of the ``http_response`` in chunks.
+
+        If the ``stop`` condition is met before the end of the body, the rest
+        of the body is discarded if it is small, otherwise it is left unread
+        and the connection must be closed.
+
+        The ``Content-Encoding`` header is removed from the response's
+        headers, since the returned body is no longer encoded. The bytes read
+        are counted for the ``site``.
+
+        :returns: The body and whether the whole body was read
+        :rtype: :obj:`tuple`
+        '''
+        decoder = ContentDecoder(http_response.headers.get('Content-Encoding'))
+        del http_response.headers['Content-Encoding']
+        wire_bytes = 0
+        body = bytearray()
+        complete = True
+        scan = stop.start_scan() if stop is not None else None
+        while True:
+            data = http_response.read(READ_CHUNK_SIZE)
+            if not data:
+                body.extend(decoder.flush())
+                break
+            wire_bytes += len(data)
+            body.extend(decoder.decompress(data))
+            if scan is not None and scan.is_met(body):
+                complete = False
+                stats.increment('Pages Stopped Early', site=site)
+                remaining = http_response.length
+                if remaining is not None and remaining <= DRAIN_LIMIT:
+                    wire_bytes += len(http_response.read())
+                break
+
+        stats.increment('Bytes on Wire', wire_bytes, site=site)
+        stats.increment('Bytes Decompressed', len(body), site=site)
+        return bytes(body), complete
+
+
+class FetchEngine(object):
+    '''The FetchEngine limits and performs the requests of a single process.
+
+    Requests are scheduled as coroutines on the caller's event loop. A
+    request must acquire a slot from the global limit and from its host's
+    limit before it is sent, the blocking socket work is then handed to a
+    thread pool so the event loop can continue scheduling other requests.
+    An engine may be shared by threads that each run their own event loop.
+
+    Failed requests are retried without holding a slot while they wait.
+    '''
+
+    def __init__(self, concurrency=None, host_concurrency=None,
+                 session=None, page_cache=None, retry_policy=None,
+                 adaptive=None):
+        '''The Constructor sets the global & per-host concurrency limits.
+
+        :param concurrency: The maximum number of requests in flight,
+                            defaults to :data:`~settings.FETCH_CONCURRENCY`
+        :type concurrency: int
+        :param host_concurrency: The maximum number of requests in flight to
+                                 a single host, defaults to
+                                 :data:`~settings.FETCH_HOST_CONCURRENCY`
+        :type host_concurrency: int
+        :param session: The Session to send requests with, defaults to a new
+                        Session
+        :type session: :class:`Session`
+        :param page_cache: The cache to look pages up in, if any
+        :type page_cache: :class:`~cache.PageCache`
+        :param retry_policy: The policy for retrying failed requests,
+                             defaults to a new RetryPolicy
+        :type retry_policy: :class:`~resilience.RetryPolicy`
+        :param adaptive: Whether each host's limit adapts to its latency &
+                         errors, up to ``host_concurrency``, instead of being
+                         fixed at ``host_concurrency``, defaults to
+                         :data:`~settings.ADAPTIVE_CONCURRENCY`
+        :type adaptive: bool
+        :returns: :obj:`None`
+        '''
+        if concurrency is None:
+            concurrency = settings.FETCH_CONCURRENCY
+        if host_concurrency is None:
+            host_concurrency = settings.FETCH_HOST_CONCURRENCY
+        if adaptive is None:
+            adaptive = settings.ADAPTIVE_CONCURRENCY
+        self.concurrency = concurrency
+        self.host_concurrency = host_concurrency
+        self.adaptive = adaptive
+        self.session = session if session is not None else Session()
+        self.page_cache = page_cache
+        self.retry_policy = (retry_policy if retry_policy is not None else
+                             RetryPolicy())
+        self._limit = AdaptiveLimit(None, concurrency, concurrency,
+                                    concurrency)
+        self._host_limits = {}
+        self._circuit_breakers = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def get_host_limit(self, host):
+        '''Return the AdaptiveLimit for the ``host``, creating it if
+        necessary.
+
+        :rtype: :class:`~concurrency.AdaptiveLimit`
+        '''
+        with self._lock:
+            if host not in self._host_limits:
+                if self.adaptive:
+                    limit = AdaptiveLimit(host, maximum=self.host_concurrency)
+                else:
+                    limit = AdaptiveLimit(host, self.host_concurrency,
+                                          self.host_concurrency,
+                                          self.host_concurrency)
+                self._host_limits[host] = limit
+            return self._host_limits[host]
+
+    def get_circuit_breaker(self, host):
+        '''Return the CircuitBreaker for the ``host``, creating it if
+        necessary.
+
+        :rtype: :class:`~resilience.CircuitBreaker`
+        '''
+        with self._lock:
+            if host not in self._circuit_breakers:
+                self._circuit_breakers[host] = CircuitBreaker()
+            return self._circuit_breakers[host]
+
+    async def fetch(self, url, headers=None, kind=None, stop=None,
+                    deadline=None):
+        '''Request the ``url``, waiting for a free global & host slot first.
+
+        :param url: The URL to request
+        :type url: str
+        :param headers: Any headers to send along with the default headers
+        :type headers: dict
+        :param kind: The kind of page being requested,
+                     :data:`~cache.SEARCH_PAGE` or
+                     :data:`~cache.PRODUCT_PAGE`. Only pages with a ``kind``
+                     are cached.
+        :type kind: str
+        :param stop: When to stop downloading the page, if ever
+        :type stop: :class:`StopCondition`
+        :param deadline: The time the request must be finished by, if any
+        :type deadline: :class:`~resilience.Deadline`
+        :returns: The server's Response
+        :rtype: :class:`Response`
+        :raises resilience.CircuitOpenError: If the host's CircuitBreaker is
+                                             open
+        :raises resilience.FetchFailedError: If the request still failed
+                                             after retrying
+        :raises resilience.DeadlineExceededError: If the ``deadline`` passes
+                                                  before the request finishes
+        '''
+        if deadline is None:
+            deadline = Deadline()
+        host = urllib.parse.urlsplit(url).netloc
+        site = stats.get_site(host)
+        circuit_breaker = self.get_circuit_breaker(host)
+        attempt = 0
+        while True:
+            if deadline.has_expired():
+                stats.increment('Skipped by Deadline', site=site)
+                raise DeadlineExceededError(
+                    'No time left to fetch {}'.format(url))
+            if not circuit_breaker.allow():
+                stats.increment('Skipped by Circuit Breaker', site=site)
+                raise CircuitOpenError(
+                    'Too many requests to {} are failing'.format(host))
+            task = asyncio.ensure_future(
+                self._fetch_once(url, headers, kind, stop, deadline))
+            try:
+                done, _ = await asyncio.wait(
+                    (task,), timeout=deadline.get_remaining())
+            finally:
+                if not task.done():
+                    task.cancel()
+            if not done:
+                stats.increment('Skipped by Deadline', site=site)
+                raise DeadlineExceededError(
+                    'Ran out of time fetching {}'.format(url))
+            try:
+                response = task.result()
+            except DeadlineExceededError:
+                stats.increment('Skipped by Deadline', site=site)
+                raise
+            except Exception as error:
+                if not self.retry_policy.is_retryable(error):
+                    circuit_breaker.record_success()
+                    raise
+                if circuit_breaker.record_failure():
+                    stats.increment('Circuit Breaker Trips', site=site)
+                attempt += 1
+                if attempt >= self.retry_policy.attempts:
+                    raise FetchFailedError(
+                        'Could not fetch {}: {}'.format(url, error)
+                    ) from error
+                delay = self.retry_policy.get_delay(attempt - 1, error)
+                remaining = deadline.get_remaining()
+                if remaining is not None and delay >= remaining:
+                    stats.increment('Skipped by Deadline', site=site)
+                    raise DeadlineExceededError(
+                        'No time left to retry {}: {}'.format(url, error)
+                    ) from error
+                stats.increment('Retries', site=site)
+                await asyncio.sleep(delay)
+                continue
+            circuit_breaker.record_success()
+            return response
+
+    async def _fetch_once(self, url, headers, kind, stop, deadline):
+        '''Wait for a free global & host slot, then fetch the ``url`` in the
+        engine's thread pool.
+
+        The request's timeout is worked out once it has a slot, so the time
+        spent waiting counts against the ``deadline``. The latency of pages
+        that were downloaded & any retryable failure are reported to the
+        host's limit. Only the request itself is timed, see
+        :attr:`Response.latency`, so a host that is slowed down by its rate
+        limit, or by waiting for another worker's download, does not look
+        overloaded.
+        '''
+        host_limit = self.get_host_limit(urllib.parse.urlsplit(url).netloc)
+        await self._limit.acquire()
+        try:
+            await host_limit.acquire()
+            latency = None
+            failed = False
+            try:
+                timeout = deadline.get_timeout(settings.FETCH_TIMEOUT)
+                loop = asyncio.get_running_loop()
+                response = await loop.run_in_executor(
+                    self._executor, self._fetch_blocking, url, headers,
+                    kind, stop, timeout, deadline)
+                if not response.from_cache:
+                    latency = response.latency
+                return response
+            except Exception as error:
+                failed = self.retry_policy.is_retryable(error)
+                raise
+            finally:
+                host_limit.release(latency, failed)
+        finally:
+            self._limit.release()
+
+    def _fetch_blocking(self, url, headers, kind=None, stop=None,
+                        timeout=None, deadline=None):
+        '''Perform the request for ``url``, blocking until it is complete.
+
+        Fresh pages are returned straight from the cache, while stale pages
+        are revalidated with a conditional request. If another worker is
+        already fetching the page, its result is waited for and reused,
+        waiting no longer than the time left before the ``deadline``.
+        Cached pages that were stopped early are only used if they also meet
+        the ``stop`` condition.
+
+        This method is run in the engine's thread pool. The engine stops
+        waiting for it at the ``deadline``, so the ``deadline`` is passed on
+        to the Session, which then no longer sends the request.
+        '''
+        if deadline is None:
+            deadline = Deadline()
+        request_headers = {'User-Agent': 'Mozilla/5.0'}
+        request_headers.update(headers or {})
+        if self.page_cache is None or kind is None:
+            return self.session.request(url, request_headers, stop, timeout,
+                                        deadline)
+
+        started_at = time.time()
+        entry = self.page_cache.get(url)
+        if entry is not None and not entry.is_usable(stop):
+            entry = None
+        if entry is not None and self.page_cache.is_fresh(entry, kind):
+            stats.increment('Cache Hits')
+            return entry.to_response()
+
+        claimed = self.page_cache.claim(url)
+        if not claimed:
+            shared_entry = self.page_cache.wait_for(
+                url, started_at, deadline.get_remaining())
+            if shared_entry is not None and shared_entry.is_usable(stop):
+                stats.increment('Coalesced Requests')
+                return shared_entry.to_response()
+        try:
+            return self._fetch_and_store(url, request_headers, entry, stop,
+                                         timeout, deadline)
+        finally:
+            if claimed:
+                self.page_cache.release(url)
+
+    def _fetch_and_store(self, url, request_headers, entry, stop=None,
+                         timeout=None, deadline=None):
+        '''Request the ``url``, revalidating the cached ``entry`` if there is
+        one, and store the response in the cache.
+        '''
+        if entry is not None:
+            request_headers.update(entry.get_validators())
+
+        response = self.session.request(url, request_headers, stop, timeout,
+                                        deadline)
+        if entry is not None and response.status == 304:
+            self.page_cache.refresh(url)
+            stats.increment('Cache Revalidations')
+            return entry.to_response()
+        stats.increment('Cache Misses')
+        self.page_cache.store(url, response)
+        return response
+
+
+def _set_timeout(connection, timeout):
+    '''Set the timeout of the ``connection`` & its socket, if it is open.'''
+    connection.timeout = timeout
+    if connection.sock is not None:
+        connection.sock.settimeout(timeout)
+
+
+#: The event loop, Session, PageCache & FetchEngine of each thread that
+#: fetches pages.
+_state = threading.local()
+
+
+def create_engine(rate_limiters=None):
+    '''Return a new FetchEngine, with its own Session & cache connection,
+    for the threads of a :class:`ThreadPool
+    <multiprocessing.pool.ThreadPool>` to share.
+
+    :param rate_limiters: The rate limiters shared by every worker, see
+                          :func:`ratelimit.create_rate_limiters`
+    :type rate_limiters: dict
+    :rtype: :class:`FetchEngine`
+    '''
+    page_cache = cache.PageCache() if settings.CACHE_ENABLED else None
+    return FetchEngine(session=Session(rate_limiters=rate_limiters),
+                       page_cache=page_cache)
+
+
+def init_worker(rate_limiters=None, engine=None):
+    '''Set up the current thread's Session, connection pools & cache.
+
+    This should be used as the ``initializer`` of any :class:`Pool
+    <multiprocessing.pool.Pool>` whose workers fetch pages, so that each
+    worker process keeps its own keep-alive connections & cache connection.
+    The threads of a :class:`ThreadPool <multiprocessing.pool.ThreadPool>`
+    should be given an ``engine`` to share instead.
+
+    :param rate_limiters: The rate limiters shared by every worker, see
+                          :func:`ratelimit.create_rate_limiters`
+    :type rate_limiters: dict
+    :param engine: The FetchEngine shared by every thread, if any, see
+                   :func:`create_engine`
+    :type engine: :class:`FetchEngine`
+    '''
+    if engine is not None:
+        _state.session = engine.session
+        _state.page_cache = engine.page_cache
+        _state.engine = engine
+        return
+    _state.session = Session(rate_limiters=rate_limiters)
+    _state.page_cache = None
+    if settings.CACHE_ENABLED:
+        _state.page_cache = cache.PageCache()
+    _state.engine = None
+
+
+def get_session():
+    '''Return the current thread's Session, creating it if necessary.
+
+    :returns: The thread's Session
+    :rtype: :class:`Session`
+    '''
+    if getattr(_state, 'session', None) is None:
+        _state.session = Session()
+    return _state.session
+
+
+def get_page_cache():
+    '''Return the current thread's PageCache, opening it if necessary.
+
+    :returns: The thread's PageCache or :obj:`None` if
+              :data:`~settings.CACHE_ENABLED` is not set
+    :rtype: :class:`~cache.PageCache`
+    '''
+    page_cache = getattr(_state, 'page_cache', None)
+    if page_cache is None and settings.CACHE_ENABLED:
+        page_cache = _state.page_cache = cache.PageCache()
+    return page_cache
+
+
+def get_engine():
+    '''Return the current thread's FetchEngine, creating it if necessary.
+
+    :returns: The thread's FetchEngine
+    :rtype: :class:`FetchEngine`
+    '''
+    if getattr(_state, 'engine', None) is None:
+        _state.engine = FetchEngine(session=get_session(),
+                                    page_cache=get_page_cache())
+    return _state.engine
+
+
+def run(coroutine):
+    '''Run the ``coroutine`` on the thread's event loop until it completes.
+
+    :param coroutine: The coroutine to run
+    :returns: The coroutine's result
+    '''
+    if getattr(_state, 'loop', None) is None:
+        _state.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_state.loop)
+    return _state.loop.run_until_complete(coroutine)
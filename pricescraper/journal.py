@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+'''This module defines the journal of finished Tasks used to resume a run.
+
+As each :class:`~scheduler.Task` finishes, the main process appends its
+result to a :class:`Journal`, a file holding one JSON object per line. The
+file is flushed after every result, so if a run is interrupted, everything
+it finished is kept.
+
+A run started with the ``--resume`` option reads the previous run's journal
+using :func:`load_journal`, and only scrapes the Tasks it does not contain.
+Tasks that failed, because their Site was unavailable or the run's deadline
+passed, are not journalled so that they are tried again.
+'''
+import json
+
+
+class Journal(object):
+    '''The Journal appends the results of finished Tasks to a file.'''
+
+    def __init__(self, path, resume=False):
+        '''The Constructor opens the journal's file.
+
+        :param path: The path to the journal's file
+        :type path: str
+        :param resume: Whether to append to an existing journal, otherwise
+                       it is emptied
+        :type resume: bool
+        :returns: :obj:`None`
+        '''
+        self.path = path
+        self._file = open(path, 'a' if resume else 'w', encoding='utf8')
+        if resume and not _ends_with_newline(path):
+            self._file.write('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''Close the journal's file.'''
+        self._file.close()
+
+    def record(self, task):
+        '''Record the result of a finished Task, unless it failed or was
+        restored from an earlier result.
+
+        :param task: The finished Task
+        :type task: :class:`~scheduler.Task`
+        :returns: Whether the Task was recorded
+        :rtype: :obj:`bool`
+        '''
+        if not task.scraped or task.restored:
+            return False
+        self._file.write(json.dumps(
+            {'sku': task.sku, 'site': task.abbreviation,
+             'attributes': task.attributes}) + '\n')
+        self._file.flush()
+        return True
+
+
+def _ends_with_newline(path):
+    '''Return whether the file is empty or ends with a newline, a journal
+    that does not was cut off while writing its last line.
+    '''
+    with open(path, 'rb') as journal_file:
+        journal_file.seek(0, 2)
+        if journal_file.tell() == 0:
+            return True
+        journal_file.seek(-1, 2)
+        return journal_file.read(1) == b'\n'
+
+
+def load_journal(path):
+    '''Read the results recorded in a journal.
+
+    A partly written last line, left by a run that was killed while writing
+    it, is ignored.
+
+    :param path: The path to the journal's file
+    :type path: str
+    :returns: A dictionary mapping each ``(SKU, Site abbreviation)`` to the
+              attributes scraped for it, this is empty if there is no
+              journal
+    :rtype: :obj:`dict`
+    '''
+    results = {}
+    try:
+        journal_file = open(path, 'r', encoding='utf8')
+    except FileNotFoundError:
+        return results
+    with journal_file:
+        for line in journal_file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            results[(result['sku'], result['site'])] = result['attributes']
+    return results
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+'''This module remembers the Product Page each SKU was matched to.
+
+Once a SESE SKU has been matched to a competitor's Product, the match almost
+never changes. Every match found by a Site is recorded in a
+:class:`MatchStore`, and later runs fetch the stored Product Page directly
+instead of searching the Site again, see
+:meth:`~sites.base.BaseSite._fetch_stored_match`. A stored match is forgotten
+when its page is gone or no longer parses, and the Site is searched again.
+
+Searches that found no match are recorded too, so the Site is not searched
+for the SKU again until the not-found result is older than the Site's
+re-probe age, see :data:`~settings.NOT_FOUND_MAX_AGE`. Each SKU's re-probe
+age is shortened by a fixed amount of up to
+:data:`~settings.NOT_FOUND_REPROBE_SPREAD`, so the SKUs that were not found
+in the same run are re-probed over several runs instead of all at once.
+
+Matches that are known to be wrong can be overridden by pinning the right
+Product Page, or no Product at all, to the SKU. Pinned matches are never
+replaced by a search, they are read from a tab-delimited overrides file
+using the ``--override-matches`` option, see :func:`load_overrides`.
+'''
+import csv
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import settings
+
+
+#: The HTTP status codes which mean a stored Product Page no longer exists.
+GONE_STATUSES = (404, 410)
+
+
+class MatchStore(object):
+    '''The MatchStore holds the Product Page matched to each SKU & Site.
+
+    The store may be shared by the threads of a process.
+    '''
+
+    def __init__(self, path=None, not_found_max_ages=None,
+                 default_not_found_max_age=None, reprobe_spread=None):
+        '''The Constructor opens the store's database, creating it if
+        necessary.
+
+        :param path: The path to the database file, defaults to
+                     :data:`~settings.MATCHES_PATH`
+        :type path: str
+        :param not_found_max_ages: A dictionary mapping Site abbreviations to
+                                   the number of seconds a not-found result
+                                   is reused for, defaults to
+                                   :data:`~settings.SITE_NOT_FOUND_MAX_AGES`
+        :type not_found_max_ages: dict
+        :param default_not_found_max_age: The number of seconds the not-found
+                                          results of other Sites are reused
+                                          for, defaults to
+                                          :data:`~settings.NOT_FOUND_MAX_AGE`
+        :type default_not_found_max_age: float
+        :param reprobe_spread: The largest fraction of the maximum age each
+                               SKU's re-probe age is shortened by, defaults
+                               to :data:`~settings.NOT_FOUND_REPROBE_SPREAD`
+        :type reprobe_spread: float
+        :returns: :obj:`None`
+        '''
+        if path is None:
+            path = settings.MATCHES_PATH
+        if not_found_max_ages is None:
+            not_found_max_ages = settings.SITE_NOT_FOUND_MAX_AGES
+        if default_not_found_max_age is None:
+            default_not_found_max_age = settings.NOT_FOUND_MAX_AGE
+        if reprobe_spread is None:
+            reprobe_spread = settings.NOT_FOUND_REPROBE_SPREAD
+        self.path = path
+        self.not_found_max_ages = not_found_max_ages
+        self.default_not_found_max_age = default_not_found_max_age
+        self.reprobe_spread = reprobe_spread
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS matches ('
+            'sku TEXT, site TEXT, url TEXT, pinned INTEGER, '
+            'matched_at REAL, PRIMARY KEY (sku, site))')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''Close the store's database connection.'''
+        with self._lock:
+            self._connection.close()
+
+    def get_reprobe_age(self, sku, site):
+        '''Return the number of seconds the SKU's not-found result from the
+        Site is reused for.
+
+        :param sku: SESE's SKU for the Product
+        :type sku: str
+        :param site: The Site's abbreviation
+        :type site: str
+        :rtype: :obj:`float`
+        '''
+        max_age = self.not_found_max_ages.get(site,
+                                              self.default_not_found_max_age)
+        key = '{}\t{}'.format(sku, site).encode('utf8')
+        return max_age * (
+            1 - self.reprobe_spread * zlib.crc32(key) / 0xffffffff)
+
+    def get_match(self, sku, site):
+        '''Return the stored match for the SKU from the Site.
+
+        :param sku: SESE's SKU for the Product
+        :type sku: str
+        :param site: The Site's abbreviation
+        :type site: str
+        :returns: The ``(URL, Pinned)`` of the match, where the URL is
+                  :obj:`None` if the Site has no match, or :obj:`None` if no
+                  match is stored or the not-found result is due to be
+                  re-probed
+        :rtype: :obj:`tuple`
+        '''
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT url, pinned, matched_at FROM matches '
+                'WHERE sku = ? AND site = ?', (sku, site)).fetchone()
+        if row is None:
+            return None
+        url, pinned, matched_at = row
+        if (url is None and not pinned and time.time() - matched_at >
+                self.get_reprobe_age(sku, site)):
+            return None
+        return url, bool(pinned)
+
+    def record_match(self, sku, site, url):
+        '''Store the Product Page a search matched to the SKU, unless the
+        SKU's match is pinned.
+
+        :param sku: SESE's SKU for the Product
+        :type sku: str
+        :param site: The Site's abbreviation
+        :type site: str
+        :param url: The URL of the matching Product Page, or :obj:`None` if
+                    the search found no match
+        :type url: str
+        :returns: :obj:`None`
+        '''
+        with self._lock:
+            self._connection.execute(
+                'INSERT INTO matches VALUES (?, ?, ?, 0, ?) '
+                'ON CONFLICT (sku, site) DO UPDATE SET '
+                'url = excluded.url, matched_at = excluded.matched_at '
+                'WHERE pinned = 0', (sku, site, url, time.time()))
+
+    def record(self, task):
+        '''Store the match of a Task that shared another Task's search,
+        see :mod:`planning`, unless its SKU's match is pinned.
+
+        Tasks that made their own search stored their match while running,
+        see :meth:`~sites.base.BaseSite._store_match`, so the MatchStore can
+        be given every finished Task as one of a
+        :class:`~pipeline.Pipeline`'s recorders.
+
+        :param task: The finished Task
+        :type task: :class:`~scheduler.Task`
+        :returns: Whether the Task's match was stored
+        :rtype: :obj:`bool`
+        '''
+        if not task.shared or not task.match_recorded or task.sku is None:
+            return False
+        self.record_match(task.sku, task.abbreviation, task.match_url)
+        return True
+
+    def forget_match(self, sku, site):
+        '''Remove the SKU's match from the Site, unless it is pinned.
+
+        :param sku: SESE's SKU for the Product
+        :type sku: str
+        :param site: The Site's abbreviation
+        :type site: str
+        :returns: :obj:`None`
+        '''
+        with self._lock:
+            self._connection.execute(
+                'DELETE FROM matches WHERE sku = ? AND site = ? '
+                'AND pinned = 0', (sku, site))
+
+    def get_pinned_keys(self):
+        '''Return the SKU & Site of every pinned match.
+
+        :returns: A set of ``(SKU, Site abbreviation)`` tuples
+        :rtype: :obj:`set`
+        '''
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT sku, site FROM matches WHERE pinned = 1').fetchall()
+        return set(tuple(row) for row in rows)
+
+    def replace_overrides(self, overrides):
+        '''Replace every pinned match with the ``overrides``.
+
+        :param overrides: The ``(SKU, Site abbreviation, URL)`` of each
+                          pinned match, with a URL of :obj:`None` if the Site
+                          has no match for the SKU
+        :type overrides: list
+        :returns: :obj:`None`
+        '''
+        pinned_at = time.time()
+        rows = [(sku, site, url, pinned_at) for sku, site, url in overrides]
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._connection.execute(
+                    'DELETE FROM matches WHERE pinned = 1')
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO matches VALUES (?, ?, ?, 1, ?)',
+                    rows)
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+
+def load_pinned_keys():
+    '''Return the SKU & Site of every pinned match, if stored matches are
+    enabled.
+
+    :returns: A set of ``(SKU, Site abbreviation)`` tuples
+    :rtype: :obj:`set`
+    '''
+    if (not settings.MATCHES_ENABLED or
+            not os.path.exists(settings.MATCHES_PATH)):
+        return set()
+    with MatchStore() as match_store:
+        return match_store.get_pinned_keys()
+
+
+def load_overrides(filename):
+    '''Read the pinned matches from a tab-delimited overrides file.
+
+    The file should have a header line, then the SKU, Site abbreviation and
+    Product Page URL of each override. A blank URL pins the Site to have no
+    match for the SKU.
+
+    :param filename: The overrides file to read
+    :type filename: str
+    :returns: The ``(SKU, Site abbreviation, URL)`` of each override
+    :rtype: :obj:`list`
+    '''
+    with open(filename, 'r', encoding='utf8') as csvfile:
+        overrides_reader = csv.reader(csvfile, delimiter='\t')
+        next(overrides_reader, None)
+        return [(sku, site, url or None)
+                for sku, site, url in overrides_reader]
+
+
+_match_store = None
+
+
+def get_match_store():
+    '''Return the current process's MatchStore, opening it if necessary.
+
+    :returns: The store or :obj:`None` if stored matches are disabled by
+              :data:`~settings.MATCHES_ENABLED`
+    :rtype: :class:`MatchStore`
+    '''
+    global _match_store
+    if not settings.MATCHES_ENABLED:
+        return None
+    if _match_store is None:
+        _match_store = MatchStore()
+    return _match_store
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+'''This module scores how well Product names match SESE's names.
+
+A :class:`NameIndex` tokenises a list of candidate names once, and keeps an
+inverted index from each word to the candidates containing it. Scoring a
+SESE name then only visits the candidates that share a word with it, instead
+of comparing every word of every candidate. An index is built once for each
+Site's catalog snapshot, see :func:`catalog.get_catalog_index`, and used to
+both search & score the catalog. The few results of a search page are scored
+using :func:`score_names` instead.
+
+The score is the match percentage described by
+:meth:`~sites.base.BaseSite._prepend_name_match_amounts`. When the optional
+:mod:`numpy` package is installed, the scores are computed for every
+candidate at once, and :meth:`NameIndex.score_all` scores many SESE names
+against the candidates as a single matrix product. The scores are exactly
+the same with or without NumPy, names without any words score ``0``.
+
+``benchmark.py`` compares the index with the original implementation.
+'''
+import collections
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from util import remove_punctuation
+
+
+def tokenize(name):
+    '''Split a name into lowercase words without punctuation.
+
+    :param name: The name to split
+    :type name: str
+    :returns: The name's words, in order
+    :rtype: :obj:`list`
+    '''
+    return [remove_punctuation(word) for word in name.lower().split()]
+
+
+class NameIndex(object):
+    '''The NameIndex scores SESE names against a fixed list of names.
+
+    .. attribute:: names
+
+        The candidate names, in the order their scores are returned
+    '''
+
+    def __init__(self, names):
+        '''The Constructor tokenises the names & builds the inverted index.
+
+        :param names: The candidate names
+        :type names: list
+        :returns: :obj:`None`
+        '''
+        self.names = list(names)
+        self.lengths = []
+        self._postings = collections.defaultdict(list)
+        for position, name in enumerate(self.names):
+            words = tokenize(name)
+            self.lengths.append(len(words))
+            for word, count in collections.Counter(words).items():
+                self._postings[word].append((position, count))
+        self._positions = {
+            word: frozenset(position for position, _ in postings)
+            for word, postings in self._postings.items()}
+        self._matrix = None
+
+    def __len__(self):
+        '''Return the number of candidate names.'''
+        return len(self.names)
+
+    def find(self, words, match_all=True):
+        '''Return the positions of the candidates containing every one of
+        the ``words``, or any of them.
+
+        :param words: The words to look for
+        :type words: iterable
+        :param match_all: Whether a candidate must contain every word, if
+                          not it only needs to contain one
+        :type match_all: bool
+        :returns: The positions of the candidates, in order
+        :rtype: :obj:`list`
+        '''
+        found = [self._positions.get(word, frozenset())
+                 for word in set(words)]
+        if not found:
+            return list(range(len(self.names))) if match_all else []
+        if match_all:
+            return sorted(frozenset.intersection(*found))
+        return sorted(frozenset.union(*found))
+
+    def count_matches(self, sese_words, positions=None):
+        '''Count the words of each candidate that are in ``sese_words``.
+
+        :param sese_words: The SESE name's words, see :func:`tokenize`
+        :type sese_words: list
+        :param positions: The positions of the candidates to count, defaults
+                          to every candidate
+        :type positions: list
+        :returns: The number of matching words in each candidate
+        :rtype: :obj:`list`
+        '''
+        if positions is None:
+            positions = range(len(self.names))
+        matches = collections.Counter()
+        for word in set(sese_words):
+            for position, count in self._postings.get(word, ()):
+                matches[position] += count
+        return [matches[position] for position in positions]
+
+    def score(self, sese_words, positions=None):
+        '''Return the match percentage of each candidate.
+
+        :param sese_words: The SESE name's words, see :func:`tokenize`
+        :type sese_words: list
+        :param positions: The positions of the candidates to score, defaults
+                          to every candidate
+        :type positions: list
+        :returns: The score of each candidate, in order
+        :rtype: :obj:`list`
+        '''
+        if positions is None:
+            positions = range(len(self.names))
+        matches = self.count_matches(sese_words, positions)
+        lengths = [self.lengths[position] for position in positions]
+        if numpy is not None:
+            return _score_arrays(
+                numpy.array(matches, dtype=float), float(len(sese_words)),
+                numpy.array(lengths, dtype=float)).tolist()
+        return [_score(match, len(sese_words), length)
+                for match, length in zip(matches, lengths)]
+
+    def rank(self, sese_words, positions=None):
+        '''Return the candidates' positions, from the best match to the
+        worst, along with their scores.
+
+        Candidates with the same score are kept in order.
+
+        :param sese_words: The SESE name's words, see :func:`tokenize`
+        :type sese_words: list
+        :param positions: The positions of the candidates to rank, defaults
+                          to every candidate
+        :type positions: list
+        :returns: A list of ``(Score, Position)`` tuples
+        :rtype: :obj:`list`
+        '''
+        if positions is None:
+            positions = range(len(self.names))
+        return _rank(self.score(sese_words, positions), positions)
+
+    def score_all(self, sese_word_lists):
+        '''Return the score of every candidate for each SESE name.
+
+        With NumPy, the matching words of every pair are counted using a
+        single matrix product.
+
+        :param sese_word_lists: The words of each SESE name, see
+                                :func:`tokenize`
+        :type sese_word_lists: list
+        :returns: A row of scores for each SESE name, as a NumPy array, or a
+                  list of lists if NumPy is not installed
+        '''
+        if numpy is None:
+            return [self.score(sese_words) for sese_words in sese_word_lists]
+        columns, candidate_words = self._get_matrix()
+        queries = numpy.zeros((len(sese_word_lists), len(columns)))
+        for row, sese_words in enumerate(sese_word_lists):
+            for word in set(sese_words):
+                if word in columns:
+                    queries[row, columns[word]] = 1
+        sese_lengths = numpy.array(
+            [len(sese_words) for sese_words in sese_word_lists],
+            dtype=float)
+        return _score_arrays(queries.dot(candidate_words),
+                             sese_lengths[:, numpy.newaxis],
+                             numpy.array(self.lengths, dtype=float))
+
+    def _get_matrix(self):
+        '''Return the column of each word & the matrix of how many times
+        each word is in each candidate, building them if necessary.
+        '''
+        if self._matrix is None:
+            columns = {word: column
+                       for column, word in enumerate(self._postings)}
+            candidate_words = numpy.zeros((len(columns), len(self.names)))
+            for word, postings in self._postings.items():
+                for position, count in postings:
+                    candidate_words[columns[word], position] = count
+            self._matrix = (columns, candidate_words)
+        return self._matrix
+
+
+def score_names(sese_words, names):
+    '''Return the match percentage of each name, without building an index.
+
+    This is quicker than a :class:`NameIndex` for the few names of a single
+    search page.
+
+    :param sese_words: The SESE name's words, see :func:`tokenize`
+    :type sese_words: list
+    :param names: The names to score
+    :type names: list
+    :returns: The score of each name, in order
+    :rtype: :obj:`list`
+    '''
+    sese_word_set = set(sese_words)
+    scores = []
+    for name in names:
+        words = tokenize(name)
+        matches = sum(1 for word in words if word in sese_word_set)
+        scores.append(_score(matches, len(sese_words), len(words)))
+    return scores
+
+
+def rank_names(sese_words, names):
+    '''Return the names' positions, from the best match to the worst, along
+    with their scores, see :func:`score_names`.
+
+    :param sese_words: The SESE name's words, see :func:`tokenize`
+    :type sese_words: list
+    :param names: The names to rank
+    :type names: list
+    :returns: A list of ``(Score, Position)`` tuples
+    :rtype: :obj:`list`
+    '''
+    return _rank(score_names(sese_words, names), range(len(names)))
+
+
+def _rank(scores, positions):
+    '''Pair the scores with their positions, sorted from the best score to
+    the worst, keeping ties in order.
+    '''
+    ranks = list(zip(scores, positions))
+    ranks.sort(key=lambda rank: rank[0], reverse=True)
+    return ranks
+
+
+def _score(matches, sese_length, site_length):
+    '''Return the match percentage of a single candidate.'''
+    if not sese_length or not site_length:
+        return 0.0
+    percent_site_words_matched = (
+        float(matches) / site_length * 100)
+    site_to_sese_word_ratio = (
+        float(site_length) / sese_length)
+    percent_sese_words_matched = min(
+        float(matches) / sese_length * 100, 100)
+    sese_to_site_word_ratio = (
+        float(sese_length) / site_length)
+    return (
+        percent_site_words_matched * site_to_sese_word_ratio +
+        percent_sese_words_matched * sese_to_site_word_ratio
+    ) / 2
+
+
+def _score_arrays(matches, sese_lengths, site_lengths):
+    '''Return the match percentages of arrays of candidates, using the same
+    operations in the same order as :func:`_score`.
+    '''
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        percent_site_words_matched = matches / site_lengths * 100
+        site_to_sese_word_ratio = site_lengths / sese_lengths
+        percent_sese_words_matched = numpy.minimum(
+            matches / sese_lengths * 100, 100)
+        sese_to_site_word_ratio = sese_lengths / site_lengths
+        scores = (
+            percent_site_words_matched * site_to_sese_word_ratio +
+            percent_sese_words_matched * sese_to_site_word_ratio
+        ) / 2
+    no_words = numpy.logical_or(numpy.equal(site_lengths, 0),
+                                numpy.equal(sese_lengths, 0))
+    return numpy.where(no_words, 0.0, scores)
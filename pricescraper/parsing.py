@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+'''This module parses pages in a pool of processes for the hybrid executor.
+
+Scraping is mostly spent waiting on the network, with bursts of regular
+expression work when a page is parsed. With the hybrid executor, Tasks are
+run by a few threads of the main process, each with its own event loop, and
+the Sites hand their pages to a small pool of parse processes using
+:func:`run_parser`, so parsing neither blocks the event loops nor is held up
+by the GIL.
+
+The parse pool is started with :func:`start_parse_pool`. When no parse pool
+has been started, like in the worker processes of the default executor,
+Sites parse their pages themselves.
+'''
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+import settings
+
+
+_parse_pool = None
+
+
+def start_parse_pool(process_count=None):
+    '''Start the current process's pool of parse processes.
+
+    The processes are all started before this returns, so it should be
+    called before any threads that fetch pages are started.
+
+    :param process_count: The number of parse processes, defaults to
+                          :data:`~settings.PARSE_PROCESS_COUNT`
+    :type process_count: int
+    :returns: The parse pool
+    :rtype: :class:`~concurrent.futures.ProcessPoolExecutor`
+    '''
+    global _parse_pool
+    if process_count is None:
+        process_count = settings.PARSE_PROCESS_COUNT
+    _parse_pool = ProcessPoolExecutor(process_count)
+    futures = [_parse_pool.submit(int) for _ in range(process_count)]
+    for future in futures:
+        future.result()
+    return _parse_pool
+
+
+def shutdown_parse_pool():
+    '''Stop the current process's parse pool, if it has one.'''
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown()
+        _parse_pool = None
+
+
+def get_parse_pool():
+    '''Return the current process's parse pool.
+
+    :returns: The parse pool or :obj:`None` if one has not been started
+    :rtype: :class:`~concurrent.futures.ProcessPoolExecutor`
+    '''
+    return _parse_pool
+
+
+async def run_parser(function, *args):
+    '''Run the ``function`` in the parse pool without blocking the event
+    loop.
+
+    :param function: The function to run, it & its arguments must be
+                     picklable
+    :type function: function
+    :returns: The function's result
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_parse_pool, function, *args)
+
+
+def parse_search_page(site_class, search_page_html):
+    '''Return the URL & Name of each result on a Site's Search Results Page.
+
+    :param site_class: The Site's class
+    :type site_class: :class:`~sites.base.BaseSite`
+    :param search_page_html: The Search Results Page's HTML
+    :type search_page_html: str
+    :returns: A list containing each Product's URL and Name
+    :rtype: :obj:`list`
+    '''
+    site = site_class('', '', False)
+    return list(site._get_results_from_search_page(search_page_html))
+
+
+def parse_product_page(site_class, page_html):
+    '''Return the Product's attributes parsed from a Site's Product Page.
+
+    :param site_class: The Site's class
+    :type site_class: :class:`~sites.base.BaseSite`
+    :param page_html: The Product Page's HTML
+    :type page_html: str
+    :returns: The Product's attributes, see
+              :meth:`~sites.base.BaseSite.get_company_attributes`
+    :rtype: :obj:`dict`
+    '''
+    site = site_class('', '', False)
+    site.page_html = page_html
+    site._parse_and_set_attributes()
+    return site.get_company_attributes()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+'''This module streams Products through the worker processes.
+
+A :class:`Pipeline` reads Products from an iterator a chunk at a time,
+turning each chunk into batches of :class:`~scheduler.Task` objects for the
+worker processes, and yields each Product as soon as all of its Tasks have
+finished. Only :data:`~settings.CHUNKS_IN_FLIGHT` chunks are read ahead of
+the Products that have been yielded, so the memory used does not grow with
+the size of the input and the output can be written while the run is still
+going.
+
+When the output must be in the same order as the input, finished Products
+are held in a :class:`ReorderBuffer` until every Product before them has
+been yielded.
+
+A Pipeline can be given earlier results, from an interrupted run's
+:class:`~journal.Journal` or from the :class:`~results.ResultStore`. Tasks
+with an earlier result are restored instead of being scraped, they are still
+sent through the worker processes in a batch of their own, so that their
+Products are yielded in order with the rest. Every finished Task is given to
+the Pipeline's recorders, which keep the results of the Tasks that were
+scraped.
+
+A Pipeline can also be given a :class:`~planning.SearchPlanner`, in which
+case Tasks that make the same search as a Task being scraped are held back,
+and finished using its result.
+'''
+import collections
+import itertools
+import threading
+
+import scheduler
+import settings
+import stats
+
+
+class ReorderBuffer(object):
+    '''The ReorderBuffer puts items that finish out of order back in order.
+
+    Each item is added along with its position, and is held until every item
+    before it has been added.
+    '''
+
+    def __init__(self, start=0):
+        '''The Constructor creates an empty buffer.
+
+        :param start: The position of the first item
+        :type start: int
+        :returns: :obj:`None`
+        '''
+        self.next_index = start
+        self._pending = {}
+
+    def __len__(self):
+        '''Return the number of items being held.'''
+        return len(self._pending)
+
+    def add(self, index, item):
+        '''Add the ``item`` at position ``index`` to the buffer.
+
+        :param index: The position of the item
+        :type index: int
+        :param item: The item to add
+        :returns: The items that are now ready, in order
+        :rtype: :obj:`list`
+        '''
+        self._pending[index] = item
+        ready = []
+        while self.next_index in self._pending:
+            ready.append(self._pending.pop(self.next_index))
+            self.next_index += 1
+        return ready
+
+
+class Pipeline(object):
+    '''The Pipeline scrapes a stream of Products using a process pool.
+
+    .. attribute:: counts
+
+        The statistics collected by the worker processes, see
+        :func:`stats.merge`
+    '''
+
+    def __init__(self, product_objects, websites=None, chunk_size=None,
+                 chunks_in_flight=None, keep_order=True, recorders=(),
+                 previous_results=(), search_planner=None):
+        '''The Constructor sets the Products to scrape & the pipeline's limits.
+
+        :param product_objects: The Products to scrape, these are read
+                                lazily
+        :type product_objects: iterable
+        :param websites: The paths of the Sites' classes, defaults to
+                         :data:`~settings.COMPANIES_TO_PROCESS`
+        :type websites: list
+        :param chunk_size: The number of Products read at a time, defaults to
+                           :data:`~settings.PRODUCTS_PER_CHUNK`
+        :type chunk_size: int
+        :param chunks_in_flight: The number of chunks that may be read before
+                                 the first of them has been yielded, defaults
+                                 to :data:`~settings.CHUNKS_IN_FLIGHT`
+        :type chunks_in_flight: int
+        :param keep_order: Whether Products are yielded in their input order
+                           or as soon as they finish
+        :type keep_order: bool
+        :param recorders: The objects to record each finished Task with,
+                          like a :class:`~journal.Journal` or
+                          :class:`~results.ResultStore`
+        :type recorders: list
+        :param previous_results: The sources of earlier results, checked in
+                                 order. Each maps ``(SKU, Site
+                                 abbreviation)`` keys to attributes using a
+                                 ``get`` method, like the :obj:`dict`
+                                 returned by :func:`~journal.load_journal`
+                                 or a :class:`~results.ResultStore`.
+        :type previous_results: list
+        :param search_planner: The planner of the Tasks that share a search,
+                               if Tasks should share searches
+        :type search_planner: :class:`~planning.SearchPlanner`
+        :returns: :obj:`None`
+        '''
+        if chunk_size is None:
+            chunk_size = settings.PRODUCTS_PER_CHUNK
+        if chunks_in_flight is None:
+            chunks_in_flight = settings.CHUNKS_IN_FLIGHT
+        self.product_objects = product_objects
+        self.websites = websites
+        self.chunk_size = chunk_size
+        self.keep_order = keep_order
+        self.recorders = recorders
+        self.previous_results = previous_results
+        self.search_planner = search_planner
+        self.counts = collections.Counter()
+        self._slots = threading.BoundedSemaphore(chunks_in_flight)
+        self._reorder_buffer = ReorderBuffer()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def iter_batches(self, batch_size=None):
+        '''Read the Products a chunk at a time, yielding batches of Tasks.
+
+        Before each chunk is read, this waits until fewer than
+        ``chunks_in_flight`` chunks are unfinished. It is safe to consume
+        this from a different thread than the one consuming
+        :meth:`add_results`, like :meth:`Pool.imap_unordered
+        <multiprocessing.pool.Pool.imap_unordered>` does.
+
+        :param batch_size: The maximum number of Tasks in a batch, defaults
+                           to :data:`~settings.TASKS_PER_WORKER_BATCH`
+        :type batch_size: int
+        :returns: A generator of lists of Tasks
+        '''
+        if batch_size is None:
+            batch_size = settings.TASKS_PER_WORKER_BATCH
+        products = enumerate(self.product_objects)
+        while True:
+            self._slots.acquire()
+            chunk = list(itertools.islice(products, self.chunk_size))
+            if not chunk:
+                self._slots.release()
+                return
+            chunk_state = {'unfinished': len(chunk)}
+            tasks = []
+            restored_tasks = []
+            with self._lock:
+                for index, product in chunk:
+                    product_tasks = scheduler.create_tasks(
+                        [product], self.websites, start=index)
+                    self._in_flight[index] = [product, len(product_tasks),
+                                              chunk_state]
+                    for task in product_tasks:
+                        attributes = self._get_previous_result(task)
+                        if attributes is not None:
+                            task.restore(attributes)
+                            restored_tasks.append(task)
+                        else:
+                            tasks.append(task)
+                if self.search_planner is not None:
+                    tasks = self.search_planner.plan(tasks)
+            yield from scheduler.split_into_batches(tasks, batch_size)
+            if restored_tasks:
+                yield restored_tasks
+
+    def add_results(self, tasks):
+        '''Add a batch of finished Tasks to their Products.
+
+        :param tasks: The finished Tasks
+        :type tasks: list
+        :returns: The Products that are ready to be written
+        :rtype: :obj:`list`
+        '''
+        ready = []
+        with self._lock:
+            for task in tasks:
+                ready.extend(self._add_result(task))
+                if self.search_planner is None:
+                    continue
+                for shared_task in self.search_planner.finish(task):
+                    self.counts[('Shared Searches',
+                                 shared_task.abbreviation)] += 1
+                    ready.extend(self._add_result(shared_task))
+        return ready
+
+    def run(self, process_pool, process_tasks):
+        '''Scrape every Product, yielding each one once it is finished.
+
+        :param process_pool: The pool of worker processes
+        :type process_pool: :class:`~multiprocessing.pool.Pool`
+        :param process_tasks: The function the workers use to run a batch of
+                              Tasks, returning the finished Tasks and the
+                              statistics they collected
+        :type process_tasks: function
+        :returns: A generator of finished Products
+        '''
+        results = process_pool.imap_unordered(process_tasks,
+                                              self.iter_batches())
+        for tasks, batch_counts in results:
+            stats.merge(self.counts, batch_counts)
+            yield from self.add_results(tasks)
+
+    def _add_result(self, task):
+        '''Record a finished Task & add it to its Product, returning the
+        Products now ready. The lock must be held.
+        '''
+        for recorder in self.recorders:
+            recorder.record(task)
+        product_state = self._in_flight[task.index]
+        product_state[0].add_task_result(task)
+        product_state[1] -= 1
+        if product_state[1] == 0:
+            return self._finish_product(task.index)
+        return []
+
+    def _get_previous_result(self, task):
+        '''Return the earlier attributes for the Task, if there are any.'''
+        key = (task.sku, task.abbreviation)
+        for results in self.previous_results:
+            attributes = results.get(key)
+            if attributes is not None:
+                return attributes
+
+    def _finish_product(self, index):
+        '''Release a finished Product, returning the Products now ready.
+
+        A chunk's slot is released once every Product in it has been
+        returned. The lock must be held.
+        '''
+        if self.keep_order:
+            ready_indexes = self._reorder_buffer.add(index, index)
+        else:
+            ready_indexes = [index]
+        ready = []
+        for ready_index in ready_indexes:
+            product, _, chunk_state = self._in_flight.pop(ready_index)
+            ready.append(product)
+            chunk_state['unfinished'] -= 1
+            if chunk_state['unfinished'] == 0:
+                self._slots.release()
+        return ready
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+'''This module plans which Tasks share a single search.
+
+Different SKUs often search a Site for the same thing, like a variety sold
+in several packet sizes. Tasks whose Site, SESE name, category & organic
+status are the same once normalised, see :func:`get_search_key`, search for
+& match the same Product. A :class:`~pipeline.Pipeline` given a
+:class:`SearchPlanner` only sends the first of them to the workers, and
+copies its result to the rest once it has finished.
+
+The match found by the search is stored for the SKUs of the Tasks that
+shared it too, by giving the Pipeline a :class:`~matches.MatchStore` as one
+of its recorders.
+
+Only Tasks that are read while a Task with the same search is being scraped
+share its result, so the memory used does not grow with the size of the
+input. Products sharing a search are usually next to each other in the
+input, so this catches most of them.
+'''
+from util import remove_punctuation
+
+
+def normalise(text):
+    '''Return the text in lowercase, without punctuation or extra spaces.
+
+    :param text: The text to normalise
+    :type text: str
+    :rtype: :obj:`str`
+    '''
+    return ' '.join(remove_punctuation(text).lower().split())
+
+
+def get_search_key(task):
+    '''Return the key of the search the Task makes, Tasks with the same key
+    find the same match.
+
+    :param task: The Task to get the key of
+    :type task: :class:`~scheduler.Task`
+    :returns: The Task's Site, normalised SESE name & category, and organic
+              status
+    :rtype: :obj:`tuple`
+    '''
+    return (task.website, normalise(task.sese_name),
+            normalise(task.sese_category), task.sese_organic)
+
+
+class SearchPlanner(object):
+    '''The SearchPlanner holds back Tasks that make the same search as a
+    Task that is being scraped.
+
+    Tasks for a SKU with a pinned match, see :mod:`matches`, are always
+    scraped on their own, since the override only applies to their SKU.
+    '''
+
+    def __init__(self, pinned_keys=()):
+        '''The Constructor sets the Tasks that may not share a search.
+
+        :param pinned_keys: The ``(SKU, Site abbreviation)`` of each pinned
+                            match, see :func:`matches.load_pinned_keys`
+        :type pinned_keys: iterable
+        :returns: :obj:`None`
+        '''
+        self.pinned_keys = set(pinned_keys)
+        self._shared = {}
+
+    def plan(self, tasks):
+        '''Return the Tasks that need to be scraped, holding back the rest
+        until the Task making their search has finished.
+
+        :param tasks: The Tasks to plan
+        :type tasks: list
+        :returns: The Tasks to scrape, in order
+        :rtype: :obj:`list`
+        '''
+        planned = []
+        for task in tasks:
+            if self._is_pinned(task):
+                planned.append(task)
+                continue
+            search_key = get_search_key(task)
+            if search_key in self._shared:
+                self._shared[search_key].append(task)
+            else:
+                self._shared[search_key] = []
+                planned.append(task)
+        return planned
+
+    def finish(self, task):
+        '''Copy a scraped Task's result to the Tasks held back for it.
+
+        :param task: The finished Task
+        :type task: :class:`~scheduler.Task`
+        :returns: The Tasks that shared its search, now finished
+        :rtype: :obj:`list`
+        '''
+        if task.restored or self._is_pinned(task):
+            return []
+        shared_tasks = self._shared.pop(get_search_key(task), [])
+        for shared_task in shared_tasks:
+            shared_task.share_result(task)
+        return shared_tasks
+
+    def _is_pinned(self, task):
+        '''Return whether the Task's SKU has a pinned match on its Site.'''
+        return (task.sku, task.abbreviation) in self.pinned_keys
@@ -11,16 +11,47 @@ The Script will take these Products, search the sites using the Variety Name
 and Category, and create a Tab-delimited CSV containing each site's Packet
 Price, Packet Weight, Item Number, Item Name and Organic Status.
 
+Each site's results also have a status column, which is "ok" when a match
+was found, "not-found" when the site had no match, or "error" when the site
+could not be scraped.
+
+The Script's options, for resuming, sharding, queueing or retrying a run
+and for managing the stored catalogs & matches, are listed by ``--help``.
+Each is described in its module, like :mod:`sharding` or :mod:`matches`,
+and configured in :mod:`settings`.
+
 The Script uses best matches, not exact matches, so the data should be reviewed
 afterwards.
 
 '''
+import argparse
 import csv
+import functools
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import os
+import sys
+import time
 
+from affinity import SiteAffinityPool
+import catalog
+import fetch
+from journal import Journal, load_journal
+import matches
+import parsing
+from pipeline import Pipeline
+from planning import SearchPlanner
 from product import Product
+import ratelimit
+from resilience import Deadline
+from results import ResultStore
+import retry
+import scheduler
 import settings
+import sharding
+import stats
 from util import create_header_list
+import workqueue
 
 
 def load_input_file(filename):
@@ -30,24 +61,43 @@ def load_input_file(filename):
     Assumes the input file is seperated by commas and contains the product's
     SKU, Name, Variety Category and Organic Status(True or False)
 
-    Returns a list of the Product objects that were created.
+    Returns a generator of the Product objects, the file is read as the
+    Products are needed.
     '''
-    product_objects = list()
-
     with open(filename, 'r', encoding="utf8") as csvfile:
         input_reader = csv.reader(csvfile, delimiter='\t')
         input_reader.__next__()   # Skip the header line
         for row in input_reader:
-            product = Product(number=row[0], organic=row[1],
-                              name=row[2], category=row[3])
-            product_objects.append(product)
+            yield Product(number=row[0], organic=row[1],
+                          name=row[2], category=row[3])
 
-    return product_objects
+
+def process_tasks(tasks, deadline=None):
+    '''Concurrently run a batch of Tasks, each scraping a Product from a
+    Site.
+
+    Returns the list of finished Tasks, in the order they finished, along
+    with the statistics collected while running them.
+    '''
+    tasks = fetch.run(scheduler.TaskScheduler().run(tasks, deadline))
+    return tasks, stats.collect()
 
 
-def process_product(product):
-    '''Process all configured websites for a Product.'''
-    return product.process()
+def report_progress(product_objects, counts):
+    '''
+    Passes through the finished Products, printing the progress of the run
+    every :data:`~settings.PROGRESS_INTERVAL` seconds, and once all of the
+    Products have been finished.
+    '''
+    finished = 0
+    reported_at = time.monotonic()
+    for product in product_objects:
+        finished += 1
+        if time.monotonic() - reported_at >= settings.PROGRESS_INTERVAL:
+            stats.write_progress(sys.stderr, finished, counts)
+            reported_at = time.monotonic()
+        yield product
+    stats.write_progress(sys.stderr, finished, counts)
 
 
 def create_output_file(filename, product_objects):
@@ -56,6 +106,9 @@ def create_output_file(filename, product_objects):
     contains a Product's SKU, Name, Category, Organic Status and the Name,
     Number, Price and Weight of the related Product from each competitor's
     site.
+
+    The products may be a generator, each line is written as soon as its
+    Product is produced.
     '''
     with open(filename, 'w', encoding="utf8") as csvfile:
         outputwriter = csv.writer(csvfile, delimiter='\t')
@@ -66,16 +119,210 @@ def create_output_file(filename, product_objects):
             outputwriter.writerow(products_attributes)
 
 
+def create_worker_pool(executor, rate_limiters):
+    '''
+    Creates the pool that runs batches of Tasks using the ``executor``.
+
+    The ``processes`` executor returns a pool of worker processes. The
+    ``hybrid`` executor starts the parse pool, then returns a pool of threads
+    that fetch pages using a shared FetchEngine & hand them to the parse
+    pool, which should be stopped using :func:`parsing.shutdown_parse_pool`
+    once the run is finished, even if it failed. The ``affinity`` executor
+    returns a group of worker processes for each Site.
+    '''
+    if executor == 'hybrid':
+        parsing.start_parse_pool()
+        return ThreadPool(settings.FETCH_THREAD_COUNT,
+                          initializer=fetch.init_worker,
+                          initargs=(rate_limiters,
+                                    fetch.create_engine(rate_limiters)))
+    if executor == 'affinity':
+        return SiteAffinityPool(initializer=fetch.init_worker,
+                                initargs=(rate_limiters,))
+    return Pool(settings.WORKER_PROCESS_COUNT,
+                initializer=fetch.init_worker,
+                initargs=(rate_limiters,))
+
+
+def parse_arguments():
+    '''Parse the Script's command line options.'''
+    parser = argparse.ArgumentParser(
+        description='Scrape competitor prices for the Products in input.csv')
+    parser.add_argument(
+        '--time-limit', type=float, default=settings.RUN_TIME_LIMIT,
+        help='the number of seconds the run may take')
+    parser.add_argument(
+        '--executor', choices=('processes', 'hybrid', 'affinity'),
+        default=settings.EXECUTOR,
+        help='run Tasks in worker processes, fetch pages in threads & parse '
+             'them in a separate pool of processes, or run each Site\'s '
+             'Tasks in its own group of worker processes')
+    parser.add_argument(
+        '--unordered', action='store_true',
+        help='write each Product as soon as it is finished, instead of in '
+             'the order of the input file')
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='continue an interrupted run, only scraping the results '
+             'missing from its journal')
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='only scrape the results that are older than their Site\'s '
+             'maximum age, reusing the rest')
+    parser.add_argument(
+        '--retry-failed', action='store_true',
+        help='only scrape the results with an error status in the output '
+             'file, keeping the rest')
+    parser.add_argument(
+        '--shard', type=sharding.parse_shard, metavar='i/N',
+        help='only scrape shard i of N of the input file')
+    parser.add_argument(
+        '--merge', nargs='+', metavar='SHARD_OUTPUT',
+        help='combine the output files of every shard, in shard order, '
+             'instead of scraping')
+    parser.add_argument(
+        '--crawl-catalogs', action='store_true',
+        help='store a snapshot of each Site\'s catalog to match Products '
+             'against, instead of scraping')
+    parser.add_argument(
+        '--override-matches', metavar='OVERRIDES_FILE',
+        help='replace the pinned matches with the ones in the file, instead '
+             'of scraping')
+    parser.add_argument(
+        '--queue', default=settings.QUEUE_PATH, metavar='PATH',
+        help='the database holding the work queue')
+    queue_modes = parser.add_mutually_exclusive_group()
+    queue_modes.add_argument(
+        '--enqueue', action='store_true',
+        help='add every Task in the input file to the work queue')
+    queue_modes.add_argument(
+        '--work', action='store_true',
+        help='scrape Tasks from the work queue until it is empty')
+    queue_modes.add_argument(
+        '--collect', action='store_true',
+        help='write the results in the finished work queue to the output '
+             'file')
+    arguments = parser.parse_args()
+    if arguments.retry_failed:
+        output_filename = './output.csv'
+        if arguments.shard is not None:
+            output_filename = sharding.get_shard_filename(output_filename,
+                                                          *arguments.shard)
+        if not os.path.exists(output_filename):
+            parser.error('--retry-failed needs the output file of an earlier '
+                         'run, {} does not exist'.format(output_filename))
+    return arguments
+
+
 def main():
     '''
     Loads the input file and exports the Product object details
     '''
+    arguments = parse_arguments()
+    if arguments.merge:
+        skus = (product.sese_number
+                for product in load_input_file('./input.csv'))
+        sharding.merge_outputs(skus, arguments.merge, './output.csv')
+        return
+    if arguments.enqueue or arguments.work or arguments.collect:
+        run_work_queue(arguments)
+        return
+    if arguments.crawl_catalogs:
+        fetch.init_worker(ratelimit.create_rate_limiters())
+        with catalog.CatalogStore() as catalog_store:
+            fetch.run(catalog.crawl_catalogs(catalog_store))
+        stats.write_run_summary('./summary.txt', stats.collect())
+        return
+    if arguments.override_matches:
+        with matches.MatchStore() as match_store:
+            match_store.replace_overrides(
+                matches.load_overrides(arguments.override_matches))
+        return
+
+    output_filename = './output.csv'
+    summary_filename = './summary.txt'
+    journal_filename = settings.JOURNAL_PATH
     product_objects = load_input_file('./input.csv')
+    if arguments.shard is not None:
+        shard, shard_count = arguments.shard
+        output_filename, summary_filename, journal_filename = [
+            sharding.get_shard_filename(filename, shard, shard_count)
+            for filename in (output_filename, summary_filename,
+                             journal_filename)]
+        product_objects = sharding.select_shard(product_objects, shard,
+                                                shard_count)
+
+    deadline = Deadline.from_time_limit(arguments.time_limit)
+    previous_results = []
+    if arguments.retry_failed:
+        product_objects, output_results = retry.load_output_file(
+            output_filename)
+        previous_results.append(output_results)
+    if arguments.resume:
+        previous_results.append(load_journal(journal_filename))
+    journal = Journal(journal_filename, resume=arguments.resume)
+    result_store = ResultStore()
+    if arguments.incremental:
+        previous_results.append(result_store)
 
-    with Pool(settings.WORKER_PROCESS_COUNT) as process_pool:
-        product_objects = process_pool.map(process_product, product_objects)
+    recorders = [journal, result_store]
+    search_planner = match_store = None
+    if settings.SHARE_SEARCHES:
+        search_planner = SearchPlanner(matches.load_pinned_keys())
+        if settings.MATCHES_ENABLED:
+            match_store = matches.MatchStore()
+            recorders.append(match_store)
+
+    rate_limiters = ratelimit.create_rate_limiters()
+    try:
+        with journal, result_store:
+            product_pipeline = Pipeline(product_objects,
+                                        keep_order=not arguments.unordered,
+                                        recorders=recorders,
+                                        previous_results=previous_results,
+                                        search_planner=search_planner)
+            with create_worker_pool(arguments.executor,
+                                    rate_limiters) as process_pool:
+                finished_products = product_pipeline.run(
+                    process_pool,
+                    functools.partial(process_tasks, deadline=deadline))
+                create_output_file(
+                    output_filename,
+                    report_progress(finished_products,
+                                    product_pipeline.counts))
+    finally:
+        parsing.shutdown_parse_pool()
+        if match_store is not None:
+            match_store.close()
+
+    stats.write_run_summary(summary_filename, product_pipeline.counts)
+
+
+def run_work_queue(arguments):
+    '''
+    Adds the input file to the work queue, scrapes Tasks from it, or writes
+    its results to the output file, depending on the command line options.
+    '''
+    with workqueue.SQLiteWorkQueue(arguments.queue) as work_queue:
+        if arguments.enqueue:
+            work_queue.add(
+                scheduler.create_tasks(load_input_file('./input.csv')))
+        elif arguments.collect:
+            create_output_file('./output.csv',
+                               workqueue.iter_complete_products(work_queue))
+        else:
+            deadline = Deadline.from_time_limit(arguments.time_limit)
+            rate_limiters = ratelimit.create_rate_limiters()
+            try:
+                with create_worker_pool(arguments.executor,
+                                        rate_limiters) as process_pool:
+                    counts = workqueue.run_worker(
+                        work_queue, process_pool,
+                        functools.partial(process_tasks, deadline=deadline))
+            finally:
+                parsing.shutdown_parse_pool()
+            stats.write_run_summary('./summary.txt', counts)
 
-    create_output_file('./output.csv', product_objects)
 
 if __name__ == '__main__':
     main()
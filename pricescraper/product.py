@@ -4,7 +4,6 @@ The Product module holds the class that defines each of SESE's Products and the
 respective Products at Other Companies websites.
 '''
 import settings
-from util import get_class
 
 
 class Product(object):
@@ -60,6 +59,11 @@ class Product(object):
     .. attribute:: company_organic
 
         A company's organic status for their product
+
+    .. attribute:: company_status
+
+        Whether the company's product was found, not found, or could not be
+        scraped because of an error
     '''
 
     def __init__(self, number, name, category, organic):
@@ -115,13 +119,11 @@ class Product(object):
             company_attribute = attribute_abbrev + "_" + attribute
             setattr(self, company_attribute, attribute_dict[attribute])
 
-    def process(self):
-        '''Pull every website's data and return the completed Product.'''
-        for website in settings.COMPANIES_TO_PROCESS:
-            website = get_class(website)
-            website_product = website(
-                self.sese_name, self.sese_category, self.sese_organic)
-            website_product.get_and_set_product_information()
-            attributes = website_product.get_company_attributes()
-            self._add_companys_attributes(website.ABBREVIATION, attributes)
-        return self
+    def add_task_result(self, task):
+        '''Add the attributes scraped by a finished Task to the Product.
+
+        :param task: The finished Task
+        :type task: :class:`~scheduler.Task`
+        :returns: :obj:`None`
+        '''
+        self._add_companys_attributes(task.abbreviation, task.attributes)
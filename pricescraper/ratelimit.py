@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+'''This module defines the rate limits shared by every worker process.
+
+Each Site's host is given a :class:`TokenBucket`, allowing a steady rate of
+requests along with short bursts. The buckets keep their state in shared
+memory, so they should be created by the main process using
+:func:`create_rate_limiters` and handed to each worker process, where every
+request to the host takes a token from the same bucket.
+
+The rate & burst for each Site are set by the
+:data:`~settings.DEFAULT_RATE_LIMIT` & :data:`~settings.SITE_RATE_LIMITS`
+settings.
+'''
+import multiprocessing
+import time
+import urllib.parse
+
+import settings
+from util import get_class
+
+
+class TokenBucket(object):
+    '''The TokenBucket limits the rate of requests across processes.
+
+    The bucket holds up to ``burst`` tokens and is refilled at ``rate`` tokens
+    per second. Each request takes one token, waiting until a token is
+    available if the bucket is empty.
+    '''
+
+    def __init__(self, rate, burst):
+        '''The Constructor creates a full bucket in shared memory.
+
+        :param rate: The number of tokens added per second
+        :type rate: float
+        :param burst: The maximum number of tokens the bucket holds
+        :type burst: float
+        :returns: :obj:`None`
+        '''
+        self.rate = rate
+        self.burst = burst
+        self._state = multiprocessing.Array('d', [burst, time.time()])
+
+    def reserve(self, timeout=None):
+        '''Take a token from the bucket, returning how long to wait for it.
+
+        Tokens are taken immediately even if the bucket is empty, so that
+        requests are served in the order they reserved their tokens.
+
+        :param timeout: The longest wait for the token, or :obj:`None` to
+                        wait as long as necessary
+        :type timeout: float
+        :returns: The number of seconds until the token is available, or
+                  :obj:`None` if no token was taken because it would not be
+                  available within the ``timeout``
+        :rtype: :obj:`float`
+        '''
+        with self._state.get_lock():
+            tokens, updated_at = self._state[:]
+            now = time.time()
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            tokens -= 1
+            delay = max(0.0, -tokens / self.rate)
+            if timeout is not None and delay > timeout:
+                return None
+            self._state[:] = [tokens, now]
+        return delay
+
+    def acquire(self, timeout=None):
+        '''Take a token from the bucket, sleeping until it is available.
+
+        :param timeout: The longest wait for the token, or :obj:`None` to
+                        wait as long as necessary
+        :type timeout: float
+        :returns: The number of seconds spent waiting, or :obj:`None` if no
+                  token was taken because it would not be available within
+                  the ``timeout``
+        :rtype: :obj:`float`
+        '''
+        delay = self.reserve(timeout)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+def create_rate_limiters():
+    '''Create a TokenBucket for the host of every Site being processed.
+
+    :returns: A dictionary mapping each host to its TokenBucket
+    :rtype: :obj:`dict`
+    '''
+    rate_limiters = {}
+    for website in settings.COMPANIES_TO_PROCESS:
+        website = get_class(website)
+        host = urllib.parse.urlsplit(website.ROOT_URL).netloc
+        rate, burst = settings.SITE_RATE_LIMITS.get(
+            website.ABBREVIATION, settings.DEFAULT_RATE_LIMIT)
+        rate_limiters[host] = TokenBucket(rate, burst)
+    return rate_limiters
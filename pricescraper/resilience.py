@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+'''This module defines how failing requests are retried or skipped.
+
+A :class:`RetryPolicy` decides which failed requests should be retried and
+how long to wait before each retry, using jittered exponential backoff or
+the delay requested by a ``Retry-After`` header.
+
+A :class:`CircuitBreaker` watches the requests sent to a single Site. Once
+too many of them fail, the breaker opens and further requests to the Site
+fail immediately with a :class:`CircuitOpenError`, instead of each waiting
+for its own retries and timeouts. After a cooldown, a single request is
+allowed through to check whether the Site has recovered.
+
+A :class:`Deadline` bounds how long a run may take. It is passed down from
+:func:`price_scraper.main` to every fetch, which is given the remaining time
+as its timeout, and fetches started after the deadline fail immediately with
+a :class:`DeadlineExceededError`.
+'''
+from collections import deque
+import email.utils
+from http import client
+import random
+import threading
+import time
+import urllib.error
+
+import settings
+
+
+#: The HTTP status codes of responses that are worth retrying.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class FetchFailedError(Exception):
+    '''Raised when a page could not be fetched after retrying.'''
+
+
+class CircuitOpenError(FetchFailedError):
+    '''Raised instead of sending a request to a Site that is failing.'''
+
+
+class DeadlineExceededError(Exception):
+    '''Raised when a request cannot be made before the run's deadline.'''
+
+
+class Deadline(object):
+    '''The Deadline is the time by which the run must be finished.
+
+    A Deadline without an expiry time never expires. Expiry times are wall
+    clock times, so a Deadline can be passed to other processes.
+    '''
+
+    def __init__(self, expires_at=None):
+        '''The Constructor sets the expiry time of the Deadline.
+
+        :param expires_at: The time, in seconds since the epoch, the Deadline
+                           expires at or :obj:`None` if it never expires
+        :type expires_at: float
+        :returns: :obj:`None`
+        '''
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_time_limit(cls, seconds):
+        '''Return a Deadline expiring ``seconds`` from now.
+
+        :param seconds: The time limit or :obj:`None` for no limit
+        :type seconds: float
+        :rtype: :class:`Deadline`
+        '''
+        if seconds is None:
+            return cls()
+        return cls(time.time() + seconds)
+
+    def get_remaining(self):
+        '''Return the number of seconds left, or :obj:`None` if unlimited.'''
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    def has_expired(self):
+        '''Return whether the Deadline has passed.'''
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    def get_timeout(self, timeout=None):
+        '''Return the ``timeout`` shortened to the time left, if necessary.
+
+        :param timeout: The longest timeout to use, or :obj:`None` for no
+                        timeout
+        :type timeout: float
+        :rtype: :obj:`float`
+        '''
+        remaining = self.get_remaining()
+        if remaining is None:
+            return timeout
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+
+class RetryPolicy(object):
+    '''The RetryPolicy decides whether & when to retry a failed request.'''
+
+    def __init__(self, attempts=None, base_delay=None, max_delay=None):
+        '''The Constructor sets the number of attempts & the delay limits.
+
+        :param attempts: The maximum number of attempts for a request,
+                         defaults to :data:`~settings.RETRY_ATTEMPTS`
+        :type attempts: int
+        :param base_delay: The delay before the first retry, which doubles
+                           with each retry, defaults to
+                           :data:`~settings.RETRY_BASE_DELAY`
+        :type base_delay: float
+        :param max_delay: The longest delay before any retry, defaults to
+                          :data:`~settings.RETRY_MAX_DELAY`
+        :type max_delay: float
+        :returns: :obj:`None`
+        '''
+        if attempts is None:
+            attempts = settings.RETRY_ATTEMPTS
+        if base_delay is None:
+            base_delay = settings.RETRY_BASE_DELAY
+        if max_delay is None:
+            max_delay = settings.RETRY_MAX_DELAY
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_retryable(self, error):
+        '''Return whether the request that raised the ``error`` should be
+        retried.
+
+        Connection errors, timeouts and responses with a status in
+        :data:`RETRY_STATUSES` are retryable, other errors such as a ``404``
+        are not.
+        '''
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code in RETRY_STATUSES
+        return isinstance(error, (OSError, client.HTTPException))
+
+    def get_delay(self, attempt, error):
+        '''Return the number of seconds to wait before retrying.
+
+        If the server sent a ``Retry-After`` header, its delay is used.
+        Otherwise a random delay of up to ``base_delay * 2 ** attempt`` is
+        used, so that workers retrying at the same time spread out.
+
+        :param attempt: The number of the attempt that failed, from zero
+        :type attempt: int
+        :param error: The error raised by the failed attempt
+        :type error: :class:`Exception`
+        :rtype: :obj:`float`
+        '''
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    '''The CircuitBreaker stops requests to a Site that keeps failing.
+
+    The breaker remembers the outcome of the last ``window`` requests. Once
+    at least ``minimum_requests`` have been made and the rate of failures
+    reaches ``error_rate``, the breaker opens for ``cooldown`` seconds.
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, error_rate=None, window=None, minimum_requests=None,
+                 cooldown=None):
+        '''The Constructor creates a closed breaker.
+
+        The parameters default to the
+        :data:`~settings.CIRCUIT_BREAKER_ERROR_RATE`,
+        :data:`~settings.CIRCUIT_BREAKER_WINDOW`,
+        :data:`~settings.CIRCUIT_BREAKER_MINIMUM_REQUESTS` &
+        :data:`~settings.CIRCUIT_BREAKER_COOLDOWN` settings.
+        '''
+        if error_rate is None:
+            error_rate = settings.CIRCUIT_BREAKER_ERROR_RATE
+        if window is None:
+            window = settings.CIRCUIT_BREAKER_WINDOW
+        if minimum_requests is None:
+            minimum_requests = settings.CIRCUIT_BREAKER_MINIMUM_REQUESTS
+        if cooldown is None:
+            cooldown = settings.CIRCUIT_BREAKER_COOLDOWN
+        self.error_rate = error_rate
+        self.minimum_requests = minimum_requests
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        '''Return whether a request may be sent.
+
+        Once an open breaker's cooldown has passed, a single trial request is
+        allowed through.
+        '''
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN and
+                    time.monotonic() - self._opened_at >= self.cooldown):
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        '''Record a successful request, closing the breaker after a trial.'''
+        with self._lock:
+            self._outcomes.append(True)
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+
+    def record_failure(self):
+        '''Record a failed request, opening the breaker if too many requests
+        have failed.
+
+        :returns: Whether this failure opened the breaker
+        :rtype: :obj:`bool`
+        '''
+        with self._lock:
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            should_open = self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and
+                len(self._outcomes) >= self.minimum_requests and
+                failures / len(self._outcomes) >= self.error_rate)
+            if should_open:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+            return should_open
+
+
+def get_retry_after(error):
+    '''Return the delay requested by the ``error``'s ``Retry-After`` header.
+
+    :returns: The number of seconds to wait, or :obj:`None` if the error is
+              not a response with a valid ``Retry-After`` header
+    :rtype: :obj:`float`
+    '''
+    if not isinstance(error, urllib.error.HTTPError) or error.headers is None:
+        return None
+    retry_after = error.headers.get('Retry-After')
+    if retry_after is None:
+        return None
+    retry_after = retry_after.strip()
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+'''This module defines the store of every result scraped so far.
+
+The :class:`ResultStore` keeps the latest attributes scraped for each SKU
+from each Site in a SQLite database, along with the time they were scraped.
+Every run records its results in the store.
+
+Most competitors rarely change their prices, so a run started with the
+``--incremental`` option only scrapes the results that are older than their
+Site's maximum age, set by :data:`~settings.RESULT_MAX_AGE` &
+:data:`~settings.SITE_RESULT_MAX_AGES`. Every other result is taken from the
+store.
+'''
+import json
+import sqlite3
+import threading
+import time
+
+import settings
+
+
+class ResultStore(object):
+    '''The ResultStore holds the latest result for each SKU & Site.
+
+    The store may be shared by the threads of a process.
+    '''
+
+    def __init__(self, path=None, max_ages=None, default_max_age=None):
+        '''The Constructor opens the store's database, creating it if
+        necessary.
+
+        :param path: The path to the database file, defaults to
+                     :data:`~settings.RESULTS_PATH`
+        :type path: str
+        :param max_ages: A dictionary mapping Site abbreviations to the
+                         number of seconds their results may be reused for,
+                         defaults to :data:`~settings.SITE_RESULT_MAX_AGES`
+        :type max_ages: dict
+        :param default_max_age: The number of seconds the results of other
+                                Sites may be reused for, defaults to
+                                :data:`~settings.RESULT_MAX_AGE`
+        :type default_max_age: float
+        :returns: :obj:`None`
+        '''
+        if path is None:
+            path = settings.RESULTS_PATH
+        if max_ages is None:
+            max_ages = settings.SITE_RESULT_MAX_AGES
+        if default_max_age is None:
+            default_max_age = settings.RESULT_MAX_AGE
+        self.path = path
+        self.max_ages = max_ages
+        self.default_max_age = default_max_age
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'sku TEXT, site TEXT, attributes TEXT, scraped_at REAL, '
+            'PRIMARY KEY (sku, site))')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''Close the store's database connection.'''
+        with self._lock:
+            self._connection.close()
+
+    def get_max_age(self, site):
+        '''Return the number of seconds the ``site``'s results may be reused.
+
+        :param site: The Site's abbreviation
+        :type site: str
+        :rtype: :obj:`float`
+        '''
+        return self.max_ages.get(site, self.default_max_age)
+
+    def get(self, key):
+        '''Return the stored attributes for a SKU & Site, if they are recent
+        enough to reuse.
+
+        :param key: The ``(SKU, Site abbreviation)`` of the result
+        :type key: tuple
+        :returns: The attributes or :obj:`None` if there is no result
+                  younger than the Site's maximum age
+        :rtype: :obj:`dict`
+        '''
+        sku, site = key
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT attributes FROM results '
+                'WHERE sku = ? AND site = ? AND scraped_at >= ?',
+                (sku, site, time.time() - self.get_max_age(site))).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+    def record(self, task):
+        '''Store the result of a finished Task, unless it failed or was
+        restored from an earlier result.
+
+        :param task: The finished Task
+        :type task: :class:`~scheduler.Task`
+        :returns: Whether the Task was stored
+        :rtype: :obj:`bool`
+        '''
+        if not task.scraped or task.restored:
+            return False
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                (task.sku, task.abbreviation, json.dumps(task.attributes),
+                 time.time()))
+        return True
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+'''This module retries the failed Tasks of a finished run.
+
+Every Site's results in the output file have a status column, see
+:data:`~scheduler.ERROR`. A run started with the ``--retry-failed`` option
+reads the previous output file using :func:`load_output_file`, restores
+every result that was found or not found, and only scrapes the Tasks that
+failed, or are missing, before writing the output file again.
+'''
+import csv
+
+from product import Product
+import scheduler
+import settings
+from util import create_header_list
+
+
+def load_output_file(filename):
+    '''Read the Products & the results that did not fail from an output
+    file.
+
+    The whole file is read before this returns, so the output file can then
+    be written again.
+
+    :param filename: The output file to read
+    :type filename: str
+    :returns: The Products in the file, in order, and a dictionary mapping
+              each ``(SKU, Site abbreviation)`` without an error to its
+              attributes
+    :rtype: :obj:`tuple`
+    :raises ValueError: If the file was written with different columns than
+                        the current settings give
+    '''
+    product_objects = []
+    results = {}
+    with open(filename, 'r', encoding='utf8') as csvfile:
+        output_reader = csv.reader(csvfile, delimiter='\t')
+        if next(output_reader, None) != create_header_list():
+            raise ValueError(
+                'The columns of {} do not match the current settings'.format(
+                    filename))
+        sese_attributes = len(settings.SESE_HEADER_ORDER)
+        attribute_count = len(settings.ATTRIBUTE_HEADER_ORDER)
+        for row in output_reader:
+            sese = dict(zip(settings.SESE_HEADER_ORDER, row))
+            product_objects.append(Product(
+                number=sese['sese_number'], name=sese['sese_name'],
+                category=sese['sese_category'],
+                organic=sese['sese_organic']))
+            for position, company in enumerate(
+                    settings.COMPANY_HEADER_ORDER):
+                start = sese_attributes + position * attribute_count
+                attributes = dict(zip(
+                    settings.ATTRIBUTE_HEADER_ORDER,
+                    row[start:start + attribute_count]))
+                if attributes['status'] not in (scheduler.OK,
+                                                scheduler.NOT_FOUND):
+                    continue
+                results[(sese['sese_number'], company)] = attributes
+    return product_objects, results
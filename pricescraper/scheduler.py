@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+'''This module schedules the scraping of Products as separate Site tasks.
+
+Scraping a single Product from a single Site is a :class:`Task`. Each Site
+has its own queue of Tasks, so a Site that needs more requests per Product,
+like :class:`~sites.seed_savers.SeedSavers`, never holds up the Products of
+the faster Sites.
+
+The main process uses :func:`create_tasks` & :func:`split_into_batches` to
+hand out batches of Tasks to the worker processes, and each worker runs its
+batch using a :class:`TaskScheduler`. Finished Tasks are sent back to the
+main process and added to their Products using
+:meth:`~product.Product.add_task_result`.
+
+An error raised while running a Task is caught & recorded on the Task, so a
+bug in one Site's scraper never loses the results of any other Task. Each
+finished Task has a status of :data:`OK`, :data:`NOT_FOUND` or :data:`ERROR`,
+which is written to the output file.
+'''
+import asyncio
+import collections
+import itertools
+
+import settings
+import stats
+from util import get_class
+
+
+#: The status of a Task whose Site had a match for the Product.
+OK = 'ok'
+
+#: The status of a Task whose Site was searched without finding a match.
+NOT_FOUND = 'not-found'
+
+#: The status of a Task that failed, because its Site was unavailable, the
+#: run's deadline passed or its scraper raised an error.
+ERROR = 'error'
+
+
+class Task(object):
+    '''A Task scrapes one Product's details from one Site.
+
+    .. attribute:: index
+
+        The position of the Product in the input
+
+    .. attribute:: sku
+
+        SESE's SKU for the Product
+
+    .. attribute:: website
+
+        The path of the Site's class, as used in
+        :data:`~settings.COMPANIES_TO_PROCESS`
+
+    .. attribute:: abbreviation
+
+        The Site's abbreviation
+
+    .. attribute:: attributes
+
+        The Site's attributes for the Product, see
+        :meth:`~sites.base.BaseSite.get_company_attributes`. This is
+        :obj:`None` until the Task has been run.
+
+    .. attribute:: scraped
+
+        Whether the Site was successfully searched for the Product
+
+    .. attribute:: status
+
+        Whether the Task found a match, found no match or failed, see
+        :data:`OK`, :data:`NOT_FOUND` & :data:`ERROR`. This is :obj:`None`
+        until the Task has been run.
+
+    .. attribute:: error
+
+        A description of the error raised while running the Task, if any
+
+    .. attribute:: restored
+
+        Whether the Task's result was restored from a previous run instead of
+        being scraped
+
+    .. attribute:: shared
+
+        Whether the Task's result was copied from a Task that made the same
+        search, see :mod:`planning`
+
+    .. attribute:: match_recorded
+
+        Whether the Site's search recorded a match, or the lack of one, for
+        the Product, see :mod:`matches`
+
+    .. attribute:: match_url
+
+        The URL of the Product Page the search matched, or :obj:`None` if it
+        found no match or no match was recorded
+    '''
+
+    def __init__(self, index, product, website):
+        '''The Constructor copies the SESE attributes the Site searches for.
+
+        :param index: The position of the Product in the input
+        :type index: int
+        :param product: The Product to scrape
+        :type product: :class:`~product.Product`
+        :param website: The path of the Site's class
+        :type website: str
+        :returns: :obj:`None`
+        '''
+        self.index = index
+        self.sku = product.sese_number
+        self.sese_name = product.sese_name
+        self.sese_category = product.sese_category
+        self.sese_organic = product.sese_organic
+        self.website = website
+        self.abbreviation = get_class(website).ABBREVIATION
+        self.attributes = None
+        self.scraped = False
+        self.status = None
+        self.error = None
+        self.restored = False
+        self.shared = False
+        self.match_recorded = False
+        self.match_url = None
+
+    def restore(self, attributes):
+        '''Finish the Task using the ``attributes`` from a previous run.
+
+        :param attributes: The attributes scraped by the previous run
+        :type attributes: dict
+        :returns: :obj:`None`
+        '''
+        self.scraped = self.restored = True
+        self._set_attributes(attributes)
+
+    def share_result(self, task):
+        '''Finish the Task using the result of a Task that made the same
+        search, see :mod:`planning`.
+
+        :param task: The finished Task that made the search
+        :type task: :class:`Task`
+        :returns: :obj:`None`
+        '''
+        self.scraped = task.scraped
+        self.error = task.error
+        self.shared = True
+        self.match_recorded = task.match_recorded
+        self.match_url = task.match_url
+        self._set_attributes(task.attributes)
+
+    async def run(self, deadline=None):
+        '''Scrape the Product from the Site, setting the Task's attributes.
+
+        Restored Tasks are returned without being scraped again. If the
+        Site's scraper raises an error, the Task is given a status of
+        :data:`ERROR` and a name of "Error".
+
+        :param deadline: The time the Task must be finished by, if any
+        :type deadline: :class:`~resilience.Deadline`
+        :returns: The finished Task
+        :rtype: :class:`Task`
+        '''
+        if self.restored:
+            return self
+        try:
+            website = get_class(self.website)
+            website_product = website(self.sese_name, self.sese_category,
+                                      self.sese_organic, deadline,
+                                      sku=self.sku)
+            await website_product.get_and_set_product_information()
+        except Exception as error:
+            self.error = '{}: {}'.format(type(error).__name__, error)
+            stats.increment('Task Errors', site=self.abbreviation)
+            attributes = dict.fromkeys(settings.ATTRIBUTE_HEADER_ORDER)
+            attributes['name'] = 'Error'
+            self._set_attributes(attributes)
+            return self
+        self.scraped = website_product.scraped
+        self.match_recorded = website_product.match_recorded
+        self.match_url = website_product.match_url
+        self._set_attributes(website_product.get_company_attributes())
+        return self
+
+    def _set_attributes(self, attributes):
+        '''Set the Task's attributes & status, adding the status to the
+        attributes.
+
+        Attributes restored from before statuses were recorded are given one
+        based on their name.
+        '''
+        if not self.scraped:
+            self.status = ERROR
+        elif attributes.get('status') is not None:
+            self.status = attributes['status']
+        elif attributes['name'] == 'Not Found':
+            self.status = NOT_FOUND
+        else:
+            self.status = OK
+        self.attributes = dict(attributes, status=self.status)
+
+
+class TaskScheduler(object):
+    '''The TaskScheduler runs Tasks from a separate queue for each Site.
+
+    Each Site's queue is worked through by ``site_concurrency`` coroutines,
+    so every Site makes progress at its own pace.
+    '''
+
+    def __init__(self, site_concurrency=None):
+        '''The Constructor sets the number of Tasks run at once for a Site.
+
+        :param site_concurrency: The maximum number of a Site's Tasks to run
+                                 at once, defaults to
+                                 :data:`~settings.SITE_TASK_CONCURRENCY`
+        :type site_concurrency: int
+        :returns: :obj:`None`
+        '''
+        if site_concurrency is None:
+            site_concurrency = settings.SITE_TASK_CONCURRENCY
+        self.site_concurrency = site_concurrency
+
+    async def run(self, tasks, deadline=None):
+        '''Run every Task, returning them in the order they finished.
+
+        :param tasks: The Tasks to run
+        :type tasks: list
+        :param deadline: The time the Tasks must be finished by, if any
+        :type deadline: :class:`~resilience.Deadline`
+        :returns: The finished Tasks
+        :rtype: :obj:`list`
+        '''
+        queues = collections.OrderedDict()
+        for task in tasks:
+            queues.setdefault(task.website, collections.deque()).append(task)
+        finished = []
+
+        async def work_through(queue):
+            while queue:
+                task = queue.popleft()
+                finished.append(await task.run(deadline))
+
+        await asyncio.gather(*[
+            work_through(queue) for queue in queues.values()
+            for _ in range(min(self.site_concurrency, len(queue)))])
+        return finished
+
+
+def create_tasks(product_objects, websites=None, start=0):
+    '''Create a Task for every Product & Site.
+
+    :param product_objects: The Products to scrape
+    :type product_objects: list
+    :param websites: The paths of the Sites' classes, defaults to
+                     :data:`~settings.COMPANIES_TO_PROCESS`
+    :type websites: list
+    :param start: The position in the input of the first Product
+    :type start: int
+    :returns: The Tasks, grouped by Product
+    :rtype: :obj:`list`
+    '''
+    if websites is None:
+        websites = settings.COMPANIES_TO_PROCESS
+    return [Task(index, product, website)
+            for index, product in enumerate(product_objects, start)
+            for website in websites]
+
+
+def split_into_batches(tasks, batch_size):
+    '''Split the ``tasks`` into batches of at most ``batch_size`` Tasks.
+
+    Every batch holds the Tasks of a single Site, and the batches of each
+    Site are interleaved so that the worker processes scrape every Site at
+    once.
+
+    :param tasks: The Tasks to split
+    :type tasks: list
+    :param batch_size: The maximum number of Tasks in a batch
+    :type batch_size: int
+    :returns: The batches of Tasks
+    :rtype: :obj:`list`
+    '''
+    queues = collections.OrderedDict()
+    for task in tasks:
+        queues.setdefault(task.website, []).append(task)
+    site_batches = [
+        [queue[index:index + batch_size]
+         for index in range(0, len(queue), batch_size)]
+        for queue in queues.values()]
+    batches = []
+    for round_batches in itertools.zip_longest(*site_batches):
+        batches.extend(batch for batch in round_batches if batch is not None)
+    return batches
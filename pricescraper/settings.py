@@ -3,6 +3,237 @@
 #: The number of worker processes to create when processing Products.
 WORKER_PROCESS_COUNT = 8
 
+#: How batches of Tasks are run. The ``processes`` executor runs them in
+#: :data:`WORKER_PROCESS_COUNT` worker processes that both fetch & parse
+#: pages. The ``hybrid`` executor runs them in :data:`FETCH_THREAD_COUNT`
+#: threads that fetch pages, which hand the pages to
+#: :data:`PARSE_PROCESS_COUNT` processes for parsing. The ``affinity``
+#: executor gives each Site its own group of worker processes, sized by
+#: :data:`SITE_WORKER_COUNT` & :data:`SITE_WORKER_COUNTS`.
+EXECUTOR = 'processes'
+
+#: The number of threads fetching pages with the ``hybrid`` executor, each
+#: runs its own event loop, but they share the limits of one FetchEngine.
+FETCH_THREAD_COUNT = 16
+
+#: The number of processes parsing pages with the ``hybrid`` executor.
+PARSE_PROCESS_COUNT = 2
+
+#: The number of worker processes in each Site's group with the ``affinity``
+#: executor.
+SITE_WORKER_COUNT = 1
+
+#: The number of worker processes in specific Sites'(by abbreviation) groups
+#: with the ``affinity`` executor, overriding the :data:`SITE_WORKER_COUNT`.
+SITE_WORKER_COUNTS = {}
+
+#: The number of Tasks, each scraping one Product from one Site, handed to a
+#: worker process at a time. Every Task in a batch is for the same Site.
+TASKS_PER_WORKER_BATCH = 25
+
+#: The number of Tasks for a single Site each worker process runs at once.
+SITE_TASK_CONCURRENCY = 25
+
+#: The number of Products read from the input file at a time.
+PRODUCTS_PER_CHUNK = 100
+
+#: The journal each finished result is recorded in, so that an interrupted
+#: run can be continued with the ``--resume`` option.
+JOURNAL_PATH = './journal.jsonl'
+
+#: The database storing the latest result scraped for each SKU & Site.
+RESULTS_PATH = './results.sqlite3'
+
+#: The number of seconds a stored result is reused for by a run with the
+#: ``--incremental`` option, before it is scraped again.
+RESULT_MAX_AGE = 30 * 24 * 60 * 60
+
+#: The maximum age of each Site's stored results, keyed by the Site's
+#: abbreviation, for Sites that should not use :data:`RESULT_MAX_AGE`.
+SITE_RESULT_MAX_AGES = {}
+
+#: The number of chunks of Products that may be scraped at once. Reading the
+#: input waits once this many chunks have not yet been written out, which
+#: bounds the memory used by a run.
+CHUNKS_IN_FLIGHT = 4
+
+#: Whether or not Products that make the same search of a Site share a single
+#: search, instead of each searching the Site, see :mod:`planning`.
+SHARE_SEARCHES = True
+
+#: The database holding the work queue shared by every machine in a run
+#: started with the ``--enqueue``, ``--work`` & ``--collect`` options.
+QUEUE_PATH = './queue.sqlite3'
+
+#: The number of seconds a worker's lease on a batch of Tasks lasts without
+#: a heartbeat, after which the Tasks are handed to another worker.
+QUEUE_LEASE_TIMEOUT = 5 * 60
+
+#: The number of times a Task of the work queue is run before its error is
+#: kept as its result, Tasks that fail are left pending until then.
+QUEUE_MAX_ATTEMPTS = 3
+
+#: The number of leased batches of Tasks a machine may have unfinished.
+QUEUE_BATCHES_IN_FLIGHT = 2 * WORKER_PROCESS_COUNT
+
+#: The number of seconds a machine waits before checking the work queue
+#: again when every remaining Task is leased by another machine.
+QUEUE_POLL_INTERVAL = 5
+
+#: The maximum number of requests a worker process may have in flight.
+FETCH_CONCURRENCY = 200
+
+#: The maximum number of requests a worker process may have in flight to a
+#: single host.
+FETCH_HOST_CONCURRENCY = 25
+
+#: Whether each host's limit on requests in flight adapts to the host's
+#: latency & errors, between :data:`ADAPTIVE_MIN_CONCURRENCY` and
+#: :data:`FETCH_HOST_CONCURRENCY`. Otherwise the limit is always
+#: :data:`FETCH_HOST_CONCURRENCY`.
+ADAPTIVE_CONCURRENCY = True
+
+#: The limit on requests in flight each host starts with.
+ADAPTIVE_INITIAL_CONCURRENCY = 5
+
+#: The lowest a host's limit on requests in flight may be cut to.
+ADAPTIVE_MIN_CONCURRENCY = 1
+
+#: The number of finished requests to a host after which its limit is grown
+#: or cut.
+ADAPTIVE_WINDOW = 20
+
+#: How many times slower than the host's usual latency the 95th percentile
+#: latency of a window may be before the host's limit is cut.
+ADAPTIVE_LATENCY_TOLERANCE = 2.0
+
+#: The fraction of a window's requests that may fail before the host's limit
+#: is cut.
+ADAPTIVE_ERROR_RATE = 0.1
+
+#: The fraction of a host's limit that is kept when it is cut.
+ADAPTIVE_BACKOFF = 0.7
+
+#: The number of seconds between lines of progress output.
+PROGRESS_INTERVAL = 10
+
+#: The default rate limit for each Site, as a tuple of the number of requests
+#: per second and the number of requests that may be sent in a burst. The
+#: limit is shared by every worker process.
+DEFAULT_RATE_LIMIT = (5, 10)
+
+#: The rate limits of specific Sites(by abbreviation), overriding the
+#: :data:`DEFAULT_RATE_LIMIT`.
+SITE_RATE_LIMITS = {
+    'ss': (2, 4),
+}
+
+#: The maximum number of times a request is attempted before giving up.
+RETRY_ATTEMPTS = 4
+
+#: The longest delay before the first retry of a request, in seconds. The
+#: delay doubles for each later retry, and a random delay up to this limit is
+#: used so that retries from different workers are spread out.
+RETRY_BASE_DELAY = 1
+
+#: The longest delay before any retry, in seconds. This also limits the delay
+#: a Site can request using a ``Retry-After`` header.
+RETRY_MAX_DELAY = 60
+
+#: The fraction of recent requests to a Site that must fail before its
+#: circuit breaker opens and its remaining Products are skipped.
+CIRCUIT_BREAKER_ERROR_RATE = 0.5
+
+#: The number of recent requests the circuit breaker's error rate is
+#: calculated from.
+CIRCUIT_BREAKER_WINDOW = 20
+
+#: The minimum number of requests to a Site before its circuit breaker may
+#: open.
+CIRCUIT_BREAKER_MINIMUM_REQUESTS = 10
+
+#: The number of seconds an open circuit breaker waits before letting a
+#: request through to check whether the Site has recovered.
+CIRCUIT_BREAKER_COOLDOWN = 300
+
+#: The maximum number of idle keep-alive connections a worker process keeps
+#: open to a single host.
+CONNECTION_POOL_SIZE = 25
+
+#: The number of seconds a keep-alive connection may be idle before it is
+#: closed instead of reused.
+CONNECTION_IDLE_TIMEOUT = 30
+
+#: The number of seconds to wait for a Site to respond before a request
+#: times out.
+FETCH_TIMEOUT = 30
+
+#: The number of seconds a run may take before the remaining Products are
+#: given partial results, or :obj:`None` for no limit. This can be overridden
+#: with the ``--time-limit`` option.
+RUN_TIME_LIMIT = None
+
+#: Whether or not to store fetched pages in the on-disk page cache.
+CACHE_ENABLED = True
+
+#: The path to the page cache's database file.
+CACHE_PATH = './page_cache.sqlite3'
+
+#: The maximum total size of the pages in the page cache, in bytes. The least
+#: recently used pages are removed once the cache grows past this size.
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+#: The number of seconds a cached search page is used without revalidating
+#: it with the Site.
+CACHE_SEARCH_PAGE_TTL = 3 * 24 * 60 * 60
+
+#: The number of seconds a cached product page is used without revalidating
+#: it with the Site.
+CACHE_PRODUCT_PAGE_TTL = 24 * 60 * 60
+
+#: The maximum number of seconds a worker waits for another worker that is
+#: already fetching the same page, before fetching the page itself.
+CACHE_CLAIM_TIMEOUT = 120
+
+#: Whether or not to match Products against recent snapshots of the Sites'
+#: catalogs, instead of searching the Sites.
+CATALOG_ENABLED = True
+
+#: The path to the database holding the snapshots of the Sites' catalogs,
+#: which are crawled using the ``--crawl-catalogs`` option.
+CATALOG_PATH = './catalog.sqlite3'
+
+#: The number of seconds a snapshot of a Site's catalog is used for, after
+#: which the Site is searched again until its catalog is crawled again.
+CATALOG_MAX_AGE = 7 * 24 * 60 * 60
+
+#: The maximum number of pages crawled from a Site's catalog. A catalog that
+#: is still listing new Products after this many pages is not stored, since
+#: it may be incomplete.
+CATALOG_MAX_PAGES = 200
+
+#: Whether or not to fetch the Product Page each SKU was last matched to,
+#: instead of searching the Sites again.
+MATCHES_ENABLED = True
+
+#: The path to the database holding the Product Page matched to each SKU &
+#: Site, along with the overrides given using the ``--override-matches``
+#: option.
+MATCHES_PATH = './matches.sqlite3'
+
+#: The number of seconds a search that found no match is reused for, before
+#: the Site is searched for the SKU again.
+NOT_FOUND_MAX_AGE = 60 * 24 * 60 * 60
+
+#: The maximum age of each Site's not-found results, keyed by the Site's
+#: abbreviation, for Sites that should not use :data:`NOT_FOUND_MAX_AGE`.
+SITE_NOT_FOUND_MAX_AGES = {}
+
+#: The largest fraction of the maximum age a not-found result's re-probe age
+#: is shortened by. Each SKU is shortened by a fixed amount, so not-found
+#: results from the same run are re-probed over several runs.
+NOT_FOUND_REPROBE_SPREAD = 0.25
+
 #: The minimum percentage of words in common between SESE's and Other Company's
 #: Product names for them to be considered a match.
 MINIMUM_NAME_MATCHING_PERCENTAGE = 36
@@ -33,7 +264,7 @@ COMPANY_HEADER_ORDER = (
 
 #: The output order of each Other Company's attributes
 ATTRIBUTE_HEADER_ORDER = (
-    'price', 'weight', 'number', 'name', 'organic'
+    'price', 'weight', 'number', 'name', 'organic', 'status'
 )
 
 #: The output order of SESE attributes
@@ -51,5 +282,6 @@ ATTRIBUTES_TO_NAMES = {
     'number': "ID#",
     'weight': "Weight",
     'price': "Price",
-    'organic': "Organic"
+    'organic': "Organic",
+    'status': "Status"
 }
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+'''This module splits a run across several machines.
+
+A run started with the ``--shard i/N`` option only scrapes the Products
+whose SKU falls in shard ``i`` of ``N``, see :func:`get_shard`. SKUs are
+assigned using a stable hash, so every machine agrees on the shards without
+needing to talk to each other.
+
+Once every shard has finished, their output files are combined using
+:func:`merge_outputs`, which writes the rows in the same order as the input
+file.
+'''
+import argparse
+import csv
+import zlib
+
+import settings
+from util import create_header_list
+
+
+def parse_shard(text):
+    '''Parse a shard given as ``i/N``, numbered from 1.
+
+    This is used as the ``type`` of the ``--shard`` option.
+
+    :param text: The shard's number & the total number of shards
+    :type text: str
+    :returns: The shard's number & the number of shards
+    :rtype: :obj:`tuple`
+    :raises argparse.ArgumentTypeError: If the shard is not valid
+    '''
+    try:
+        shard, shard_count = [int(part) for part in text.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'shards should be given as i/N, like 1/4')
+    if not 1 <= shard <= shard_count:
+        raise argparse.ArgumentTypeError(
+            'the shard should be between 1 and {}'.format(shard_count))
+    return shard, shard_count
+
+
+def get_shard(sku, shard_count):
+    '''Return the shard the ``sku`` belongs to.
+
+    :param sku: SESE's SKU for a Product
+    :type sku: str
+    :param shard_count: The total number of shards
+    :type shard_count: int
+    :returns: The shard's number, from 1 to ``shard_count``
+    :rtype: :obj:`int`
+    '''
+    return zlib.crc32(sku.encode('utf8')) % shard_count + 1
+
+
+def select_shard(product_objects, shard, shard_count):
+    '''Yield the Products that belong to the ``shard``.
+
+    :param product_objects: Every Product in the input
+    :type product_objects: iterable
+    :param shard: The shard's number, from 1 to ``shard_count``
+    :type shard: int
+    :param shard_count: The total number of shards
+    :type shard_count: int
+    :returns: A generator of the shard's Products
+    '''
+    for product in product_objects:
+        if get_shard(product.sese_number, shard_count) == shard:
+            yield product
+
+
+def get_shard_filename(filename, shard, shard_count):
+    '''Return the name of the ``filename`` for a single shard.
+
+    For example, shard 1 of 4 of ``./output.csv`` is written to
+    ``./output-1-of-4.csv``.
+    '''
+    base, dot, extension = filename.rpartition('.')
+    return '{}-{}-of-{}{}{}'.format(base, shard, shard_count, dot,
+                                    extension)
+
+
+def merge_outputs(skus, shard_filenames, filename):
+    '''Combine the output files of every shard into a single output file.
+
+    Each shard's rows must be in input order, so the output is written a row
+    at a time by taking the next row of the shard each SKU belongs to.
+
+    :param skus: Every SKU in the input, in order
+    :type skus: iterable
+    :param shard_filenames: The output file of each shard, in shard order
+    :type shard_filenames: list
+    :param filename: The file to write the combined output to
+    :type filename: str
+    :raises ValueError: If a shard's output is missing a row or is not in
+                        input order
+    '''
+    shard_files = [open(shard_filename, 'r', encoding='utf8')
+                   for shard_filename in shard_filenames]
+    try:
+        readers = [csv.reader(shard_file, delimiter='\t')
+                   for shard_file in shard_files]
+        for reader in readers:
+            next(reader, None)   # Skip the header line
+        sku_column = settings.SESE_HEADER_ORDER.index('sese_number')
+        with open(filename, 'w', encoding='utf8') as csvfile:
+            outputwriter = csv.writer(csvfile, delimiter='\t')
+            outputwriter.writerow(create_header_list())
+            for sku in skus:
+                shard = get_shard(sku, len(readers))
+                row = next(readers[shard - 1], None)
+                if row is None or row[sku_column] != sku:
+                    raise ValueError(
+                        'The output of shard {} does not have SKU {} in '
+                        'input order'.format(shard, sku))
+                outputwriter.writerow(row)
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 '''This module defines the Abstract Class all new Websites should sub-class'''
 from abc import abstractmethod, ABCMeta
+import collections
 import re
+import urllib.error
 import urllib.parse
 
+from cache import PRODUCT_PAGE, SEARCH_PAGE
+import catalog
+from fetch import StopCondition
+import matches
+import matching
+import parsing
+from resilience import DeadlineExceededError, FetchFailedError
 import settings
-from util import remove_punctuation, get_page_html
+import stats
+from util import (fetch_page_html, get_escaped_forms, remove_punctuation,
+                  unescape)
 
 
 class BaseSite(object):
@@ -44,7 +55,42 @@ class BaseSite(object):
     #: instead of results with all of the search terms. Defaults to False.
     INCLUDE_CATEGORY_IN_SEARCH = False
 
-    def __init__(self, name, category, organic):
+    #: The maximum number of bytes to download from a Search Results Page,
+    #: the rest of the page is ignored. Search Results Pages are also only
+    #: downloaded until the :data:`NO_RESULT_TEXT` is found.
+    SEARCH_PAGE_BYTE_LIMIT = None
+
+    #: The maximum number of bytes to download from a Product Page, the rest
+    #: of the page is ignored.
+    PRODUCT_PAGE_BYTE_LIMIT = None
+
+    #: The URL of a page listing the Site's catalog, with a pair of braces for
+    #: inserting the page number using the .format() method. If set, the
+    #: whole catalog can be crawled once using :meth:`crawl_catalog`, and
+    #: Products are then matched against the stored catalog instead of
+    #: searching the Site, see :mod:`catalog`. Catalog pages are parsed
+    #: with :meth:`_get_results_from_search_page`.
+    CATALOG_URL = None
+
+    #: The number of the first page of the catalog.
+    CATALOG_FIRST_PAGE = 1
+
+    #: Regular Expressions that every field is parsed from. If set, a Product
+    #: Page is only downloaded until all of them have matched, so they should
+    #: cover everything the ``_parse`` methods search the page for.
+    PRODUCT_PAGE_PATTERNS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        '''Count the statistics of requests to the Site's host under its
+        abbreviation, see :func:`stats.get_site`.
+        '''
+        super().__init_subclass__(**kwargs)
+        abbreviation = getattr(cls, 'ABBREVIATION', None)
+        if cls.ROOT_URL is not None and abbreviation is not None:
+            stats.add_site_host(urllib.parse.urlsplit(cls.ROOT_URL).netloc,
+                                abbreviation)
+
+    def __init__(self, name, category, organic, deadline=None, sku=None):
         '''The Constructor sets the supplied variables as SESE's attributes.
 
         :param name: SESE's name for this Product
@@ -52,13 +98,22 @@ class BaseSite(object):
         :param category: SESE's category for this Product
         :type category: str
         :param organic: SESE's organic status for this Product
+        :param deadline: The time every page must be fetched by, if any
+        :type deadline: :class:`~resilience.Deadline`
+        :param sku: SESE's SKU for this Product, used to store its match
+        :type sku: str
         :returns: :obj:`None`
         '''
+        self.sku = sku
         self.sese_name = name
         self.sese_category = category
         self.sese_organic = organic
+        self.deadline = deadline
         self.name = self.number = self.organic = None
         self.price = self.weight = self.page_html = None
+        self.scraped = False
+        self.match_recorded = False
+        self.match_url = None
 
     def get_company_attributes(self):
         '''Return a dictionary containing this Company's Product attributes '''
@@ -68,18 +123,55 @@ class BaseSite(object):
                 'price': self.price,
                 'weight': self.weight}
 
-    def get_and_set_product_information(self):
-        '''Retrieve and set the Product's information from the website'''
-        self.page_html = self._find_product_page()
-        self._parse_and_set_attributes()
+    async def get_and_set_product_information(self):
+        '''Retrieve and set the Product's information from the website
+
+        If the website could not be reached, even after retrying, the
+        Product's name will be set to "Site Unavailable" and all other
+        attributes will be set to :obj:`None`. If the run's deadline passed
+        before the Product Page was fetched, the name will be set to
+        "Timed Out" instead.
+
+        The ``scraped`` attribute is set once the Site has been searched,
+        whether or not a match was found.
+        '''
+        try:
+            self.page_html = await self._get_product_page()
+        except FetchFailedError:
+            self.page_html = None
+            self._set_unavailable_attributes("Site Unavailable")
+            return
+        except DeadlineExceededError:
+            self.page_html = None
+            self._set_unavailable_attributes("Timed Out")
+            return
+        await self._parse_product_page()
+        self.scraped = True
+
+    async def _get_product_page(self):
+        '''Return the Product Page's HTML or :obj:`None` if there is no match.
+
+        Sites that need extra requests to reach the Product Page can override
+        this method.
+        '''
+        return await self._find_product_page()
 
-    def _find_product_page(self, use_organic=True):
+    async def _find_product_page(self, use_organic=True):
         '''Find the Product Page from the Company's website.
 
         Sometimes when there is only one result, a Site will return the
         result's details page instead of a search results page. A Site can set
         the :data:`SEARCH_REDIRECTED_TEXT` class attribute to handle this.
 
+        If a recent snapshot of the Site's catalog has been stored, it is
+        searched instead of the Site, see :meth:`_search_catalog`. If the
+        Product's match was stored by a previous run, its page is fetched
+        without searching at all, see :meth:`_fetch_stored_match`. A search
+        of the Site that finds no match is stored too, so the Site is not
+        searched again until the not-found result is due to be re-probed.
+        Products missing from a catalog snapshot are not stored, since the
+        snapshot may be out of date.
+
         :param use_organic: Whether or not to check for a non-organic version
                             of the product.
         :type use_organic: bool
@@ -87,22 +179,38 @@ class BaseSite(object):
         :rtype: :obj:`str`
 
         '''
+        if use_organic:
+            is_stored, page_html = await self._fetch_stored_match()
+            if is_stored:
+                return page_html
         search_terms = remove_punctuation(self.sese_name)
         if use_organic and self.sese_organic:
             search_terms += " organic"
         if self.INCLUDE_CATEGORY_IN_SEARCH:
             search_terms += ' ' + remove_punctuation(self.sese_category)
-        search_page = self._search_site(search_terms)
-
-        if self.SEARCH_REDIRECTED_TEXT is not None:
-            if self.SEARCH_REDIRECTED_TEXT in search_page:
-                return search_page
-
-        match = self._get_best_match_or_none(search_page)
+        catalog_entries = catalog.get_catalog(self.ABBREVIATION)
+        if catalog_entries is not None:
+            stats.increment('Catalog Searches', site=self.ABBREVIATION)
+            catalog_index = catalog.get_catalog_index(self.ABBREVIATION)
+            positions = self._search_catalog(catalog_index, search_terms)
+            match = await self._fetch_best_match_or_none(
+                [catalog_entries[position] for position in positions],
+                catalog_index, positions)
+        else:
+            search_page = await self._search_site(search_terms)
+
+            if self.SEARCH_REDIRECTED_TEXT is not None:
+                if self.SEARCH_REDIRECTED_TEXT in search_page:
+                    return search_page
+
+            match = await self._get_best_match_or_none(search_page)
         check_without_organic = (
             self.sese_organic and match is None and use_organic)
-        return (match if not check_without_organic else
-                self._find_product_page(use_organic=False))
+        if check_without_organic:
+            return await self._find_product_page(use_organic=False)
+        if match is None and catalog_entries is None:
+            self._store_match(None)
+        return match
 
     def _parse_and_set_attributes(self):
         '''Parse the Product Page to find and set the Products's attributes
@@ -121,7 +229,38 @@ class BaseSite(object):
         self.price = self._parse_price_from_product_page()
         self.weight = self._parse_weight_from_product_page()
 
-    def _search_site(self, search_terms):
+    async def _parse_product_page(self):
+        '''Parse & set the Product's attributes, using the parse pool if
+        one has been started.
+
+        See :mod:`parsing` & :meth:`_parse_and_set_attributes`.
+        '''
+        if parsing.get_parse_pool() is None or self.page_html is None:
+            self._parse_and_set_attributes()
+            return
+        attributes = await parsing.run_parser(
+            parsing.parse_product_page, type(self), self.page_html)
+        for attribute, value in attributes.items():
+            setattr(self, attribute, value)
+
+    async def _parse_search_page(self, search_page_html):
+        '''Return the URL & Name of each search result, using the parse pool
+        if one has been started.
+
+        See :mod:`parsing` & :meth:`_get_results_from_search_page`.
+        '''
+        if parsing.get_parse_pool() is None:
+            return self._get_results_from_search_page(search_page_html)
+        return await parsing.run_parser(
+            parsing.parse_search_page, type(self), search_page_html)
+
+    def _set_unavailable_attributes(self, reason):
+        '''Mark the Product as not scraped, using the ``reason`` as its name.
+        '''
+        self.name = reason
+        self.number = self.organic = self.price = self.weight = None
+
+    async def _search_site(self, search_terms):
         '''Return the HTML from searching SEARCH_URL using ``search_terms``.
 
         Requires the class to have a SEARCH_URL attribute.
@@ -134,9 +273,77 @@ class BaseSite(object):
         assert self.SEARCH_URL is not None
         escaped_keywords = urllib.parse.quote(search_terms)
         search_url = self.SEARCH_URL.format(escaped_keywords)
-        return get_page_html(search_url)
+        return await fetch_page_html(
+            search_url, SEARCH_PAGE, self._get_stop_condition(SEARCH_PAGE),
+            self.deadline)
+
+    async def _fetch_stored_match(self):
+        '''Fetch the Product Page of the Product's stored match, if any.
+
+        A Site that had no match for the Product is not fetched at all, until
+        the not-found result is due to be re-probed. A match that is not
+        pinned is forgotten when its page is gone or no longer has a name, so
+        that the Site is searched again. See :mod:`matches`.
+
+        :returns: Whether a usable match was stored, and its Product Page's
+                  HTML, which is :obj:`None` when the Site has no match
+        :rtype: :obj:`tuple`
+        '''
+        match_store = matches.get_match_store()
+        if match_store is None or self.sku is None:
+            return False, None
+        match = match_store.get_match(self.sku, self.ABBREVIATION)
+        if match is None:
+            return False, None
+        match_url = match[0]
+        if match_url is None:
+            stats.increment('Stored Not Found', site=self.ABBREVIATION)
+            return True, None
+        try:
+            self.page_html = await fetch_page_html(
+                match_url, PRODUCT_PAGE,
+                self._get_stop_condition(PRODUCT_PAGE), self.deadline)
+        except urllib.error.HTTPError as error:
+            if error.code not in matches.GONE_STATUSES:
+                raise
+            self.page_html = None
+        if (self.page_html is not None and
+                self._parse_name_from_product_page()):
+            stats.increment('Stored Matches', site=self.ABBREVIATION)
+            return True, self.page_html
+        stats.increment('Stale Matches', site=self.ABBREVIATION)
+        match_store.forget_match(self.sku, self.ABBREVIATION)
+        return False, None
+
+    async def _fetch_match(self, page_url):
+        '''Fetch a matching Product Page, storing it as the Product's match.
+
+        :param page_url: The URL of the Product Page
+        :type page_url: str
+        :returns: The Product Page's HTML
+        :rtype: :obj:`str`
+        '''
+        page_html = await fetch_page_html(
+            page_url, PRODUCT_PAGE, self._get_stop_condition(PRODUCT_PAGE),
+            self.deadline)
+        self._store_match(page_url)
+        return page_html
+
+    def _store_match(self, page_url):
+        '''Store the Product Page a search matched, or :obj:`None` if the
+        search found no match, unless the Product has no SKU.
+
+        The match is also kept in the ``match_url`` attribute, so that it can
+        be stored for the Products that share the search, see
+        :meth:`matches.MatchStore.record`.
+        '''
+        self.match_recorded = True
+        self.match_url = page_url
+        match_store = matches.get_match_store()
+        if match_store is not None and self.sku is not None:
+            match_store.record_match(self.sku, self.ABBREVIATION, page_url)
 
-    def _get_best_match_or_none(self, search_page_html):
+    async def _get_best_match_or_none(self, search_page_html):
         '''Attempt to find the best match on the Search Results HTML.
 
         The method will first attempt to find a Product that contains the name
@@ -153,28 +360,133 @@ class BaseSite(object):
                   match is found
         :rtype: :obj:`str`
         '''
-        products = self._get_results_from_search_page(search_page_html)
-        has_no_results = len(products) == 0 or (
-            self.NO_RESULT_TEXT is not None and
-            self.NO_RESULT_TEXT in search_page_html
-        )
-        if has_no_results:
+        products = [(unescape(url), unescape(name)) for url, name in
+                    await self._parse_search_page(search_page_html)]
+        if self._is_no_result_page(search_page_html):
+            return None
+        return await self._fetch_best_match_or_none(products)
+
+    def _is_no_result_page(self, search_page_html):
+        '''Return whether the Search Results Page contains the
+        :data:`NO_RESULT_TEXT`, in any of its escaped forms.
+
+        :param search_page_html: The Search Results Page's HTML
+        :type search_page_html: str
+        :rtype: :obj:`bool`
+        '''
+        if self.NO_RESULT_TEXT is None:
+            return False
+        return any(form in search_page_html
+                   for form in get_escaped_forms(self.NO_RESULT_TEXT))
+
+    async def _fetch_best_match_or_none(self, products, name_index=None,
+                                        positions=None):
+        '''Fetch the Product Page of the best match in a list of Products.
+
+        See :meth:`_get_best_match_or_none` for how the best match is picked.
+
+        :param products: The ``(URL, Name)`` of each search result
+        :type products: list
+        :param name_index: The index the ``products`` were found in, if any,
+                           see :meth:`_prepend_name_match_amounts`
+        :type name_index: :class:`~matching.NameIndex`
+        :param positions: The position of each Product in the ``name_index``
+        :type positions: list
+        :returns: Product Page HTML of the best match or :obj:`None` if no good
+                  match is found
+        :rtype: :obj:`str`
+        '''
+        if len(products) == 0:
             return None
 
+        clean_sese_name = remove_punctuation(self.sese_name).lower()
         for product in products:
             relative_url, product_name = product
             clean_product_name = remove_punctuation(product_name).lower()
-            clean_sese_name = remove_punctuation(self.sese_name).lower()
             if clean_sese_name in clean_product_name:
-                page_url = self.ROOT_URL + relative_url
-                return get_page_html(page_url)
+                return await self._fetch_match(self.ROOT_URL + relative_url)
 
-        product_ranks = self._prepend_name_match_amounts(products)
+        product_ranks = self._prepend_name_match_amounts(
+            products, name_index, positions)
         best_match = product_ranks[0]
         match_amount = best_match[0]
         if match_amount >= settings.MINIMUM_NAME_MATCHING_PERCENTAGE:
-            match_url = self.ROOT_URL + best_match[1][0]
-            return get_page_html(match_url)
+            return await self._fetch_match(self.ROOT_URL + best_match[1][0])
+
+    def _search_catalog(self, catalog_index, search_terms):
+        '''Return the positions of the catalog's Products whose names match
+        the search terms.
+
+        Like most Site searches, a Product must contain every search term,
+        unless :data:`INCLUDE_CATEGORY_IN_SEARCH` is set, in which case it
+        only needs to contain one of them.
+
+        :param catalog_index: The index of the names in the Site's catalog,
+                              see :func:`catalog.get_catalog_index`
+        :type catalog_index: :class:`~matching.NameIndex`
+        :param search_terms: The keywords to search for
+        :type search_terms: str
+        :returns: The catalog positions of the matching Products, in order
+        :rtype: :obj:`list`
+        '''
+        search_words = remove_punctuation(search_terms).lower().split()
+        return catalog_index.find(
+            search_words, match_all=not self.INCLUDE_CATEGORY_IN_SEARCH)
+
+    async def crawl_catalog(self, max_pages=None):
+        '''Return every Product listed in the Site's catalog.
+
+        Pages of the :data:`CATALOG_URL` are fetched in order until a page
+        lists no new Products.
+
+        :param max_pages: The maximum number of pages to fetch, defaults to
+                          :data:`~settings.CATALOG_MAX_PAGES`
+        :type max_pages: int
+        :returns: The ``(URL, Name)`` of each Product
+        :rtype: :obj:`list`
+        :raises ValueError: If every page lists new Products, since the
+                            catalog may continue past the last page
+        '''
+        assert self.CATALOG_URL is not None
+        if max_pages is None:
+            max_pages = settings.CATALOG_MAX_PAGES
+        products = collections.OrderedDict()
+        for page in range(self.CATALOG_FIRST_PAGE,
+                          self.CATALOG_FIRST_PAGE + max_pages):
+            page_html = await fetch_page_html(
+                self.CATALOG_URL.format(page), SEARCH_PAGE, None,
+                self.deadline)
+            new_products = [
+                (unescape(url), unescape(name)) for url, name in
+                await self._parse_search_page(page_html)
+                if unescape(url) not in products]
+            if not new_products:
+                break
+            products.update(new_products)
+        else:
+            raise ValueError(
+                'The catalog has more than {} pages'.format(max_pages))
+        return list(products.items())
+
+    def _get_stop_condition(self, kind):
+        '''Return when to stop downloading a page of the ``kind``.
+
+        :param kind: The kind of page, :data:`~cache.SEARCH_PAGE` or
+                     :data:`~cache.PRODUCT_PAGE`
+        :type kind: str
+        :returns: The StopCondition for the page or :obj:`None` if the whole
+                  page should be downloaded
+        :rtype: :class:`~fetch.StopCondition`
+        '''
+        if kind == SEARCH_PAGE:
+            markers = (get_escaped_forms(self.NO_RESULT_TEXT)
+                       if self.NO_RESULT_TEXT is not None else ())
+            condition = StopCondition(self.SEARCH_PAGE_BYTE_LIMIT,
+                                      markers=markers)
+        else:
+            condition = StopCondition(self.PRODUCT_PAGE_BYTE_LIMIT,
+                                      patterns=self.PRODUCT_PAGE_PATTERNS)
+        return condition if condition.is_active() else None
 
     @abstractmethod
     def _get_results_from_search_page(self, search_page_html):
@@ -186,7 +498,8 @@ class BaseSite(object):
         :rtype: :obj:`list`
         '''
 
-    def _prepend_name_match_amounts(self, search_results):
+    def _prepend_name_match_amounts(self, search_results, name_index=None,
+                                    positions=None):
         '''Prepend the % of SESE Name matched to the ``search_results`` list.
 
         ``search_results`` should be a list of (URL, Name) tuples.
@@ -194,7 +507,9 @@ class BaseSite(object):
         This method iterates through the provided ``search_results`` comparing
         the Product Name with the SESE Product Name by calculating the
         percentage of words in the Company's Name that are also in the SESE
-        Name.
+        Name, see :func:`matching.score_names`. Results found in a
+        :class:`~matching.NameIndex`, like a catalog's, are scored using the
+        index instead.
 
         The match percentage will be prepended to each :obj:`tuple` in the
         ``search_results`` returning a list of ``[(Match Percentage, (URL,
@@ -203,42 +518,30 @@ class BaseSite(object):
         :param search_results: A list of tuples containing the ``(URL, Name)``
                                of each matching Product
         :type search_results: list
+        :param name_index: The index the ``search_results`` were found in, if
+                           any
+        :type name_index: :class:`~matching.NameIndex`
+        :param positions: The position of each search result in the
+                          ``name_index``
+        :type positions: list
         :returns: A list of tupes containing ``(Match%, (URL, Name))`` of each
                   Product
         :rtype: :obj:`list`
 
         '''
-        sese_words = [remove_punctuation(x) for x in
-                      self.sese_name.lower().split() +
-                      self.sese_category.lower().split()]
-        number_of_sese_words = len(sese_words)
-        output = []
-        for result in search_results:
-            number_of_matches = 0
-            site_words = [remove_punctuation(x) for x in
-                          result[1].lower().split()]
-            number_of_site_words = len(site_words)
-
-            for word in site_words:
-                if word in sese_words:
-                    number_of_matches += 1
-
-            percent_site_words_matched = (
-                float(number_of_matches) / number_of_site_words * 100)
-            site_to_sese_word_ratio = (
-                float(number_of_site_words) / number_of_sese_words)
-            percent_sese_words_matched = min(
-                float(number_of_matches) / number_of_sese_words * 100, 100)
-            sese_to_site_word_ratio = (
-                float(number_of_sese_words) / number_of_site_words)
-
-            match_percentage = (
-                percent_site_words_matched * site_to_sese_word_ratio +
-                percent_sese_words_matched * sese_to_site_word_ratio
-            ) / 2
-            output.append((match_percentage, result))
-        output.sort(key=lambda x: x[0], reverse=True)
-        return output
+        sese_words = matching.tokenize(
+            self.sese_name + ' ' + self.sese_category)
+        if name_index is None:
+            ranks = matching.rank_names(
+                sese_words, [result[1] for result in search_results])
+        else:
+            indexes = {position: index
+                       for index, position in enumerate(positions)}
+            ranks = [(match_percentage, indexes[position])
+                     for match_percentage, position
+                     in name_index.rank(sese_words, positions)]
+        return [(match_percentage, search_results[index])
+                for match_percentage, index in ranks]
 
     @abstractmethod
     def _parse_name_from_product_page(self):
@@ -283,9 +586,11 @@ class BaseSite(object):
     def _get_match_from_product_page(self, regex_string):
         '''Return the first group from the regex in the Product Page's HTML.
 
+        Any HTML entities in the matched text are unescaped.
+
         :returns: The first match to the Regular Expression or :obj:`None`
         :rtype: :obj:`str`
         '''
         match = re.search(regex_string, self.page_html, re.M)
-        if match is not None and match.group(0) is not '':
-            return match.group(1)
+        if match is not None and match.group(0) != '':
+            return unescape(match.group(1))
@@ -19,6 +19,8 @@ class BotanicalInterests(BaseSite):
     SEARCH_URL = ROOT_URL + '/products/index/srch:{}/num:high'
     NO_RESULT_TEXT = (
         "Sorry, we couldn’t find any pages that matched your criteria.")
+    PRODUCT_PAGE_PATTERNS = (TITLE_REGEX, NUMBER_REGEX, PRICE_REGEX,
+                             WEIGHT_REGEX)
 
     def _get_results_from_search_page(self, search_page_html):
         '''Parse the Search Page, creating a list of URLs and Product Names
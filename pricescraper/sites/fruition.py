@@ -5,6 +5,12 @@ import re
 from .base import BaseSite
 
 
+TITLE_REGEX = r'<title>(.*?)</title>'
+NUMBER_REGEX = r'ProductCode=(.*?)"'
+PRICE_REGEX = r'OPTION.*?>(.*?)\s\['
+WEIGHT_REGEX = r'OPTION.*?\[\s?(.*?)\s?\]'
+
+
 class Fruition(BaseSite):
     '''This class scrapes Product data from FruitionSeeds.com'''
     ABBREVIATION = 'fs'
@@ -12,6 +18,8 @@ class Fruition(BaseSite):
     ROOT_URL = 'http://www.fruitionseeds.com'
     SEARCH_URL = ROOT_URL + '/SearchResults.asp?Submit=Search&Search={}'
     NO_RESULT_TEXT = 'No products match your search'
+    PRODUCT_PAGE_PATTERNS = (TITLE_REGEX, NUMBER_REGEX, PRICE_REGEX,
+                             WEIGHT_REGEX)
 
     def _get_results_from_search_page(self, search_page_html):
         '''Return tuples of names & URLs of search results.'''
@@ -26,7 +34,7 @@ class Fruition(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(r'<title>(.*?)</title>')
+        return self._get_match_from_product_page(TITLE_REGEX)
 
     def _parse_number_from_product_page(self):
         '''Parse the Product's Number from the Product Page.
@@ -35,7 +43,7 @@ class Fruition(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(r'ProductCode=(.*?)"')
+        return self._get_match_from_product_page(NUMBER_REGEX)
 
     def _parse_organic_status_from_product_page(self):
         '''Parse the Product's Organic Status from the Product Page.
@@ -53,7 +61,7 @@ class Fruition(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(r'OPTION.*?>(.*?)\s\[')
+        return self._get_match_from_product_page(PRICE_REGEX)
 
     def _parse_weight_from_product_page(self):
         '''Parse the Product's Weight from the Product Page.
@@ -62,4 +70,4 @@ class Fruition(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(r'OPTION.*?\[\s?(.*?)\s?\]')
+        return self._get_match_from_product_page(WEIGHT_REGEX)
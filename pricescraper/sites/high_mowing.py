@@ -5,6 +5,15 @@ import re
 from .base import BaseSite
 
 
+TITLE_REGEX = (
+    r'<td class="prod_desc">\s*<span><span.*?bold.*?>(.*?)</span>')
+NUMBER_REGEX = r'<tr class="chart_dark">\s*<td>(.*?)</td>'
+PRICE_REGEX = (
+    r'class="chart_dark">\s*(?:<td>.*?</td>\s*){3}<td>\s*(.*?)\s*</td>')
+WEIGHT_REGEX = (
+    r'class="chart_dark">\s*<td>.*?</td>\s*<td>\s*(.*?)\s*</td>')
+
+
 class HighMowing(BaseSite):
     '''This class scrapes Product data from HighMowingSeeds.com'''
     ABBREVIATION = 'hm'
@@ -13,6 +22,8 @@ class HighMowing(BaseSite):
     SEARCH_URL = ROOT_URL + '/_search.php?q={}'
     NO_RESULT_TEXT = '0 Results found for'
     INCLUDE_CATEGORY_IN_SEARCH = True
+    PRODUCT_PAGE_PATTERNS = (TITLE_REGEX, NUMBER_REGEX, PRICE_REGEX,
+                             WEIGHT_REGEX)
 
     def _get_results_from_search_page(self, search_page_html):
         '''Return tuples of names & URLs of search results.'''
@@ -27,8 +38,7 @@ class HighMowing(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(
-            r'<td class="prod_desc">\s*<span><span.*?bold.*?>(.*?)</span>')
+        return self._get_match_from_product_page(TITLE_REGEX)
 
     def _parse_number_from_product_page(self):
         '''Parse the Product's Number from the Product Page.
@@ -37,8 +47,7 @@ class HighMowing(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(
-            r'<tr class="chart_dark">\s*<td>(.*?)</td>')
+        return self._get_match_from_product_page(NUMBER_REGEX)
 
     def _parse_organic_status_from_product_page(self):
         '''Parse the Product's Organic Status from the Product Page.
@@ -56,8 +65,7 @@ class HighMowing(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(
-            r'class="chart_dark">\s*(?:<td>.*?</td>\s*){3}<td>\s*(.*?)\s*</td>')
+        return self._get_match_from_product_page(PRICE_REGEX)
 
     def _parse_weight_from_product_page(self):
         '''Parse the Product's Weight from the Product Page.
@@ -66,5 +74,4 @@ class HighMowing(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(
-            r'class="chart_dark">\s*<td>.*?</td>\s*<td>\s*(.*?)\s*</td>')
+        return self._get_match_from_product_page(WEIGHT_REGEX)
@@ -2,10 +2,17 @@
 '''This module contains a scraper for SeedSaversExchange.org'''
 import re
 import json
-import urllib.request
 
 from .base import BaseSite
-from util import get_page_html
+from cache import PRODUCT_PAGE
+import fetch
+from util import fetch_page_html
+
+
+TITLE_REGEX = r'<title>(.*?)\s?\|'
+NUMBER_REGEX = r'Catalog <span>(.*?)\s?</'
+PRICE_REGEX = r'bl_price_cell">\s*(.*?)\s*<'
+WEIGHT_REGEX = r'bl_description_cell">\s*(.*?)\s*<'
 
 
 class SeedSavers(BaseSite):
@@ -15,9 +22,11 @@ class SeedSavers(BaseSite):
     ROOT_URL = 'http://www.seedsavers.org'
     SEARCH_URL = ROOT_URL + '/onlinestore/?search={}'
     NO_RESULT_TEXT = 'No items found.'
+    PRODUCT_PAGE_PATTERNS = (TITLE_REGEX, NUMBER_REGEX, PRICE_REGEX,
+                             WEIGHT_REGEX)
 
-    def get_and_set_product_information(self):
-        '''Retrieve and set the Product's information from the website
+    async def _get_product_page(self):
+        '''Return the Product Page's HTML or :obj:`None` if there is no match.
 
         SeedSavers uses AJAX & Javascript redirects in an attempt to thwart
         bots, so we call ``_get_real_url()`` to generate the real page's URL.
@@ -27,13 +36,16 @@ class SeedSavers(BaseSite):
         '''
         found_page_text = '_cell'
 
-        self.page_html = self._find_product_page()
+        self.page_html = await self._find_product_page()
         if (self.page_html is not None and
                 found_page_text not in self.page_html):
-            self.page_html = get_page_html(self._get_real_url())
-        self._parse_and_set_attributes()
+            real_url = await self._get_real_url()
+            self.page_html = await fetch_page_html(
+                real_url, PRODUCT_PAGE, self._get_stop_condition(PRODUCT_PAGE),
+                self.deadline)
+        return self.page_html
 
-    def _get_real_url(self):
+    async def _get_real_url(self):
         '''Generate the true URL of the product by simulating an AJAX request.
 
         Some product pages linked from search results do not contain data but
@@ -48,11 +60,10 @@ class SeedSavers(BaseSite):
             r'itemparent" value="(.*? TOP).*?"').replace(' ', '%20')
         ajax_url = ("{}/{}{}").format(self.ROOT_URL, ajax_path, item_parent)
 
-        request = urllib.request.Request(
-            ajax_url, headers={'User-Agent': 'Mozilla/5.0',
-                               'Content-Type': 'application/json'})
-        response = urllib.request.urlopen(request).read().decode('utf8')
-        data = json.loads(response)
+        response = await fetch.get_engine().fetch(
+            ajax_url, headers={'Content-Type': 'application/json'},
+            deadline=self.deadline)
+        data = json.loads(response.body.decode('utf8'))
 
         real_path = data['myurl']
         return '{}/{}/'.format(self.ROOT_URL, real_path)
@@ -68,7 +79,7 @@ class SeedSavers(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(r'<title>(.*?)\s?\|')
+        return self._get_match_from_product_page(TITLE_REGEX)
 
     def _parse_number_from_product_page(self):
         '''Parse the Product's Number from the Product Page.
@@ -77,7 +88,7 @@ class SeedSavers(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(r'Catalog <span>(.*?)\s?</')
+        return self._get_match_from_product_page(NUMBER_REGEX)
 
     def _parse_organic_status_from_product_page(self):
         '''Parse the Product's Organic Status from the Product Page.
@@ -95,8 +106,7 @@ class SeedSavers(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(
-            r'bl_price_cell">\s*(.*?)\s*<')
+        return self._get_match_from_product_page(PRICE_REGEX)
 
     def _parse_weight_from_product_page(self):
         '''Parse the Product's Weight from the Product Page.
@@ -105,5 +115,4 @@ class SeedSavers(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(
-            r'bl_description_cell">\s*(.*?)\s*<')
+        return self._get_match_from_product_page(WEIGHT_REGEX)
@@ -5,6 +5,12 @@ import re
 from .base import BaseSite
 
 
+TITLE_REGEX = r'<title>(.*?)</title>'
+NUMBER_REGEX = r'child-sku.*?(.*?)</>'
+PRICE_REGEX = r'child-price.*?(.*?)</>'
+WEIGHT_REGEX = r'child-desc.*?(.*?)</>'
+
+
 class Territorial(BaseSite):
     '''This class scrapes Product data from TerritorialSeed.com'''
     ABBREVIATION = 'ts'
@@ -12,6 +18,8 @@ class Territorial(BaseSite):
     ROOT_URL = 'http://www.territorialseed.com'
     SEARCH_URL = ROOT_URL + '/category/s?keyword={}'
     NO_RESULT_TEXT = 'Showing <b>0 - 0</b> out of <b>0</b> total matches'
+    PRODUCT_PAGE_PATTERNS = (TITLE_REGEX, NUMBER_REGEX, PRICE_REGEX,
+                             WEIGHT_REGEX)
 
     def _get_results_from_search_page(self, search_page_html):
         '''Return tuples of names & URLs of search results.'''
@@ -25,7 +33,7 @@ class Territorial(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(r'<title>(.*?)</title>')
+        return self._get_match_from_product_page(TITLE_REGEX)
 
     def _parse_number_from_product_page(self):
         '''Parse the Product's Number from the Product Page.
@@ -34,7 +42,7 @@ class Territorial(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(r'child-sku.*?(.*?)</>')
+        return self._get_match_from_product_page(NUMBER_REGEX)
 
     def _parse_organic_status_from_product_page(self):
         '''Parse the Product's Organic Status from the Product Page.
@@ -52,7 +60,7 @@ class Territorial(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(r'child-price.*?(.*?)</>')
+        return self._get_match_from_product_page(PRICE_REGEX)
 
     def _parse_weight_from_product_page(self):
         '''Parse the Product's Weight from the Product Page.
@@ -61,4 +69,4 @@ class Territorial(BaseSite):
         :rtype: :obj:`str`
 
         '''
-        return self._get_match_from_product_page(r'child-desc.*?(.*?)</>')
+        return self._get_match_from_product_page(WEIGHT_REGEX)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+'''This module collects the statistics reported in the run summary.
+
+Each process counts events, such as cache hits, using :func:`increment`.
+Worker processes send their counts back to the main process using
+:func:`collect`, where they are combined using :func:`merge` and written out
+by :func:`write_run_summary`. While the run is going, the main process
+reports the counts so far using :func:`write_progress`.
+
+Statistics about a Site are counted under its abbreviation. Requests only
+know the host they were sent to, so each Site's host is mapped to its
+abbreviation using :func:`add_site_host` & :func:`get_site`.
+'''
+import collections
+import threading
+
+
+_counts = collections.Counter()
+_lock = threading.Lock()
+
+#: A dictionary mapping each Site's host to the Site's abbreviation.
+_site_hosts = {}
+
+
+def increment(name, amount=1, site=None):
+    '''Add ``amount`` to the count of the ``name`` statistic.
+
+    :param name: The name of the statistic
+    :type name: str
+    :param amount: The amount to add to the statistic
+    :type amount: int
+    :param site: The Site the statistic applies to, if any
+    :type site: str
+    :returns: :obj:`None`
+    '''
+    with _lock:
+        _counts[(name, site)] += amount
+
+
+def add_site_host(host, site):
+    '''Count the statistics of requests to the ``host`` for the ``site``.
+
+    :param host: The host of the Site's URLs
+    :type host: str
+    :param site: The Site's abbreviation
+    :type site: str
+    :returns: :obj:`None`
+    '''
+    _site_hosts[host] = site
+
+
+def get_site(host):
+    '''Return the Site the statistics of requests to the ``host`` are
+    counted for.
+
+    :param host: The host a request was sent to
+    :type host: str
+    :returns: The abbreviation of the Site at the ``host``, or the ``host``
+              itself if it is not a Site's
+    :rtype: :obj:`str`
+    '''
+    return _site_hosts.get(host, host)
+
+
+def collect():
+    '''Return the current process's counts and reset them.
+
+    :returns: The counts, keyed by ``(name, site)``
+    :rtype: :class:`~collections.Counter`
+    '''
+    global _counts
+    with _lock:
+        counts, _counts = _counts, collections.Counter()
+    return counts
+
+
+def merge(total_counts, counts):
+    '''Add the ``counts`` collected from a process to the ``total_counts``.
+
+    :returns: The ``total_counts``
+    :rtype: :class:`~collections.Counter`
+    '''
+    total_counts.update(counts)
+    return total_counts
+
+
+def write_run_summary(filename, counts):
+    '''Write the ``counts`` to a text file, one statistic per line.
+
+    Statistics that apply to the whole run are written first, followed by the
+    statistics for each Site.
+    '''
+    run_counts = sorted((name, value) for (name, site), value in
+                        counts.items() if site is None)
+    site_counts = sorted((site, name, value) for (name, site), value in
+                         counts.items() if site is not None)
+    with open(filename, 'w', encoding="utf8") as summary_file:
+        for name, value in run_counts:
+            summary_file.write("{}: {}\n".format(name, value))
+        for site, name, value in site_counts:
+            summary_file.write("{} {}: {}\n".format(site, name, value))
+
+
+def write_progress(stream, finished, counts):
+    '''Write a line showing the number of finished Products along with the
+    current concurrency limit of each Site.
+
+    :param stream: The stream to write the line to
+    :type stream: file
+    :param finished: The number of Products finished so far
+    :type finished: int
+    :param counts: The counts collected so far
+    :type counts: :class:`~collections.Counter`
+    :returns: :obj:`None`
+    '''
+    limits = sorted((site, value) for (name, site), value in counts.items()
+                    if name == 'Concurrency Limit')
+    line = "Finished {} Products".format(finished)
+    if limits:
+        line += " | Concurrency Limits: " + ", ".join(
+            "{} {}".format(site, value) for site, value in limits)
+    stream.write(line + "\n")
+    stream.flush()
@@ -1,11 +1,62 @@
 #!/usr/bin/env python3
 
 
+import argparse
+import asyncio
+import collections
+import contextlib
+from http import client
+import io
+from multiprocessing.pool import ThreadPool
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import urllib.error
+import zlib
 
+import catalog
+import fetch
+import matches
+from resilience import DeadlineExceededError
 import settings
+import stats
+from pricescraper.cache import PageCache, PRODUCT_PAGE, SEARCH_PAGE
+from pricescraper.fetch import (ConnectionPool, ContentDecoder, FetchEngine,
+                                Response, StopCondition, get_engine)
+from pricescraper.journal import Journal, load_journal
+from pricescraper.matching import NameIndex, tokenize
+from pricescraper import matching, parsing
+from pricescraper.affinity import SiteAffinityPool
+from pricescraper.benchmark import generate_names, reference_scores
+from pricescraper.concurrency import AdaptiveLimit
+from pricescraper.pipeline import Pipeline, ReorderBuffer
+from pricescraper.planning import SearchPlanner, get_search_key
+from pricescraper.price_scraper import parse_arguments
 from pricescraper.product import Product
-from pricescraper.util import create_header_list, get_class, remove_punctuation
+from pricescraper.ratelimit import TokenBucket
+from pricescraper.resilience import (CircuitBreaker, Deadline, RetryPolicy,
+                                     get_retry_after)
+from pricescraper.results import ResultStore
+from pricescraper.retry import load_output_file
+from pricescraper.scheduler import (ERROR, NOT_FOUND, OK, Task,
+                                    TaskScheduler, create_tasks,
+                                    split_into_batches)
+from pricescraper.sites.base import BaseSite
+from pricescraper.sites.botanical_interests import BotanicalInterests
+from pricescraper.sites.testfixtures import botanical_fixtures
+from pricescraper.sharding import (get_shard, get_shard_filename,
+                                   merge_outputs, parse_shard, select_shard)
+from pricescraper.util import (create_header_list, get_class,
+                               get_escaped_forms, remove_punctuation,
+                               unescape)
+from pricescraper.workqueue import (Heartbeat, SQLiteWorkQueue,
+                                    iter_complete_products, run_worker)
 
 
 class TestProductClass(unittest.TestCase):
@@ -223,3 +274,1985 @@ class TestUtilFunctions(unittest.TestCase):
         '''Should remove all punctuation from the string'''
         result = remove_punctuation('!d$k>&<l,;.')
         self.assertEqual(result, 'dkl')
+
+    def test_unescape(self):
+        '''Should replace HTML entities, leaving None unchanged'''
+        self.assertEqual(unescape('Bull&#39;s Blood &amp; Beet'),
+                         "Bull's Blood & Beet")
+        self.assertIsNone(unescape(None))
+
+    def test_get_escaped_forms(self):
+        '''Non-ASCII characters should be written as each kind of entity'''
+        self.assertEqual(get_escaped_forms('couldn’t'),
+                         ['couldn’t', 'couldn&rsquo;t', 'couldn&#8217;t',
+                          'couldn&#x2019;t'])
+        self.assertEqual(get_escaped_forms('No items found.'),
+                         ['No items found.'])
+
+    def test_escaped_no_result_text_is_found(self):
+        '''Botanical Interests' no-result page should be recognised, though
+        it writes the NO_RESULT_TEXT with entities'''
+        site = BotanicalInterests('Brandywine', 'Tomato', False)
+
+        self.assertTrue(site._is_no_result_page(
+            botanical_fixtures.NO_RESULT_HTML))
+        self.assertFalse(site._is_no_result_page(
+            botanical_fixtures.RESULTS_HTML))
+
+
+class TestFetchEngine(unittest.TestCase):
+    '''Tests the ``fetch`` module'''
+
+    class MockEngine(FetchEngine):
+        '''Record the number of concurrent requests instead of fetching'''
+        def __init__(self, *args, **kwargs):
+            super(TestFetchEngine.MockEngine, self).__init__(*args, **kwargs)
+            self.lock = threading.Lock()
+            self.in_flight = {}
+            self.max_in_flight = {}
+
+        def _fetch_blocking(self, url, headers, kind=None, stop=None,
+                            timeout=None, deadline=None):
+            host = url.split('/')[2]
+            with self.lock:
+                for key in (host, None):
+                    self.in_flight[key] = self.in_flight.get(key, 0) + 1
+                    self.max_in_flight[key] = max(
+                        self.max_in_flight.get(key, 0), self.in_flight[key])
+            time.sleep(0.01)
+            with self.lock:
+                for key in (host, None):
+                    self.in_flight[key] -= 1
+            return Response(url, 200, {}, b'')
+
+    def fetch_all(self, engine, urls):
+        async def gather():
+            return await asyncio.gather(*[engine.fetch(url) for url in urls])
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(gather())
+        finally:
+            loop.close()
+
+    def test_fetch_respects_global_limit(self):
+        '''No more than ``concurrency`` requests should be in flight'''
+        engine = self.MockEngine(concurrency=3, host_concurrency=10)
+        urls = ['http://host{}.com/'.format(i) for i in range(12)]
+
+        responses = self.fetch_all(engine, urls)
+
+        self.assertEqual([r.url for r in responses], urls)
+        self.assertEqual(engine.max_in_flight[None], 3)
+
+    def test_limits_are_shared_by_event_loops(self):
+        '''Threads running their own event loops should share the engine's
+        global & host limits'''
+        engine = self.MockEngine(concurrency=3, host_concurrency=2)
+        urls = ['http://{}.com/{}'.format(host, i)
+                for host in 'abcd' for i in range(4)]
+        threads = [threading.Thread(target=self.fetch_all,
+                                    args=(engine, urls)) for _ in range(3)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(engine.max_in_flight[None], 3)
+        for host in 'abcd':
+            self.assertLessEqual(engine.max_in_flight[host + '.com'], 2)
+
+    def test_fetch_respects_host_limit(self):
+        '''No more than ``host_concurrency`` requests should go to a host'''
+        engine = self.MockEngine(concurrency=10, host_concurrency=2)
+        urls = (['http://a.com/{}'.format(i) for i in range(6)] +
+                ['http://b.com/{}'.format(i) for i in range(6)])
+
+        self.fetch_all(engine, urls)
+
+        self.assertEqual(engine.max_in_flight['a.com'], 2)
+        self.assertEqual(engine.max_in_flight['b.com'], 2)
+        self.assertEqual(engine.max_in_flight[None], 4)
+
+
+class TestConnectionPool(unittest.TestCase):
+    '''Tests the ``fetch.ConnectionPool`` class'''
+
+    class MockConnection(object):
+        def __init__(self):
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    class MockPool(ConnectionPool):
+        def connect(self):
+            return TestConnectionPool.MockConnection()
+
+    def test_released_connections_are_reused(self):
+        '''A released connection should be returned by the next acquire'''
+        pool = self.MockPool('http', 'a.com', size=2, idle_timeout=30)
+        connection, reused = pool.acquire()
+        pool.release(connection)
+
+        next_connection, next_reused = pool.acquire()
+
+        self.assertFalse(reused)
+        self.assertTrue(next_reused)
+        self.assertIs(connection, next_connection)
+
+    def test_idle_connections_expire(self):
+        '''Connections idle past the timeout should be closed, not reused'''
+        pool = self.MockPool('http', 'a.com', size=2, idle_timeout=0)
+        connection, _ = pool.acquire()
+        pool.release(connection)
+        time.sleep(0.01)
+
+        next_connection, reused = pool.acquire()
+
+        self.assertFalse(reused)
+        self.assertTrue(connection.closed)
+        self.assertIsNot(connection, next_connection)
+
+    def test_full_pool_closes_released_connections(self):
+        '''No more than ``size`` idle connections should be kept'''
+        pool = self.MockPool('http', 'a.com', size=1, idle_timeout=30)
+        first, _ = pool.acquire()
+        second, _ = pool.acquire()
+        pool.release(first)
+        pool.release(second)
+
+        self.assertFalse(first.closed)
+        self.assertTrue(second.closed)
+
+
+class TestPageCache(unittest.TestCase):
+    '''Tests the ``cache`` module'''
+
+    class MockSession(object):
+        '''Return queued responses, recording each request's headers'''
+        def __init__(self, *responses):
+            self.responses = list(responses)
+            self.requests = []
+
+        def request(self, url, headers, stop=None, timeout=None,
+                    deadline=None):
+            self.requests.append(headers)
+            return self.responses.pop(0)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.sqlite3')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_response(self, url, body, status=200, **headers):
+        message = client.HTTPMessage()
+        for name, value in headers.items():
+            message[name.replace('_', '-')] = value
+        return Response(url, status, message, body)
+
+    def test_store_and_get(self):
+        '''A stored response should be returned with its headers'''
+        page_cache = PageCache(self.path, 1000, {SEARCH_PAGE: 60})
+        page_cache.store('http://a.com/', self.make_response(
+            'http://a.com/', b'body', ETag='"abc"'))
+
+        entry = page_cache.get('http://a.com/')
+
+        self.assertEqual(entry.body, b'body')
+        self.assertEqual(entry.headers['ETag'], '"abc"')
+        self.assertEqual(entry.get_validators(), {'If-None-Match': '"abc"'})
+        self.assertIsNone(page_cache.get('http://b.com/'))
+
+    def test_ttl_depends_on_kind(self):
+        '''Search & product pages should use their own TTLs'''
+        page_cache = PageCache(self.path, 1000,
+                               {SEARCH_PAGE: 60, PRODUCT_PAGE: 0})
+        page_cache.store('http://a.com/', self.make_response(
+            'http://a.com/', b'body'))
+        entry = page_cache.get('http://a.com/')
+
+        self.assertTrue(page_cache.is_fresh(entry, SEARCH_PAGE))
+        self.assertFalse(page_cache.is_fresh(entry, PRODUCT_PAGE))
+
+    def test_least_recently_used_pages_are_evicted(self):
+        '''The least recently used pages should be removed when full'''
+        page_cache = PageCache(self.path, 10, {SEARCH_PAGE: 60})
+        for name in 'abc':
+            url = 'http://{}.com/'.format(name)
+            page_cache.store(url, self.make_response(url, b'12345'))
+            time.sleep(0.01)
+            if name == 'b':
+                page_cache.get('http://a.com/')
+
+        self.assertIsNotNone(page_cache.get('http://a.com/'))
+        self.assertIsNone(page_cache.get('http://b.com/'))
+        self.assertIsNotNone(page_cache.get('http://c.com/'))
+        self.assertEqual(page_cache.get_size(), 10)
+
+    def test_total_size_is_shared_by_every_worker(self):
+        '''Pages stored, replaced or evicted by any worker should be
+        counted, including those stored before the total was kept'''
+        connection = sqlite3.connect(self.path)
+        connection.execute(
+            'CREATE TABLE pages (url TEXT PRIMARY KEY, status INTEGER, '
+            'headers TEXT, body BLOB, complete INTEGER, size INTEGER, '
+            'stored_at REAL, accessed_at REAL)')
+        connection.execute(
+            "INSERT INTO pages VALUES ('http://a.com/', 200, '[]', "
+            "X'00', 1, 4, 0, 0)")
+        connection.commit()
+        connection.close()
+        page_cache = PageCache(self.path, 10, {SEARCH_PAGE: 60})
+        other_cache = PageCache(self.path, 10, {SEARCH_PAGE: 60})
+        self.assertEqual(page_cache.get_size(), 4)
+
+        other_cache.store('http://b.com/',
+                          self.make_response('http://b.com/', b'12345'))
+        page_cache.store('http://b.com/',
+                         self.make_response('http://b.com/', b'123'))
+        self.assertEqual(other_cache.get_size(), 7)
+        other_cache.store('http://c.com/',
+                          self.make_response('http://c.com/', b'12345'))
+
+        self.assertIsNone(page_cache.get('http://a.com/'))
+        self.assertEqual(page_cache.get_size(), 8)
+
+    def test_engine_revalidates_stale_pages(self):
+        '''Stale pages should be requested conditionally and reused on 304'''
+        url = 'http://a.com/'
+        page_cache = PageCache(self.path, 1000, {PRODUCT_PAGE: 0})
+        session = self.MockSession(
+            self.make_response(url, b'body', Last_Modified='yesterday'),
+            self.make_response(url, b'', status=304))
+        engine = FetchEngine(1, 1, session=session, page_cache=page_cache)
+
+        first = engine._fetch_blocking(url, None, PRODUCT_PAGE)
+        second = engine._fetch_blocking(url, None, PRODUCT_PAGE)
+
+        self.assertEqual(first.body, b'body')
+        self.assertEqual(second.body, b'body')
+        self.assertNotIn('If-Modified-Since', session.requests[0])
+        self.assertEqual(session.requests[1]['If-Modified-Since'],
+                         'yesterday')
+
+    def test_engine_coalesces_concurrent_requests(self):
+        '''A page being fetched by another worker should not be re-fetched'''
+        url = 'http://a.com/'
+        page_cache = PageCache(self.path, 1000, {PRODUCT_PAGE: 60})
+        other_cache = PageCache(self.path, 1000, {PRODUCT_PAGE: 60})
+        session = self.MockSession()
+        engine = FetchEngine(1, 1, session=session, page_cache=page_cache)
+        self.assertTrue(other_cache.claim(url))
+
+        def finish_other_fetch():
+            time.sleep(0.2)
+            other_cache.store(url, self.make_response(url, b'shared'))
+            other_cache.release(url)
+        thread = threading.Thread(target=finish_other_fetch)
+        thread.start()
+        response = engine._fetch_blocking(url, None, PRODUCT_PAGE)
+        thread.join()
+
+        self.assertEqual(response.body, b'shared')
+        self.assertEqual(session.requests, [])
+
+    def test_expired_claims_are_replaced(self):
+        '''A claim should only block others until it times out'''
+        page_cache = PageCache(self.path, 1000, {PRODUCT_PAGE: 60},
+                               claim_timeout=0)
+        self.assertTrue(page_cache.claim('http://a.com/'))
+        time.sleep(0.01)
+
+        self.assertTrue(page_cache.claim('http://a.com/'))
+        self.assertIsNone(page_cache.wait_for('http://a.com/', time.time()))
+
+    def test_waits_for_claims_can_time_out(self):
+        '''Waiting for another worker's fetch should stop at the timeout'''
+        page_cache = PageCache(self.path, 1000, {PRODUCT_PAGE: 60})
+        self.assertTrue(page_cache.claim('http://a.com/'))
+        started_at = time.monotonic()
+
+        self.assertIsNone(
+            page_cache.wait_for('http://a.com/', time.time(), 0.1))
+        self.assertLess(time.monotonic() - started_at, 0.5)
+
+
+class TestContentDecoder(unittest.TestCase):
+    '''Tests the ``fetch.ContentDecoder`` class'''
+    BODY = b'<html>' + b'seeds ' * 1000 + b'</html>'
+
+    def decode_in_chunks(self, decoder, data, size=100):
+        chunks = [decoder.decompress(data[index:index + size])
+                  for index in range(0, len(data), size)]
+        return b''.join(chunks) + decoder.flush()
+
+    def test_gzip(self):
+        '''Gzipped bodies should be decompressed in chunks'''
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        data = compressor.compress(self.BODY) + compressor.flush()
+
+        body = self.decode_in_chunks(ContentDecoder('gzip'), data)
+
+        self.assertLess(len(data), len(self.BODY))
+        self.assertEqual(body, self.BODY)
+
+    def test_deflate(self):
+        '''Deflated bodies should be decompressed with a zlib header'''
+        data = zlib.compress(self.BODY)
+
+        body = self.decode_in_chunks(ContentDecoder('deflate'), data)
+
+        self.assertEqual(body, self.BODY)
+
+    def test_raw_deflate(self):
+        '''Deflated bodies should be decompressed without a zlib header'''
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        data = compressor.compress(self.BODY) + compressor.flush()
+
+        body = self.decode_in_chunks(ContentDecoder('deflate'), data)
+
+        self.assertEqual(body, self.BODY)
+
+    def test_identity(self):
+        '''Bodies with no encoding should be returned unchanged'''
+        body = self.decode_in_chunks(ContentDecoder(None), self.BODY)
+
+        self.assertEqual(body, self.BODY)
+
+
+class TestResponseText(unittest.TestCase):
+    '''Tests decoding the body of a ``fetch.Response``'''
+    TEXT = 'Sorry, we couldn\u2019t find any pages.'
+
+    def make_response(self, body, content_type=None):
+        headers = client.HTTPMessage()
+        if content_type is not None:
+            headers['Content-Type'] = content_type
+        return Response('http://a.com/', 200, headers, body)
+
+    def test_content_type_charset(self):
+        '''The charset of the Content-Type header should be used'''
+        response = self.make_response(self.TEXT.encode('cp1252'),
+                                      'text/html; charset=windows-1252')
+
+        self.assertEqual(response.get_charset(), 'cp1252')
+        self.assertEqual(response.get_text(), self.TEXT)
+
+    def test_meta_charset(self):
+        '''A charset declared by a meta tag should be used'''
+        body = ('<html><head><meta http-equiv="Content-Type" '
+                'content="text/html; charset=ISO-8859-1"></head>'
+                'Caf\u00e9</html>').encode('iso-8859-1')
+        response = self.make_response(body, 'text/html')
+
+        self.assertEqual(response.get_charset(), 'iso8859-1')
+        self.assertIn('Caf\u00e9', response.get_text())
+
+    def test_undeclared_charset(self):
+        '''Undeclared bodies should be decoded as UTF-8 if possible'''
+        utf8 = self.make_response(self.TEXT.encode('utf8'))
+        latin = self.make_response('Caf\u00e9'.encode('iso-8859-1'))
+
+        self.assertIsNone(utf8.get_charset())
+        self.assertEqual(utf8.get_text(), self.TEXT)
+        self.assertEqual(latin.get_text(), 'Caf\u00e9')
+
+
+class TestStopCondition(unittest.TestCase):
+    '''Tests the ``fetch.StopCondition`` class'''
+
+    def test_byte_limit(self):
+        '''The condition should be met once ``max_bytes`` are downloaded'''
+        condition = StopCondition(max_bytes=10)
+
+        self.assertFalse(condition.is_met(b'123456789'))
+        self.assertTrue(condition.is_met(b'1234567890'))
+
+    def test_markers(self):
+        '''The condition should be met once any marker is found'''
+        condition = StopCondition(markers=('No items found.', 'Sorry’'))
+
+        self.assertFalse(condition.is_met(b'<html><h6>Results'))
+        self.assertTrue(condition.is_met(b'<html>No items found.'))
+        self.assertTrue(condition.is_met('<p>Sorry’</p>'.encode('utf8')))
+
+    def test_patterns_must_all_match_complete_lines(self):
+        '''Every pattern must match, and only against finished lines'''
+        condition = StopCondition(patterns=(r'<title>(.*?)</title>',
+                                            r'price">(.*?)<'))
+
+        self.assertFalse(condition.is_met(b'<title>Beans</title>\n'))
+        self.assertFalse(condition.is_met(
+            b'<title>Beans</title>\n<b class="price">$2.'))
+        self.assertTrue(condition.is_met(
+            b'<title>Beans</title>\n<b class="price">$2.45</b>\n'))
+
+    def test_escaped_markers_stop_search_pages(self):
+        '''Botanical Interests' no-result page should stop the download,
+        though it writes the NO_RESULT_TEXT with entities'''
+        site = BotanicalInterests('Brandywine', 'Tomato', False)
+        condition = site._get_stop_condition(SEARCH_PAGE)
+
+        self.assertTrue(condition.is_met(
+            botanical_fixtures.NO_RESULT_HTML.encode('utf8')))
+        self.assertFalse(condition.is_met(
+            botanical_fixtures.RESULTS_HTML.encode('utf8')))
+
+    def test_scan_finds_markers_split_between_chunks(self):
+        '''A scan should find a marker spanning two checks'''
+        scan = StopCondition(markers=('No items found.',)).start_scan()
+
+        self.assertFalse(scan.is_met(b'<html>' + b'x' * 100 + b'No items'))
+        self.assertTrue(scan.is_met(
+            b'<html>' + b'x' * 100 + b'No items found.</html>'))
+
+    def test_scan_keeps_earlier_pattern_matches(self):
+        '''A scan should remember the patterns matched by earlier checks'''
+        scan = StopCondition(patterns=(r'<title>(.*?)</title>',
+                                       r'price">(.*?)<')).start_scan()
+        body = b'<title>Beans</title>\n' + b'x' * 2000 + b'\n'
+
+        self.assertFalse(scan.is_met(body))
+        self.assertTrue(scan.is_met(body + b'<b class="price">$2.45</b>\n'))
+
+    def test_inactive_condition(self):
+        '''A condition without any limits should not be active'''
+        self.assertFalse(StopCondition().is_active())
+        self.assertTrue(StopCondition(max_bytes=1).is_active())
+
+
+class TestTokenBucket(unittest.TestCase):
+    '''Tests the ``ratelimit.TokenBucket`` class'''
+
+    def test_burst_is_not_delayed(self):
+        '''Up to ``burst`` requests should be sent without waiting'''
+        bucket = TokenBucket(rate=1, burst=3)
+
+        delays = [bucket.reserve() for _ in range(3)]
+
+        self.assertEqual(delays, [0, 0, 0])
+
+    def test_requests_past_burst_are_spaced_by_rate(self):
+        '''Requests past the burst should wait for the bucket to refill'''
+        bucket = TokenBucket(rate=10, burst=1)
+
+        delays = [bucket.reserve() for _ in range(3)]
+
+        self.assertEqual(delays[0], 0)
+        self.assertAlmostEqual(delays[1], 0.1, places=2)
+        self.assertAlmostEqual(delays[2], 0.2, places=2)
+
+    def test_tokens_are_not_taken_past_the_timeout(self):
+        '''A token that would come too late should be left in the bucket'''
+        bucket = TokenBucket(rate=10, burst=1)
+
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertIsNone(bucket.reserve(timeout=0.05))
+        self.assertIsNone(bucket.acquire(timeout=0.05))
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+
+    def test_session_does_not_wait_past_the_deadline(self):
+        '''Requests that cannot be sent before the deadline should not be
+        sent at all'''
+        class FakePool(object):
+            acquired = 0
+
+            def acquire(self):
+                FakePool.acquired += 1
+                raise AssertionError('The request should not be sent')
+
+        class FakeSession(fetch.Session):
+            def get_pool(self, scheme, netloc):
+                return FakePool()
+
+        session = FakeSession(
+            rate_limiters={'a.com': TokenBucket(rate=0.1, burst=1)})
+        started_at = time.monotonic()
+        with self.assertRaises(DeadlineExceededError):
+            session.request('http://b.com/',
+                            deadline=Deadline(time.time() - 1))
+        session.rate_limiters['a.com'].reserve()
+        with self.assertRaises(DeadlineExceededError):
+            session.request('http://a.com/',
+                            deadline=Deadline.from_time_limit(1))
+
+        self.assertLess(time.monotonic() - started_at, 0.5)
+        self.assertEqual(FakePool.acquired, 0)
+
+
+class TestResilience(unittest.TestCase):
+    '''Tests the ``resilience`` module'''
+
+    class FlakySession(object):
+        '''Raise the queued errors before returning a response'''
+        def __init__(self, *errors):
+            self.errors = list(errors)
+            self.attempts = 0
+
+        def request(self, url, headers, stop=None, timeout=None,
+                    deadline=None):
+            self.attempts += 1
+            self.timeout = timeout
+            if self.errors:
+                raise self.errors.pop(0)
+            return Response(url, 200, {}, b'ok')
+
+    def make_http_error(self, code, retry_after=None):
+        headers = client.HTTPMessage()
+        if retry_after is not None:
+            headers['Retry-After'] = retry_after
+        return urllib.error.HTTPError('http://a.com/', code, 'Error',
+                                      headers, None)
+
+    def test_retry_after_seconds(self):
+        '''A numeric ``Retry-After`` header should be used as the delay'''
+        policy = RetryPolicy(attempts=3, base_delay=100, max_delay=60)
+        error = self.make_http_error(429, '7')
+
+        self.assertEqual(get_retry_after(error), 7)
+        self.assertEqual(policy.get_delay(0, error), 7)
+        self.assertIsNone(get_retry_after(self.make_http_error(503)))
+
+    def test_backoff_is_bounded(self):
+        '''Jittered delays should grow with each attempt up to the max'''
+        policy = RetryPolicy(attempts=10, base_delay=1, max_delay=5)
+        error = ConnectionResetError()
+
+        for attempt in range(10):
+            delay = policy.get_delay(attempt, error)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(5, 2 ** attempt))
+
+    def test_only_transient_errors_are_retried(self):
+        '''Server errors & connection errors should be retried, not 404s'''
+        policy = RetryPolicy()
+
+        self.assertTrue(policy.is_retryable(self.make_http_error(503)))
+        self.assertTrue(policy.is_retryable(self.make_http_error(429)))
+        self.assertTrue(policy.is_retryable(TimeoutError()))
+        self.assertFalse(policy.is_retryable(self.make_http_error(404)))
+        self.assertFalse(policy.is_retryable(ValueError()))
+
+    def test_circuit_breaker_opens_and_recovers(self):
+        '''The breaker should open at the error rate and allow a trial after
+        the cooldown'''
+        breaker = CircuitBreaker(error_rate=0.5, window=4,
+                                 minimum_requests=4, cooldown=0.05)
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+
+        self.assertTrue(breaker.record_failure())
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+
+    def test_engine_retries_transient_errors(self):
+        '''The engine should retry until a request succeeds'''
+        session = self.FlakySession(self.make_http_error(503),
+                                    ConnectionResetError())
+        engine = FetchEngine(1, 1, session=session,
+                             retry_policy=RetryPolicy(3, 0, 0))
+        loop = asyncio.new_event_loop()
+        try:
+            response = loop.run_until_complete(engine.fetch('http://a.com/'))
+        finally:
+            loop.close()
+
+        self.assertEqual(response.body, b'ok')
+        self.assertEqual(session.attempts, 3)
+
+    def test_request_statistics_are_counted_for_the_site(self):
+        '''Statistics about requests to a Site's host should be counted
+        under the Site's abbreviation'''
+        session = self.FlakySession(ConnectionResetError())
+        engine = FetchEngine(1, 1, session=session,
+                             retry_policy=RetryPolicy(2, 0, 0))
+        stats.collect()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(engine.fetch(MatchSite.ROOT_URL + '/2'))
+        finally:
+            loop.close()
+
+        self.assertEqual(stats.get_site('match.com'), 'mts')
+        self.assertEqual(stats.get_site('other.com'), 'other.com')
+        self.assertEqual(stats.collect()[('Retries', 'mts')], 1)
+
+    def test_deadline_shortens_timeouts(self):
+        '''A Deadline should cap timeouts at the time it has left'''
+        self.assertIsNone(Deadline().get_timeout())
+        self.assertEqual(Deadline().get_timeout(30), 30)
+        self.assertFalse(Deadline().has_expired())
+
+        deadline = Deadline.from_time_limit(5)
+        self.assertLessEqual(deadline.get_timeout(30), 5)
+        self.assertEqual(deadline.get_timeout(1), 1)
+        self.assertTrue(Deadline(time.time() - 1).has_expired())
+
+    def test_engine_passes_remaining_time_as_timeout(self):
+        '''Each request's timeout should be limited by the deadline'''
+        session = self.FlakySession()
+        engine = FetchEngine(1, 1, session=session)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(engine.fetch(
+                'http://a.com/', deadline=Deadline.from_time_limit(2)))
+            with self.assertRaises(DeadlineExceededError):
+                loop.run_until_complete(engine.fetch(
+                    'http://a.com/', deadline=Deadline(time.time() - 1)))
+        finally:
+            loop.close()
+
+        self.assertLessEqual(session.timeout, 2)
+        self.assertEqual(session.attempts, 1)
+
+    def test_engine_stops_waiting_at_deadline(self):
+        '''A request still running at the deadline should be abandoned'''
+        class SlowSession(object):
+            def request(self, url, headers, stop=None, timeout=None,
+                        deadline=None):
+                time.sleep(0.5)
+                return Response(url, 200, {}, b'ok')
+
+        engine = FetchEngine(1, 1, session=SlowSession())
+        loop = asyncio.new_event_loop()
+        started_at = time.monotonic()
+        try:
+            with self.assertRaises(DeadlineExceededError):
+                loop.run_until_complete(engine.fetch(
+                    'http://a.com/', deadline=Deadline.from_time_limit(0.05)))
+        finally:
+            loop.close()
+
+        self.assertLess(time.monotonic() - started_at, 0.4)
+
+
+class MockSite(object):
+    '''A Site that records the Tasks running at once instead of scraping'''
+    ABBREVIATION = 'ms'
+    DELAY = 0
+    running = 0
+    max_running = 0
+    finished = []
+
+    match_recorded = False
+    match_url = None
+
+    def __init__(self, name, category, organic, deadline=None, sku=None):
+        self.sese_name = name
+
+    async def get_and_set_product_information(self):
+        cls = type(self)
+        cls.running += 1
+        cls.max_running = max(cls.max_running, cls.running)
+        await asyncio.sleep(self.DELAY)
+        cls.running -= 1
+        MockSite.finished.append(cls.ABBREVIATION)
+
+    @property
+    def scraped(self):
+        return True
+
+    def get_company_attributes(self):
+        return {'name': self.sese_name, 'number': None, 'organic': None,
+                'price': None, 'weight': None}
+
+
+class SlowMockSite(MockSite):
+    ABBREVIATION = 'sms'
+    DELAY = 0.05
+
+
+class BrokenMockSite(MockSite):
+    '''A Site whose scraper raises an error'''
+    ABBREVIATION = 'bms'
+
+    async def get_and_set_product_information(self):
+        await asyncio.sleep(0)
+        return self.name.lower()
+
+
+class TestScheduler(unittest.TestCase):
+    '''Tests the ``scheduler`` module'''
+    WEBSITES = ['pricescraper.tests.SlowMockSite',
+                'pricescraper.tests.MockSite']
+
+    def setUp(self):
+        MockSite.finished = []
+        for site in (MockSite, SlowMockSite):
+            site.running = site.max_running = 0
+        self.products = [
+            Product(number=str(i), name='variety {}'.format(i),
+                    category='category', organic='False')
+            for i in range(4)]
+
+    def test_batches_hold_a_single_site(self):
+        '''Batches should hold one Site's Tasks, alternating Sites'''
+        tasks = create_tasks(self.products, self.WEBSITES)
+        batches = split_into_batches(tasks, 3)
+
+        self.assertEqual([[task.abbreviation for task in batch]
+                          for batch in batches],
+                         [['sms'] * 3, ['ms'] * 3, ['sms'], ['ms']])
+
+    def test_slow_sites_do_not_block_fast_sites(self):
+        '''Every fast Task should finish before the slow Tasks'''
+        tasks = create_tasks(self.products, self.WEBSITES)
+        loop = asyncio.new_event_loop()
+        try:
+            finished = loop.run_until_complete(
+                TaskScheduler(site_concurrency=2).run(tasks))
+        finally:
+            loop.close()
+
+        self.assertEqual(MockSite.finished, ['ms'] * 4 + ['sms'] * 4)
+        self.assertEqual(len(finished), 8)
+        self.assertEqual(SlowMockSite.max_running, 2)
+
+    def test_results_are_added_to_products(self):
+        '''A finished Task's attributes should be set on its Product'''
+        task = Task(2, self.products[2], 'pricescraper.tests.MockSite')
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(task.run())
+        finally:
+            loop.close()
+        self.products[task.index].add_task_result(task)
+
+        self.assertEqual(self.products[2].ms_name, 'variety 2')
+        self.assertEqual(task.status, OK)
+
+    def test_errors_are_isolated(self):
+        '''A Site's error should only fail its own Tasks'''
+        tasks = create_tasks(self.products,
+                             ['pricescraper.tests.BrokenMockSite',
+                              'pricescraper.tests.MockSite'])
+        loop = asyncio.new_event_loop()
+        try:
+            finished = loop.run_until_complete(TaskScheduler().run(tasks))
+        finally:
+            loop.close()
+
+        statuses = collections.Counter(
+            (task.abbreviation, task.status) for task in finished)
+        self.assertEqual(statuses, {('bms', ERROR): 4, ('ms', OK): 4})
+        broken = [task for task in finished if task.abbreviation == 'bms']
+        self.assertEqual(broken[0].attributes['name'], 'Error')
+        self.assertFalse(broken[0].scraped)
+        self.assertIn('AttributeError', broken[0].error)
+
+    def test_restored_tasks_have_a_status(self):
+        '''Restored results without a status should be given one'''
+        task = Task(0, self.products[0], 'pricescraper.tests.MockSite')
+        task.restore({'name': 'Not Found', 'number': None})
+
+        self.assertEqual(task.status, NOT_FOUND)
+        self.assertEqual(task.attributes['status'], NOT_FOUND)
+
+
+class TestPipeline(unittest.TestCase):
+    '''Tests the ``pipeline`` module'''
+    WEBSITES = TestScheduler.WEBSITES
+
+    def run_batch(self, tasks):
+        loop = asyncio.new_event_loop()
+        try:
+            tasks = loop.run_until_complete(TaskScheduler().run(tasks))
+        finally:
+            loop.close()
+        return tasks, collections.Counter({('Batches', None): 1})
+
+    def read_products(self, count):
+        for number in range(count):
+            self.products_read += 1
+            yield Product(number=str(number), name='variety',
+                          category='category', organic='False')
+
+    def test_reorder_buffer(self):
+        '''Items should only be released once every earlier item has been'''
+        buffer = ReorderBuffer()
+
+        self.assertEqual(buffer.add(1, 'b'), [])
+        self.assertEqual(buffer.add(2, 'c'), [])
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(buffer.add(0, 'a'), ['a', 'b', 'c'])
+        self.assertEqual(buffer.add(3, 'd'), ['d'])
+
+    def test_products_stream_in_order(self):
+        '''Products should be yielded in input order while only a few
+        chunks are read ahead'''
+        self.products_read = 0
+        pipeline = Pipeline(self.read_products(20), self.WEBSITES,
+                            chunk_size=3, chunks_in_flight=2)
+        numbers = []
+        with ThreadPool(4) as pool:
+            for product in pipeline.run(pool, self.run_batch):
+                numbers.append(int(product.sese_number))
+                self.assertLessEqual(self.products_read - len(numbers), 6)
+                self.assertEqual(product.ms_name, 'variety')
+                self.assertEqual(product.sms_name, 'variety')
+
+        self.assertEqual(numbers, list(range(20)))
+        self.assertGreater(pipeline.counts[('Batches', None)], 0)
+
+    def test_unordered_products_are_all_yielded(self):
+        '''Every Product should be yielded once when order is not kept'''
+        self.products_read = 0
+        pipeline = Pipeline(self.read_products(10), self.WEBSITES,
+                            chunk_size=4, keep_order=False)
+        with ThreadPool(4) as pool:
+            numbers = [int(product.sese_number)
+                       for product in pipeline.run(pool, self.run_batch)]
+
+        self.assertEqual(sorted(numbers), list(range(10)))
+
+    def test_previous_results_are_restored(self):
+        '''Journalled results should be restored instead of scraped, and
+        new results should be journalled'''
+        self.products_read = 0
+        MockSite.finished = []
+        path = os.path.join(tempfile.mkdtemp(), 'journal.jsonl')
+        previous_results = {
+            (str(number), 'sms'): {'name': 'restored', 'number': None,
+                                   'organic': None, 'price': None,
+                                   'weight': None}
+            for number in range(3)}
+        with Journal(path) as journal:
+            pipeline = Pipeline(self.read_products(3), self.WEBSITES,
+                                recorders=[journal],
+                                previous_results=[previous_results])
+            with ThreadPool(2) as pool:
+                products = list(pipeline.run(pool, self.run_batch))
+
+        self.assertEqual([p.sms_name for p in products], ['restored'] * 3)
+        self.assertEqual([p.ms_name for p in products], ['variety'] * 3)
+        self.assertEqual(MockSite.finished, ['ms'] * 3)
+        self.assertEqual(sorted(load_journal(path)),
+                         [(str(number), 'ms') for number in range(3)])
+
+
+class TestJournal(unittest.TestCase):
+    '''Tests the ``journal`` module'''
+
+    def make_task(self, sku, scraped=True):
+        product = Product(number=sku, name='variety', category='category',
+                          organic='False')
+        task = Task(0, product, 'pricescraper.tests.MockSite')
+        task.attributes = {'name': 'variety'}
+        task.scraped = scraped
+        return task
+
+    def test_failed_tasks_are_not_journalled(self):
+        '''Only Tasks that were scraped should be recorded'''
+        path = os.path.join(tempfile.mkdtemp(), 'journal.jsonl')
+        with Journal(path) as journal:
+            self.assertTrue(journal.record(self.make_task('1')))
+            self.assertFalse(journal.record(self.make_task('2', False)))
+
+        self.assertEqual(load_journal(path),
+                         {('1', 'ms'): {'name': 'variety'}})
+
+    def test_resume_appends_and_ignores_partial_lines(self):
+        '''Resuming should keep old results, skipping a cut off line'''
+        path = os.path.join(tempfile.mkdtemp(), 'journal.jsonl')
+        with Journal(path) as journal:
+            journal.record(self.make_task('1'))
+        with open(path, 'a') as journal_file:
+            journal_file.write('{"sku": "2", "si')
+        with Journal(path, resume=True) as journal:
+            journal.record(self.make_task('3'))
+
+        self.assertEqual(sorted(load_journal(path)),
+                         [('1', 'ms'), ('3', 'ms')])
+        self.assertEqual(load_journal(path + '.missing'), {})
+
+
+class TestResultStore(unittest.TestCase):
+    '''Tests the ``results`` module'''
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'results.sqlite3')
+
+    def make_task(self, sku, name):
+        product = Product(number=sku, name=name, category='category',
+                          organic='False')
+        task = Task(0, product, 'pricescraper.tests.MockSite')
+        task.attributes = {'name': name}
+        task.scraped = True
+        return task
+
+    def test_latest_result_is_kept(self):
+        '''Recording a result should replace the SKU & Site's old result'''
+        with ResultStore(self.path, {}, 60) as store:
+            store.record(self.make_task('1', 'old'))
+            store.record(self.make_task('1', 'new'))
+
+            self.assertEqual(store.get(('1', 'ms')), {'name': 'new'})
+            self.assertIsNone(store.get(('2', 'ms')))
+
+    def test_restored_and_failed_results_are_not_recorded(self):
+        '''Only freshly scraped results should be stored'''
+        failed = self.make_task('1', 'failed')
+        failed.scraped = False
+        restored = self.make_task('2', 'restored')
+        restored.restore({'name': 'restored'})
+        with ResultStore(self.path, {}, 60) as store:
+            self.assertFalse(store.record(failed))
+            self.assertFalse(store.record(restored))
+            self.assertIsNone(store.get(('1', 'ms')))
+            self.assertIsNone(store.get(('2', 'ms')))
+
+    def test_max_age_depends_on_site(self):
+        '''Results older than their Site's max age should not be reused'''
+        with ResultStore(self.path, {'ms': 0.05}, 60) as store:
+            store.record(self.make_task('1', 'variety'))
+            self.assertIsNotNone(store.get(('1', 'ms')))
+            self.assertEqual(store.get_max_age('sms'), 60)
+
+            time.sleep(0.06)
+            self.assertIsNone(store.get(('1', 'ms')))
+
+
+class TestSharding(unittest.TestCase):
+    '''Tests the ``sharding`` module'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.skus = [str(number) for number in range(30)]
+
+    def write_output(self, filename, skus):
+        path = os.path.join(self.directory, filename)
+        with open(path, 'w', encoding='utf8') as output_file:
+            output_file.write('header\n')
+            for sku in skus:
+                output_file.write('{}\tTrue\tvariety {}\tcategory\n'.format(
+                    sku, sku))
+        return path
+
+    def test_parse_shard(self):
+        '''Shards should be numbered from 1 to N'''
+        self.assertEqual(parse_shard('2/4'), (2, 4))
+        for invalid in ('0/4', '5/4', '2', 'a/b'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(invalid)
+
+    def test_every_sku_is_in_one_shard(self):
+        '''The shards should partition the input, using a stable hash'''
+        products = [Product(number=sku, name='variety', category='category',
+                            organic='False') for sku in self.skus]
+        shards = [[product.sese_number for product in
+                   select_shard(products, shard, 3)]
+                  for shard in (1, 2, 3)]
+
+        self.assertEqual(sorted(sum(shards, []), key=int), self.skus)
+        self.assertTrue(all(shards))
+        self.assertEqual(get_shard('12383A', 7), get_shard('12383A', 7))
+        self.assertEqual(get_shard_filename('./output.csv', 1, 3),
+                         './output-1-of-3.csv')
+
+    def test_merge_keeps_input_order(self):
+        '''Merged rows should be in input order, under a single header'''
+        shard_paths = [
+            self.write_output('output-{}.csv'.format(shard), [
+                sku for sku in self.skus if get_shard(sku, 2) == shard])
+            for shard in (1, 2)]
+        path = os.path.join(self.directory, 'output.csv')
+
+        merge_outputs(self.skus, shard_paths, path)
+
+        with open(path, encoding='utf8') as output_file:
+            lines = output_file.read().splitlines()
+        self.assertEqual(lines[0].split('\t'), create_header_list())
+        self.assertEqual([line.split('\t')[0] for line in lines[1:]],
+                         self.skus)
+
+    def test_merge_rejects_unordered_shards(self):
+        '''Shards not in input order should not be merged'''
+        shard_paths = [
+            self.write_output('output-{}.csv'.format(shard), reversed([
+                sku for sku in self.skus if get_shard(sku, 2) == shard]))
+            for shard in (1, 2)]
+
+        with self.assertRaises(ValueError):
+            merge_outputs(self.skus, shard_paths,
+                          os.path.join(self.directory, 'output.csv'))
+
+
+class TestWorkQueue(unittest.TestCase):
+    '''Tests the ``workqueue`` module'''
+    WEBSITES = TestScheduler.WEBSITES
+    run_batch = TestPipeline.run_batch
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'queue.sqlite3')
+        products = [Product(number=str(i), name='variety {}'.format(i),
+                            category='category', organic='True')
+                    for i in range(3)]
+        self.tasks = create_tasks(products, self.WEBSITES)
+
+    def test_leases_are_exclusive(self):
+        '''A leased Task should not be handed to another worker, and each
+        lease should only hold the Tasks of one Site'''
+        with SQLiteWorkQueue(self.path, lease_timeout=60) as queue:
+            queue.add(self.tasks)
+            queue.add(self.tasks)
+            first = queue.lease('first', 4)
+            second = queue.lease('second', 4)
+
+            self.assertEqual(len(first), 3)
+            self.assertEqual(len(second), 3)
+            self.assertEqual(len(set(task.website for task in first)), 1)
+            self.assertEqual(len(set(task.website for task in second)), 1)
+            self.assertNotEqual(first[0].website, second[0].website)
+            self.assertEqual(queue.lease('third', 4), [])
+            self.assertEqual(queue.count_unfinished(), 6)
+            self.assertTrue(first[0].sese_organic)
+
+    def test_expired_leases_are_handed_out_again(self):
+        '''Tasks should be re-delivered once their lease expires, unless
+        a heartbeat extends it'''
+        with SQLiteWorkQueue(self.path, lease_timeout=0.1) as queue:
+            queue.add(self.tasks)
+            queue.lease('lost', 2)
+            queue.lease('alive', 2)
+            with Heartbeat(queue, 'alive', interval=0.02):
+                time.sleep(0.2)
+                redelivered = queue.lease('other', 6)
+
+        self.assertEqual([task.index for task in redelivered], [0, 1, 2])
+        self.assertEqual(len(set(task.website for task in redelivered)), 1)
+
+    def test_failed_tasks_are_retried(self):
+        '''A Task that failed should be leased again until it has used up
+        its attempts, then its error should be kept'''
+        with SQLiteWorkQueue(self.path, max_attempts=2) as queue:
+            queue.add(self.tasks[:1])
+            for _ in range(2):
+                self.assertEqual(queue.count_unfinished(), 1)
+                task, = queue.lease('worker', 1)
+                task.status = ERROR
+                task.attributes = {'name': 'Error', 'status': ERROR}
+                queue.complete('worker', task)
+
+            self.assertEqual(queue.count_unfinished(), 0)
+            self.assertEqual(queue.lease('worker', 1), [])
+            completed = list(queue.iter_complete())
+
+        self.assertEqual(completed[0].attributes['name'], 'Error')
+
+    def test_late_errors_do_not_replace_results(self):
+        '''An error from an expired lease should not replace a result'''
+        with SQLiteWorkQueue(self.path, lease_timeout=0) as queue:
+            queue.add(self.tasks[:1])
+            lost_task, = queue.lease('lost', 1)
+            task, = queue.lease('other', 1)
+            task.status = OK
+            task.attributes = {'name': 'variety 0', 'status': OK}
+            queue.complete('other', task)
+            lost_task.status = ERROR
+            lost_task.attributes = {'name': 'Error', 'status': ERROR}
+            queue.complete('lost', lost_task)
+
+            self.assertEqual(queue.count_unfinished(), 0)
+            completed = list(queue.iter_complete())
+
+        self.assertEqual(completed[0].attributes['name'], 'variety 0')
+
+    def test_late_errors_do_not_interrupt_new_leases(self):
+        '''An error from an expired lease should not count against the
+        worker that leased the Task again'''
+        with SQLiteWorkQueue(self.path, lease_timeout=0,
+                             max_attempts=2) as queue:
+            queue.add(self.tasks[:1])
+            lost_task, = queue.lease('lost', 1)
+            task, = queue.lease('other', 1)
+            lost_task.status = ERROR
+            lost_task.attributes = {'name': 'Error', 'status': ERROR}
+            queue.complete('lost', lost_task)
+
+            self.assertEqual(queue.count_unfinished(), 1)
+            task.status = ERROR
+            task.attributes = {'name': 'Error', 'status': ERROR}
+            queue.complete('other', task)
+            self.assertEqual(queue.count_unfinished(), 1)
+            task, = queue.lease('other', 1)
+            task.status = OK
+            task.attributes = {'name': 'variety 0', 'status': OK}
+            queue.complete('other', task)
+            completed = list(queue.iter_complete())
+
+        self.assertEqual(completed[0].attributes['name'], 'variety 0')
+
+    def test_worker_runs_every_task(self):
+        '''A worker should run the queue until it is empty, and the
+        results should be collected in input order'''
+        with SQLiteWorkQueue(self.path) as queue:
+            queue.add(self.tasks)
+            with ThreadPool(2) as pool:
+                counts = run_worker(queue, pool, self.run_batch,
+                                    'worker', batch_size=2,
+                                    batches_in_flight=2, poll_interval=0.01)
+            products = list(iter_complete_products(queue))
+
+        self.assertEqual(counts[('Batches', None)], 4)
+        self.assertEqual([product.sese_number for product in products],
+                         ['0', '1', '2'])
+        self.assertEqual(products[1].ms_name, 'variety 1')
+        self.assertEqual(products[1].sms_name, 'variety 1')
+
+    def test_unfinished_queue_is_not_collected(self):
+        '''Collecting a queue with unfinished Tasks should fail'''
+        with SQLiteWorkQueue(self.path) as queue:
+            queue.add(self.tasks)
+            with self.assertRaises(ValueError):
+                list(iter_complete_products(queue))
+
+
+class ParseSite(BaseSite):
+    '''A Site whose pages are parsed by the ``parsing`` tests'''
+    ABBREVIATION = 'ps'
+
+    def _get_results_from_search_page(self, search_page_html):
+        return re.findall(r'<a href="(.*?)">(.*?)</a>', search_page_html)
+
+    def _parse_name_from_product_page(self):
+        return self._get_match_from_product_page(r'<h1>(.*?)</h1>')
+
+    def _parse_number_from_product_page(self):
+        return self._get_match_from_product_page(r'#(\d+)')
+
+    def _parse_organic_status_from_product_page(self):
+        return 'Organic' in self.page_html
+
+    def _parse_price_from_product_page(self):
+        return self._get_match_from_product_page(r'\$([\d.]+)')
+
+    def _parse_weight_from_product_page(self):
+        return None
+
+
+class TestParsing(unittest.TestCase):
+    '''Tests the ``parsing`` module'''
+    PRODUCT_PAGE = '<h1>Sugar Snap &amp; Pea</h1> #1234 $3.25 Organic'
+
+    def test_parse_functions(self):
+        '''Pages should be parsed by a new instance of the Site'''
+        results = parsing.parse_search_page(
+            ParseSite, '<a href="/1">Pea</a><a href="/2">Bean</a>')
+        attributes = parsing.parse_product_page(ParseSite,
+                                                self.PRODUCT_PAGE)
+
+        self.assertEqual(results, [('/1', 'Pea'), ('/2', 'Bean')])
+        self.assertEqual(attributes, {
+            'name': 'Sugar Snap & Pea', 'number': '1234', 'organic': True,
+            'price': '3.25', 'weight': None})
+
+    def test_pages_are_parsed_in_the_parse_pool(self):
+        '''A Site should use the parse pool once it has been started'''
+        site = ParseSite('Sugar Snap', 'Pea', True)
+        site.page_html = self.PRODUCT_PAGE
+        parsing.start_parse_pool(1)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(site._parse_product_page())
+            results = loop.run_until_complete(
+                site._parse_search_page('<a href="/1">Pea</a>'))
+        finally:
+            loop.close()
+            parsing.shutdown_parse_pool()
+
+        self.assertIsNone(parsing.get_parse_pool())
+        self.assertEqual(site.name, 'Sugar Snap & Pea')
+        self.assertEqual(site.price, '3.25')
+        self.assertEqual(results, [('/1', 'Pea')])
+
+    def test_fetch_threads_share_an_engine(self):
+        '''Fetch threads given an engine should all use it, other threads
+        should get their own FetchEngine'''
+        cache_enabled = settings.CACHE_ENABLED
+        settings.CACHE_ENABLED = False
+        try:
+            engine = fetch.create_engine()
+            with ThreadPool(2, initializer=fetch.init_worker,
+                            initargs=(None, engine)) as pool:
+                shared = pool.map(lambda _: fetch.get_engine(), range(4))
+            engines = []
+            threads = [threading.Thread(target=lambda: engines.append(
+                (get_engine(), get_engine()))) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+                thread.join()
+        finally:
+            settings.CACHE_ENABLED = cache_enabled
+
+        for shared_engine in shared:
+            self.assertIs(shared_engine, engine)
+        self.assertIs(engines[0][0], engines[0][1])
+        self.assertIsNot(engines[0][0], engines[1][0])
+
+
+def get_batch_worker(tasks):
+    '''Return the batch's Site & the process that ran it'''
+    if not tasks[0].sku:
+        raise ValueError('missing SKU')
+    return tasks[0].abbreviation, os.getpid()
+
+
+def get_batch_sites(tasks):
+    '''Return the Sites of the batch's Tasks & the process that ran it'''
+    return set(task.abbreviation for task in tasks), os.getpid()
+
+
+class TestSiteAffinityPool(unittest.TestCase):
+    '''Tests the ``affinity`` module'''
+    WEBSITES = TestScheduler.WEBSITES
+
+    def create_batches(self, skus):
+        products = [Product(number=sku, name='variety', category='category',
+                            organic='False') for sku in skus]
+        return split_into_batches(create_tasks(products, self.WEBSITES), 1)
+
+    def test_sites_have_their_own_workers(self):
+        '''Every batch of a Site should be run by the Site's group'''
+        with SiteAffinityPool(self.WEBSITES, {'sms': 1}, 2) as pool:
+            results = list(pool.imap_unordered(
+                get_batch_worker, self.create_batches('123456')))
+
+        self.assertEqual(len(results), 12)
+        workers = collections.defaultdict(set)
+        for abbreviation, pid in results:
+            workers[abbreviation].add(pid)
+        self.assertEqual(len(workers['sms']), 1)
+        self.assertIn(len(workers['ms']), (1, 2))
+        self.assertFalse(workers['sms'] & workers['ms'])
+
+    def test_mixed_batches_are_split_by_site(self):
+        '''Each Site's Tasks in a batch mixing Sites should be run by the
+        Site's group'''
+        tasks = [task for batch in self.create_batches('12')
+                 for task in batch]
+        with SiteAffinityPool(self.WEBSITES, {}, 1) as pool:
+            results = list(pool.imap_unordered(get_batch_sites, [tasks]))
+            site_workers = dict(pool.imap_unordered(
+                get_batch_worker, self.create_batches('1')))
+
+        self.assertEqual(len(results), 2)
+        for abbreviations, pid in results:
+            self.assertEqual(len(abbreviations), 1)
+            self.assertEqual(site_workers[abbreviations.pop()], pid)
+
+    def test_errors_are_raised(self):
+        '''An error in a worker should be raised by the results'''
+        with SiteAffinityPool(self.WEBSITES, {}, 1) as pool:
+            with self.assertRaises(ValueError):
+                list(pool.imap_unordered(get_batch_worker,
+                                         self.create_batches(['1', ''])))
+
+
+class TestAdaptiveLimit(unittest.TestCase):
+    '''Tests the ``concurrency`` module'''
+
+    def setUp(self):
+        stats.collect()
+        self.limit = AdaptiveLimit('host', initial=2, minimum=1, maximum=4,
+                                   window=5, latency_tolerance=2,
+                                   error_rate=0.2, backoff=0.5)
+
+    def finish_requests(self, count, latency=0.1, failed=False):
+        for _ in range(count):
+            self.limit.in_flight += 1
+            self.limit.release(latency, failed)
+
+    def test_limit_grows_while_latency_is_flat(self):
+        '''The limit should grow by one per window, up to its maximum'''
+        self.finish_requests(10)
+        self.assertEqual(self.limit.limit, 4)
+        self.finish_requests(10)
+        self.assertEqual(self.limit.limit, 4)
+        self.assertEqual(self.limit.baseline, 0.1)
+        self.assertEqual(stats.collect()[('Concurrency Limit', 'host')], 4)
+
+    def test_limit_is_cut_when_latency_or_errors_rise(self):
+        '''Slow windows & failing windows should cut the limit'''
+        self.finish_requests(10)
+        self.finish_requests(5, latency=1)
+        self.assertEqual(self.limit.limit, 2)
+        self.finish_requests(3)
+        self.finish_requests(2, failed=True)
+        self.assertEqual(self.limit.limit, 1)
+        self.finish_requests(5, failed=True)
+        self.assertEqual(self.limit.limit, 1)
+        self.assertEqual(stats.collect()[('Concurrency Limit', 'host')], 1)
+
+    def test_requests_wait_for_a_slot(self):
+        '''Requests past the limit should wait for a slot to be released'''
+        acquired = []
+
+        async def request(number):
+            await self.limit.acquire()
+            acquired.append(number)
+            await asyncio.sleep(0.01)
+            self.limit.release()
+
+        async def run_requests():
+            await asyncio.gather(*[request(number) for number in range(4)])
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(asyncio.wait_for(run_requests(), 1))
+        finally:
+            loop.close()
+        self.assertEqual(sorted(acquired), [0, 1, 2, 3])
+        self.assertEqual(self.limit.in_flight, 0)
+
+    def test_rate_limit_waits_do_not_shrink_the_limit(self):
+        '''Waiting for a slow rate limit should not count as latency'''
+        class FakeSocket(object):
+            def makefile(self, mode):
+                return io.BytesIO(
+                    b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+
+        class FakeConnection(object):
+            sock = None
+
+            def request(self, method, path, headers=None):
+                time.sleep(0.02)
+
+            def getresponse(self):
+                response = client.HTTPResponse(FakeSocket())
+                response.begin()
+                return response
+
+            def close(self):
+                pass
+
+        class FakePool(object):
+            def acquire(self):
+                return FakeConnection(), False
+
+            def release(self, connection):
+                pass
+
+        class FakeSession(fetch.Session):
+            def get_pool(self, scheme, netloc):
+                return FakePool()
+
+        session = FakeSession(
+            rate_limiters={'a.com': TokenBucket(rate=15, burst=5)})
+        window = settings.ADAPTIVE_WINDOW
+        settings.ADAPTIVE_WINDOW = 5
+        try:
+            engine = FetchEngine(1, 4, session=session, adaptive=True)
+            loop = asyncio.new_event_loop()
+            try:
+                for number in range(15):
+                    loop.run_until_complete(engine.fetch(
+                        'http://a.com/{}'.format(number)))
+            finally:
+                loop.close()
+        finally:
+            settings.ADAPTIVE_WINDOW = window
+
+        host_limit = engine.get_host_limit('a.com')
+        self.assertGreater(stats.collect()[('Rate Limited Requests',
+                                            'a.com')], 5)
+        self.assertEqual(host_limit.limit, 4)
+        self.assertLess(host_limit.baseline, 0.05)
+
+    def test_progress_shows_limits(self):
+        '''The progress output should show each host's limit'''
+        stream = io.StringIO()
+        counts = collections.Counter({('Concurrency Limit', 'b.com'): 3,
+                                      ('Concurrency Limit', 'a.com'): 5,
+                                      ('Retries', 'a.com'): 2})
+        stats.write_progress(stream, 12, counts)
+
+        self.assertEqual(stream.getvalue(),
+                         'Finished 12 Products | Concurrency Limits: '
+                         'a.com 5, b.com 3\n')
+
+
+class TestRetry(unittest.TestCase):
+    '''Tests the ``retry`` module'''
+    SETTINGS = {'SESE_HEADER_ORDER': ('sese_number', 'sese_organic',
+                                      'sese_name', 'sese_category'),
+                'COMPANY_HEADER_ORDER': ('ms', 'sms'),
+                'ATTRIBUTE_HEADER_ORDER': ('price', 'name', 'status')}
+
+    def setUp(self):
+        self.original_settings = {name: getattr(settings, name)
+                                  for name in self.SETTINGS}
+        for name, value in self.SETTINGS.items():
+            setattr(settings, name, value)
+        self.path = os.path.join(tempfile.mkdtemp(), 'output.csv')
+
+    def tearDown(self):
+        for name, value in self.original_settings.items():
+            setattr(settings, name, value)
+
+    def write_output(self, header, rows):
+        with open(self.path, 'w', encoding='utf8') as output_file:
+            for row in [header] + rows:
+                output_file.write('\t'.join(row) + '\n')
+
+    def test_retrying_needs_an_output_file(self):
+        '''Retrying without the shard's output file should be reported as a
+        usage error'''
+        argv = sys.argv
+        sys.argv = ['price_scraper.py', '--retry-failed', '--shard', '1/2']
+        stderr = io.StringIO()
+        try:
+            with contextlib.redirect_stderr(stderr):
+                with self.assertRaises(SystemExit):
+                    parse_arguments()
+        finally:
+            sys.argv = argv
+
+        self.assertIn('output-1-of-2.csv does not exist', stderr.getvalue())
+
+    def test_only_failed_results_are_retried(self):
+        '''Results with an error or no status should not be restored'''
+        self.write_output(create_header_list(), [
+            ['1', 'True', 'Pea', 'Pea', '2.45', 'Pea', 'ok',
+             '', 'Error', 'error'],
+            ['2', 'False', 'Bean', 'Bean', '', 'Not Found', 'not-found',
+             '', '', '']])
+
+        product_objects, results = load_output_file(self.path)
+
+        self.assertEqual([(product.sese_number, product.sese_organic)
+                          for product in product_objects],
+                         [('1', True), ('2', False)])
+        self.assertEqual(results, {
+            ('1', 'ms'): {'price': '2.45', 'name': 'Pea', 'status': 'ok'},
+            ('2', 'ms'): {'price': '', 'name': 'Not Found',
+                          'status': 'not-found'}})
+
+    def test_output_with_other_columns_is_rejected(self):
+        '''An output file written with other settings should not be read'''
+        self.write_output(create_header_list()[:-1], [])
+
+        with self.assertRaises(ValueError):
+            load_output_file(self.path)
+
+
+class CatalogSite(ParseSite):
+    '''A Site with a catalog listed over two pages'''
+    ABBREVIATION = 'cs'
+    CATALOG_URL = 'http://catalog.com/seeds?page={}'
+
+
+class TestCatalog(unittest.TestCase):
+    '''Tests the ``catalog`` module'''
+    PRODUCTS = [('/1', 'Sugar Snap Pea'), ('/2', 'Organic Sugar Snap Pea'),
+                ('/3', 'Provider Bean')]
+
+    class CatalogEngine(FetchEngine):
+        '''Serve the pages of the catalog instead of fetching them'''
+        PAGES = {1: '<a href="/1">Sugar Snap Pea</a><a href="/2">Pea</a>',
+                 2: '<a href="/3">Provider &amp; Bean</a>',
+                 3: '<a href="/3">Provider &amp; Bean</a>'}
+
+        def _fetch_blocking(self, url, headers, kind=None, stop=None,
+                            timeout=None, deadline=None):
+            page = self.PAGES.get(int(url.rsplit('=', 1)[1]), '')
+            return Response(url, 200, {}, page.encode('utf8'))
+
+    def setUp(self):
+        self.original_path = settings.CATALOG_PATH
+        settings.CATALOG_PATH = os.path.join(tempfile.mkdtemp(),
+                                             'catalog.sqlite3')
+        catalog._catalogs.clear()
+
+    def tearDown(self):
+        settings.CATALOG_PATH = self.original_path
+        catalog._catalogs.clear()
+
+    def test_snapshots_are_replaced(self):
+        '''A new crawl should replace the Site's snapshot'''
+        with catalog.CatalogStore() as catalog_store:
+            self.assertIsNone(catalog_store.get_crawled_at('cs'))
+            catalog_store.replace('cs', self.PRODUCTS)
+            catalog_store.replace('cs', self.PRODUCTS[:2])
+            catalog_store.replace('ps', self.PRODUCTS[2:])
+
+            self.assertEqual(catalog_store.get_products('cs'),
+                             self.PRODUCTS[:2])
+            self.assertIsNotNone(catalog_store.get_crawled_at('cs'))
+
+    def test_only_recent_snapshots_are_used(self):
+        '''Sites without a recent snapshot should be searched instead'''
+        self.assertIsNone(catalog.get_catalog('cs'))
+        self.assertFalse(os.path.exists(settings.CATALOG_PATH))
+        catalog._catalogs.clear()
+        with catalog.CatalogStore() as catalog_store:
+            catalog_store.replace('cs', self.PRODUCTS)
+
+        self.assertEqual(catalog.get_catalog('cs'), self.PRODUCTS)
+        self.assertIsNone(catalog.get_catalog('ps'))
+
+    def test_catalog_search(self):
+        '''Products should contain every search term, or any of them for
+        Sites that include the category'''
+        site = CatalogSite('Sugar Snap', 'Pea', True)
+        catalog_index = NameIndex([name for _, name in self.PRODUCTS])
+
+        self.assertEqual(
+            site._search_catalog(catalog_index, 'Sugar Snap, organic'), [1])
+        self.assertEqual(site._search_catalog(catalog_index, ''), [0, 1, 2])
+        site.INCLUDE_CATEGORY_IN_SEARCH = True
+        self.assertEqual(
+            site._search_catalog(catalog_index, 'provider pea'), [0, 1, 2])
+        self.assertEqual(site._search_catalog(catalog_index, ''), [])
+
+    def test_catalog_index_is_built_once_per_snapshot(self):
+        '''The catalog's NameIndex should be reused until the snapshot is
+        read again'''
+        with catalog.CatalogStore() as catalog_store:
+            catalog_store.replace('cs', self.PRODUCTS)
+
+        catalog_index = catalog.get_catalog_index('cs')
+        self.assertIs(catalog.get_catalog_index('cs'), catalog_index)
+        self.assertEqual(catalog_index.names,
+                         [name for _, name in self.PRODUCTS])
+        self.assertIsNone(catalog.get_catalog_index('ps'))
+        catalog._catalogs.clear()
+        self.assertIsNot(catalog.get_catalog_index('cs'), catalog_index)
+
+    def test_catalogs_are_crawled(self):
+        '''Catalog pages should be crawled until no new Products are
+        listed'''
+        original_engine = getattr(fetch._state, 'engine', None)
+        fetch._state.engine = self.CatalogEngine()
+        try:
+            with catalog.CatalogStore() as catalog_store:
+                loop = asyncio.new_event_loop()
+                try:
+                    loop.run_until_complete(catalog.crawl_catalogs(
+                        catalog_store, ['pricescraper.tests.CatalogSite',
+                                        'pricescraper.tests.ParseSite']))
+                finally:
+                    loop.close()
+                products = catalog_store.get_products('cs')
+        finally:
+            fetch._state.engine = original_engine
+
+        self.assertEqual(products, [('/1', 'Sugar Snap Pea'), ('/2', 'Pea'),
+                                    ('/3', 'Provider & Bean')])
+
+    def test_unfinished_catalogs_are_not_stored(self):
+        '''A crawl that stops at the page limit should keep the previous
+        snapshot'''
+        original_engine = getattr(fetch._state, 'engine', None)
+        fetch._state.engine = self.CatalogEngine()
+        stats.collect()
+        try:
+            with catalog.CatalogStore() as catalog_store:
+                catalog_store.replace('cs', self.PRODUCTS[:1])
+                loop = asyncio.new_event_loop()
+                try:
+                    loop.run_until_complete(catalog.crawl_catalogs(
+                        catalog_store, ['pricescraper.tests.CatalogSite'],
+                        max_pages=2))
+                finally:
+                    loop.close()
+                products = catalog_store.get_products('cs')
+        finally:
+            fetch._state.engine = original_engine
+
+        self.assertEqual(products, self.PRODUCTS[:1])
+        self.assertEqual(
+            stats.collect()[('Catalog Crawl Failures', 'cs')], 1)
+
+
+class TestMatching(unittest.TestCase):
+    '''Tests the ``matching`` module'''
+
+    def test_scores_match_the_original_loop(self):
+        '''The NameIndex should give exactly the original loop's scores'''
+        generator = random.Random(1)
+        names = generate_names(200, generator)
+        products = list(zip(generate_names(20, generator),
+                            generate_names(20, generator)))
+        name_index = NameIndex(names)
+        word_lists = [tokenize(name + ' ' + category)
+                      for name, category in products]
+
+        expected = [reference_scores(name, category, names)
+                    for name, category in products]
+        self.assertEqual([name_index.score(words) for words in word_lists],
+                         expected)
+        self.assertEqual([list(row) for row in
+                          name_index.score_all(word_lists)], expected)
+
+    @unittest.skipIf(matching.numpy is None, 'NumPy is not installed')
+    def test_numpy_scores_match_the_original_loop(self):
+        '''The NumPy scores should be exactly the original loop's scores'''
+        generator = random.Random(2)
+        names = generate_names(200, generator)
+        products = list(zip(generate_names(20, generator),
+                            generate_names(20, generator)))
+        name_index = NameIndex(names)
+        lengths = matching.numpy.array(name_index.lengths, dtype=float)
+
+        for name, category in products:
+            words = tokenize(name + ' ' + category)
+            scores = matching._score_arrays(
+                matching.numpy.array(name_index.count_matches(words),
+                                     dtype=float),
+                float(len(words)), lengths)
+            self.assertEqual(scores.tolist(),
+                             reference_scores(name, category, names))
+
+    def test_both_paths_score_names_without_words(self):
+        '''Empty & punctuation-only names should get the same scores with &
+        without NumPy, names without any words scoring 0'''
+        names = ['Sugar Snap Pea', '', '&', '... !', 'Pea (OV)']
+        word_lists = [tokenize('Sugar Snap Pea'), tokenize('& Pea'), []]
+        expected = [matching.score_names(words, names)
+                    for words in word_lists]
+        name_index = NameIndex(names)
+
+        self.assertEqual(expected[0][1], 0)
+        self.assertEqual(expected[2], [0] * len(names))
+        original_numpy = matching.numpy
+        paths = [None] if original_numpy is None else [None, original_numpy]
+        try:
+            for numpy in paths:
+                matching.numpy = numpy
+                self.assertEqual(
+                    [name_index.score(words) for words in word_lists],
+                    expected)
+                self.assertEqual([list(row) for row in
+                                  name_index.score_all(word_lists)],
+                                 expected)
+        finally:
+            matching.numpy = original_numpy
+
+    def test_index_scores_a_subset_of_candidates(self):
+        '''Scoring some of the index's candidates should give the same
+        ranks as scoring those names on their own'''
+        generator = random.Random(3)
+        names = generate_names(100, generator)
+        name_index = NameIndex(names)
+        words = tokenize('sweet red pepper')
+        positions = name_index.find(['pepper'])
+
+        self.assertTrue(positions)
+        self.assertTrue(all('pepper' in tokenize(names[position])
+                            for position in positions))
+        self.assertEqual(
+            [(score, positions[index]) for score, index in
+             matching.rank_names(words, [names[p] for p in positions])],
+            name_index.rank(words, positions))
+
+    def test_match_amounts_are_ranked(self):
+        '''Search results should be ranked by score, keeping ties in
+        order'''
+        site = ParseSite('Sugar Snap', 'Pea', True)
+        results = [('/1', 'Provider Bean'), ('/2', 'Snap Pea'),
+                   ('/3', 'Sugar Snap Pea'), ('/4', 'Pea Snap'),
+                   ('/5', 'Sugar Snap Pea & Bean')]
+        scores = reference_scores('Sugar Snap', 'Pea',
+                                  [name for _, name in results])
+
+        ranked = site._prepend_name_match_amounts(results)
+
+        self.assertEqual([result[0] for _, result in ranked],
+                         ['/3', '/2', '/4', '/5', '/1'])
+        self.assertEqual(sorted(score for score, _ in ranked),
+                         sorted(scores))
+        self.assertEqual(site._prepend_name_match_amounts([]), [])
+
+
+class MatchSite(ParseSite):
+    '''A Site whose pages are served by the ``matches`` tests'''
+    ABBREVIATION = 'mts'
+    ROOT_URL = 'http://match.com'
+    SEARCH_URL = ROOT_URL + '/search?q={}'
+
+
+class TestMatches(unittest.TestCase):
+    '''Tests the ``matches`` module'''
+
+    class MatchEngine(FetchEngine):
+        '''Serve a search page & Product Pages, recording each request'''
+        PAGES = {'/2': '<h1>Sugar Snap Pea</h1> #2 $3.25',
+                 '/3': 'Sold Out'}
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.requested = []
+
+        def _fetch_blocking(self, url, headers, kind=None, stop=None,
+                            timeout=None, deadline=None):
+            path = url[len(MatchSite.ROOT_URL):]
+            self.requested.append(path)
+            if path.startswith('/search'):
+                page = '<a href="/2">Sugar Snap Pea</a>'
+            elif path in self.PAGES:
+                page = self.PAGES[path]
+            else:
+                raise urllib.error.HTTPError(url, 404, 'Not Found', {}, None)
+            return Response(url, 200, {}, page.encode('utf8'))
+
+    def setUp(self):
+        self.original_path = settings.MATCHES_PATH
+        settings.MATCHES_PATH = os.path.join(tempfile.mkdtemp(),
+                                             'matches.sqlite3')
+        matches._match_store = None
+        self.original_engine = getattr(fetch._state, 'engine', None)
+        fetch._state.engine = self.engine = self.MatchEngine()
+
+    def tearDown(self):
+        fetch._state.engine = self.original_engine
+        matches.get_match_store().close()
+        matches._match_store = None
+        settings.MATCHES_PATH = self.original_path
+
+    def scrape(self, name='Sugar Snap', category='Pea', organic=False):
+        '''Scrape the Product for SKU 1 from the MatchSite'''
+        site = MatchSite(name, category, organic, sku='1')
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(site.get_and_set_product_information())
+        finally:
+            loop.close()
+        return site
+
+    def test_shared_searches_store_each_skus_match(self):
+        '''Tasks sharing a search should store its match for their SKU'''
+        tasks = create_tasks(
+            [Product(number=str(number), name='Sugar Snap', category='Pea',
+                     organic='False') for number in (1, 2)],
+            ['pricescraper.tests.MatchSite'])
+        planner = SearchPlanner()
+        planned_task, = planner.plan(tasks)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(planned_task.run())
+        finally:
+            loop.close()
+        shared_task, = planner.finish(planned_task)
+        match_store = matches.get_match_store()
+
+        self.assertFalse(match_store.record(planned_task))
+        self.assertTrue(match_store.record(shared_task))
+        self.assertEqual(match_store.get_match('2', 'mts'),
+                         match_store.get_match('1', 'mts'))
+        self.assertEqual(match_store.get_match('2', 'mts')[0],
+                         MatchSite.ROOT_URL + '/2')
+
+    def test_pinned_matches_are_kept(self):
+        '''Searches should not replace or forget pinned matches'''
+        match_store = matches.get_match_store()
+        match_store.record_match('1', 'mts', '/2')
+        match_store.record_match('2', 'mts', '/2')
+        match_store.replace_overrides([('1', 'mts', '/3'),
+                                       ('3', 'mts', None)])
+        match_store.record_match('1', 'mts', '/4')
+        match_store.forget_match('1', 'mts')
+        match_store.forget_match('2', 'mts')
+
+        self.assertEqual(match_store.get_match('1', 'mts'), ('/3', True))
+        self.assertIsNone(match_store.get_match('2', 'mts'))
+        self.assertEqual(match_store.get_match('3', 'mts'), (None, True))
+        match_store.replace_overrides([])
+        self.assertIsNone(match_store.get_match('1', 'mts'))
+
+    def test_overrides_are_loaded(self):
+        '''Blank URLs in the overrides file should mean no match'''
+        filename = os.path.join(tempfile.mkdtemp(), 'overrides.csv')
+        with open(filename, 'w', encoding='utf8') as overrides_file:
+            overrides_file.write('SKU\tSite\tURL\n1\tmts\t/2\n2\tmts\t\n')
+
+        self.assertEqual(matches.load_overrides(filename),
+                         [('1', 'mts', '/2'), ('2', 'mts', None)])
+
+    def test_matches_are_stored(self):
+        '''A search's match should be fetched directly by the next run'''
+        first_site = self.scrape()
+        second_site = self.scrape()
+
+        self.assertEqual(self.engine.requested,
+                         ['/search?q=Sugar%20Snap', '/2', '/2'])
+        self.assertEqual(first_site.name, 'Sugar Snap Pea')
+        self.assertEqual(second_site.name, 'Sugar Snap Pea')
+        self.assertEqual(second_site.price, '3.25')
+
+    def test_stale_matches_are_searched_again(self):
+        '''A stored page that is gone or does not parse should be replaced
+        by searching the Site'''
+        match_store = matches.get_match_store()
+        for stored_url in ('/1', '/3'):
+            match_store.record_match('1', 'mts', MatchSite.ROOT_URL +
+                                     stored_url)
+            self.engine.requested = []
+
+            site = self.scrape()
+
+            self.assertEqual(self.engine.requested,
+                             [stored_url, '/search?q=Sugar%20Snap', '/2'])
+            self.assertEqual(site.name, 'Sugar Snap Pea')
+            self.assertEqual(match_store.get_match('1', 'mts'),
+                             (MatchSite.ROOT_URL + '/2', False))
+
+    def test_pinned_no_match_is_not_searched(self):
+        '''A Site pinned to have no match should not be searched'''
+        matches.get_match_store().replace_overrides([('1', 'mts', None)])
+
+        site = self.scrape()
+
+        self.assertEqual(self.engine.requested, [])
+        self.assertEqual(site.name, 'Not Found')
+        self.assertTrue(site.scraped)
+
+    def test_not_found_is_reprobed(self):
+        '''A Site with no match should not be searched again until the
+        not-found result is due to be re-probed'''
+        first_site = self.scrape('Provider', 'Bean', True)
+        second_site = self.scrape('Provider', 'Bean', True)
+        searches = len(self.engine.requested)
+        matches.get_match_store().close()
+        matches._match_store = matches.MatchStore(
+            default_not_found_max_age=0)
+        self.scrape('Provider', 'Bean', True)
+
+        self.assertEqual(self.engine.requested[:searches],
+                         ['/search?q=Provider%20organic',
+                          '/search?q=Provider'])
+        self.assertEqual(len(self.engine.requested), searches * 2)
+        self.assertEqual(first_site.name, 'Not Found')
+        self.assertEqual(second_site.name, 'Not Found')
+        self.assertTrue(second_site.scraped)
+
+    def test_catalog_matches_are_fetched_directly(self):
+        '''A Site with a catalog snapshot should not be searched'''
+        original_path = settings.CATALOG_PATH
+        settings.CATALOG_PATH = os.path.join(tempfile.mkdtemp(),
+                                             'catalog.sqlite3')
+        catalog._catalogs.clear()
+        try:
+            with catalog.CatalogStore() as catalog_store:
+                catalog_store.replace('mts', [('/1', 'Provider Bean'),
+                                              ('/2', 'Sugar Snap Pea'),
+                                              ('/3', 'Snap Bean')])
+            site = self.scrape('Snap', 'Pea')
+        finally:
+            settings.CATALOG_PATH = original_path
+            catalog._catalogs.clear()
+
+        self.assertEqual(self.engine.requested, ['/2'])
+        self.assertEqual(site.name, 'Sugar Snap Pea')
+
+    def test_catalog_not_found_is_not_stored(self):
+        '''A Product missing from a catalog snapshot should not be stored
+        as having no match'''
+        original_path = settings.CATALOG_PATH
+        settings.CATALOG_PATH = os.path.join(tempfile.mkdtemp(),
+                                             'catalog.sqlite3')
+        catalog._catalogs.clear()
+        try:
+            with catalog.CatalogStore() as catalog_store:
+                catalog_store.replace('mts', [('/2', 'Sugar Snap Pea')])
+            site = self.scrape('Provider', 'Bean', True)
+        finally:
+            settings.CATALOG_PATH = original_path
+            catalog._catalogs.clear()
+
+        self.assertEqual(self.engine.requested, [])
+        self.assertEqual(site.name, 'Not Found')
+        self.assertIsNone(matches.get_match_store().get_match('1', 'mts'))
+
+    def test_reprobe_ages_are_spread(self):
+        '''Each SKU should be re-probed after a fixed age between the
+        spread & the Site's maximum age'''
+        with matches.MatchStore(settings.MATCHES_PATH, {'mts': 100}, 1000,
+                                0.25) as match_store:
+            ages = [match_store.get_reprobe_age(str(sku), 'mts')
+                    for sku in range(50)]
+            other_age = match_store.get_reprobe_age('1', 'other')
+
+            self.assertEqual(ages[1], match_store.get_reprobe_age('1', 'mts'))
+        self.assertTrue(all(75 <= age <= 100 for age in ages))
+        self.assertGreater(len(set(ages)), 1)
+        self.assertTrue(750 <= other_age <= 1000)
+
+
+class TestPlanning(unittest.TestCase):
+    '''Tests the ``planning`` module'''
+    WEBSITES = ['pricescraper.tests.MockSite']
+    run_batch = TestPipeline.run_batch
+
+    def create_task(self, number, name='Sugar Snap', organic='False'):
+        product = Product(number=str(number), name=name, category='Pea',
+                          organic=organic)
+        return create_tasks([product], self.WEBSITES, start=number)[0]
+
+    def test_search_keys_are_normalised(self):
+        '''Tasks should share a search regardless of case & punctuation'''
+        task = self.create_task(0)
+
+        self.assertEqual(get_search_key(task),
+                         get_search_key(self.create_task(1, ' sugar snap!')))
+        self.assertNotEqual(get_search_key(task),
+                            get_search_key(self.create_task(2, 'Snap')))
+        self.assertNotEqual(
+            get_search_key(task),
+            get_search_key(self.create_task(3, organic='True')))
+
+    def test_tasks_share_a_search(self):
+        '''Held back Tasks should be given the scraped Task's result'''
+        planner = SearchPlanner(pinned_keys=[('3', 'ms')])
+        tasks = [self.create_task(number) for number in range(4)]
+        other_task = self.create_task(4, 'Provider')
+
+        planned = planner.plan(tasks + [other_task])
+        restored_task = self.create_task(5)
+        restored_task.restore({'name': 'restored', 'number': None,
+                               'organic': None, 'price': None,
+                               'weight': None})
+        self.assertEqual(planner.finish(restored_task), [])
+        tasks[0].scraped = True
+        tasks[0]._set_attributes({'name': 'Sugar Snap Pea', 'number': '1',
+                                  'organic': False, 'price': '3.25',
+                                  'weight': None})
+        shared = planner.finish(tasks[0])
+
+        self.assertEqual(planned, [tasks[0], tasks[3], other_task])
+        self.assertEqual(shared, tasks[1:3])
+        self.assertEqual([task.attributes['price'] for task in shared],
+                         ['3.25', '3.25'])
+        self.assertEqual([task.status for task in shared], [OK, OK])
+        new_task = self.create_task(6)
+        self.assertEqual(planner.plan([new_task]), [new_task])
+
+    def test_pipeline_shares_searches(self):
+        '''A Pipeline should only scrape one of the Tasks sharing a search,
+        and record the result of every Task'''
+        MockSite.finished = []
+        path = os.path.join(tempfile.mkdtemp(), 'journal.jsonl')
+        products = [Product(number=str(number), name='variety',
+                            category='category', organic='False')
+                    for number in range(6)]
+        with Journal(path) as journal:
+            pipeline = Pipeline(products, self.WEBSITES, chunk_size=6,
+                                recorders=[journal],
+                                search_planner=SearchPlanner([('4', 'ms')]))
+            with ThreadPool(2) as pool:
+                products = list(pipeline.run(pool, self.run_batch))
+
+        self.assertEqual([product.ms_name for product in products],
+                         ['variety'] * 6)
+        self.assertEqual(MockSite.finished, ['ms'] * 2)
+        self.assertEqual(pipeline.counts[('Shared Searches', 'ms')], 4)
+        self.assertEqual(len(load_journal(path)), 6)
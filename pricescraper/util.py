@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 '''This module provides utility functions for the application'''
-import html.parser
-from http import cookiejar
+import html
+from html.entities import codepoint2name
 import string
-import urllib.request
 
+import fetch
 import settings
 
 
+#: Maps every punctuation character to :obj:`None`, for :meth:`str.translate`.
+PUNCTUATION_MAP = dict((ord(char), None) for char in string.punctuation)
+
+
 def get_class(class_string):
     '''Return the Class object of the specified string'''
     parts = class_string.split('.')
@@ -18,32 +22,76 @@ def get_class(class_string):
     return module
 
 
-urllib.request.install_opener(urllib.request.build_opener(
-    urllib.request.HTTPHandler(),
-    urllib.request.HTTPSHandler(),
-    urllib.request.HTTPCookieProcessor(cookiejar.LWPCookieJar()),
-))
+async def fetch_page_html(page_url, kind=None, stop=None, deadline=None):
+    '''Fetch the ``page_url`` using the process's FetchEngine and return the
+    HTML of the page.
 
-
-def get_page_html(page_url):
-    '''Visit the ``page_url`` and return the HTML of the page.
+    The page is decoded using its declared charset, see
+    :meth:`fetch.Response.get_text`. HTML entities are left escaped, values
+    parsed from the page should be passed through :func:`unescape`.
 
     :param page_url: The URL of the page to grab
     :type page_url: str
+    :param kind: The kind of page, used to cache the page. See
+                 :meth:`fetch.FetchEngine.fetch`.
+    :type kind: str
+    :param stop: When to stop downloading the page, if it is not needed in
+                 full
+    :type stop: :class:`fetch.StopCondition`
+    :param deadline: The time the page must be fetched by, if any
+    :type deadline: :class:`resilience.Deadline`
     :returns: The HTML of the page
     :rtype: :obj:`str`
     '''
-    request = urllib.request.Request(
-        page_url, headers={'User-Agent': 'Mozilla/5.0'})
-    page_html = urllib.request.urlopen(request).read()
-    try:
-        page_html = page_html.decode('iso-8859-1')
-    except UnicodeEncodeError:
-        pass
+    response = await fetch.get_engine().fetch(
+        page_url, kind=kind, stop=stop, deadline=deadline)
+    return response.get_text()
+
+
+def unescape(text):
+    '''Replace the HTML entities in a value parsed from a page.
+
+    :returns: The unescaped String or :obj:`None` if ``text`` is
+              :obj:`None`
+    :rtype: :obj:`str`
+    '''
+    if text is None:
+        return None
+    return html.unescape(text)
 
-    parser = html.parser.HTMLParser()
-    unescaped_html = parser.unescape(page_html)
-    return unescaped_html
+
+def get_escaped_forms(text):
+    '''Return the ways the text may be written in a page's HTML.
+
+    Pages are not unescaped as a whole, so text searched for in a page's HTML
+    must also be looked for with its non-ASCII characters written as named,
+    decimal or hexadecimal HTML entities, like ``couldn&rsquo;t``.
+
+    :param text: The text to search for
+    :type text: str
+    :returns: The text followed by each of its escaped forms
+    :rtype: :obj:`list`
+    '''
+    forms = [text]
+    for entity_format in ('&{name};', '&#{code};', '&#x{code:x};'):
+        form = ''.join(_escape_character(character, entity_format)
+                       for character in text)
+        if form not in forms:
+            forms.append(form)
+    return forms
+
+
+def _escape_character(character, entity_format):
+    '''Write a non-ASCII character as an entity, characters without a name
+    are written as decimal entities instead of named ones.
+    '''
+    code = ord(character)
+    if code < 128:
+        return character
+    name = codepoint2name.get(code)
+    if name is None and '{name}' in entity_format:
+        entity_format = '&#{code};'
+    return entity_format.format(name=name, code=code)
 
 
 def remove_punctuation(text):
@@ -52,9 +100,7 @@ def remove_punctuation(text):
     :returns: The String with no punctuation
     :rtype: :obj:`str`
     '''
-    remove_punctuation_map = dict((ord(char), None) for char in
-                                  string.punctuation)
-    return text.translate(remove_punctuation_map)
+    return text.translate(PUNCTUATION_MAP)
 
 
 def create_header_list():
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+'''This module defines the work queue shared by several scraper machines.
+
+Instead of splitting the input into fixed shards, a run can be spread over
+any number of machines using a :class:`WorkQueue`. Every
+:class:`~scheduler.Task` of the input is added to the queue, and each
+machine repeatedly leases a batch of Tasks, scrapes them and marks them as
+complete. A machine holding a lease sends a heartbeat while it works, if it
+stops sending them its lease expires and the Tasks are handed to another
+machine. Machines that finish their Tasks quickly simply lease more of
+them, so the work is balanced even when some Products need many more
+requests than others. Tasks that fail are left pending, so they are run
+again, until they have failed :data:`~settings.QUEUE_MAX_ATTEMPTS` times.
+
+The :class:`WorkQueue` class defines the interface a queue backend must
+implement. The :class:`SQLiteWorkQueue` keeps the queue in a SQLite
+database, which can be shared by worker processes on a single machine or,
+on a shared filesystem with working locks, by several machines.
+'''
+from abc import abstractmethod, ABCMeta
+import collections
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from product import Product
+from scheduler import ERROR, Task
+import settings
+import stats
+
+
+#: The state of a Task that is waiting to be leased.
+PENDING = 'pending'
+
+#: The state of a Task that has been leased by a worker.
+LEASED = 'leased'
+
+#: The state of a Task that has been completed.
+COMPLETE = 'complete'
+
+
+class WorkQueue(object):
+    '''The WorkQueue is an Abstract class for work queue backends.
+
+    Backends must hand out each Task to one worker at a time, re-delivering
+    Tasks whose lease has expired.
+    '''
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def add(self, tasks):
+        '''Abstract - Add the ``tasks`` to the queue as pending Tasks.
+
+        :param tasks: The Tasks to add
+        :type tasks: iterable
+        :returns: :obj:`None`
+        '''
+
+    @abstractmethod
+    def lease(self, worker_id, count):
+        '''Abstract - Lease up to ``count`` pending or expired Tasks, all
+        for the same Site.
+
+        :param worker_id: The unique name of the worker taking the lease
+        :type worker_id: str
+        :param count: The maximum number of Tasks to lease
+        :type count: int
+        :returns: The leased Tasks, this is empty if no Tasks are available
+        :rtype: :obj:`list`
+        '''
+
+    @abstractmethod
+    def heartbeat(self, worker_id):
+        '''Abstract - Extend the leases of every Task the worker holds.
+
+        :param worker_id: The unique name of the worker
+        :type worker_id: str
+        :returns: :obj:`None`
+        '''
+
+    @abstractmethod
+    def complete(self, worker_id, task):
+        '''Abstract - Store the result of a finished Task, or leave a Task
+        that failed pending until it has used up its attempts.
+
+        :param worker_id: The unique name of the worker that ran the Task
+        :type worker_id: str
+        :param task: The finished Task
+        :type task: :class:`~scheduler.Task`
+        :returns: :obj:`None`
+        '''
+
+    @abstractmethod
+    def count_unfinished(self):
+        '''Abstract - Return the number of Tasks that are not complete.
+
+        :rtype: :obj:`int`
+        '''
+
+    @abstractmethod
+    def iter_complete(self):
+        '''Abstract - Yield every complete Task in input order.
+
+        :returns: A generator of finished Tasks
+        '''
+
+
+class SQLiteWorkQueue(WorkQueue):
+    '''The SQLiteWorkQueue keeps the work queue in a SQLite database.
+
+    A SQLiteWorkQueue may be shared by the threads of a process.
+    '''
+
+    def __init__(self, path=None, lease_timeout=None, max_attempts=None):
+        '''The Constructor opens the queue's database, creating it if
+        necessary.
+
+        :param path: The path to the database file, defaults to
+                     :data:`~settings.QUEUE_PATH`
+        :type path: str
+        :param lease_timeout: The number of seconds a lease lasts without a
+                              heartbeat, defaults to
+                              :data:`~settings.QUEUE_LEASE_TIMEOUT`
+        :type lease_timeout: float
+        :param max_attempts: The number of times a Task is run before its
+                             error is kept, defaults to
+                             :data:`~settings.QUEUE_MAX_ATTEMPTS`
+        :type max_attempts: int
+        :returns: :obj:`None`
+        '''
+        if path is None:
+            path = settings.QUEUE_PATH
+        if lease_timeout is None:
+            lease_timeout = settings.QUEUE_LEASE_TIMEOUT
+        if max_attempts is None:
+            max_attempts = settings.QUEUE_MAX_ATTEMPTS
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            'position INTEGER, sku TEXT, name TEXT, category TEXT, '
+            'organic INTEGER, website TEXT, state TEXT, worker TEXT, '
+            'lease_expires_at REAL, attributes TEXT, scraped INTEGER, '
+            'attempts INTEGER DEFAULT 0, PRIMARY KEY (position, website))')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''Close the queue's database connection.'''
+        with self._lock:
+            self._connection.close()
+
+    def add(self, tasks):
+        '''Add the ``tasks`` to the queue, ignoring Tasks already in it.'''
+        rows = ((task.index, task.sku, task.sese_name, task.sese_category,
+                 task.sese_organic, task.website, PENDING)
+                for task in tasks)
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO tasks (position, sku, name, '
+                    'category, organic, website, state) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def lease(self, worker_id, count):
+        '''Lease up to ``count`` pending Tasks, or Tasks whose lease has
+        expired, in input order.
+
+        Every leased Task is for the Site of the first Task that may be
+        leased, so a :class:`~affinity.SiteAffinityPool` runs each lease as
+        a single batch.
+        '''
+        now = time.time()
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._connection.execute(
+                    'SELECT position, sku, name, category, organic, website '
+                    'FROM tasks WHERE website = ('
+                    'SELECT website FROM tasks WHERE state = ? OR '
+                    '(state = ? AND lease_expires_at < ?) '
+                    'ORDER BY position, website LIMIT 1) AND '
+                    '(state = ? OR (state = ? AND lease_expires_at < ?)) '
+                    'ORDER BY position LIMIT ?',
+                    (PENDING, LEASED, now, PENDING, LEASED, now,
+                     count)).fetchall()
+                self._connection.executemany(
+                    'UPDATE tasks SET state = ?, worker = ?, '
+                    'lease_expires_at = ? '
+                    'WHERE position = ? AND website = ?',
+                    [(LEASED, worker_id, now + self.lease_timeout,
+                      row[0], row[5]) for row in rows])
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+        return [_create_task(*row) for row in rows]
+
+    def heartbeat(self, worker_id):
+        '''Extend the leases of every Task the worker holds.'''
+        with self._lock:
+            self._connection.execute(
+                'UPDATE tasks SET lease_expires_at = ? '
+                'WHERE state = ? AND worker = ?',
+                (time.time() + self.lease_timeout, LEASED, worker_id))
+
+    def complete(self, worker_id, task):
+        '''Store the result of a finished Task.
+
+        A Task with a status of :data:`~scheduler.ERROR` is made pending
+        again, unless it has been run ``max_attempts`` times, in which case
+        the error is kept as its result.
+
+        A Task may be completed by a worker whose lease expired, in which
+        case the latest result is kept. An error is only kept if the worker
+        still holds the Task's lease, so a stale error cannot use up an
+        attempt of, or replace the result of, another worker's run.
+        '''
+        attributes = json.dumps(task.attributes)
+        with self._lock:
+            if task.status == ERROR:
+                self._connection.execute(
+                    'UPDATE tasks SET state = CASE WHEN attempts + 1 < ? '
+                    'THEN ? ELSE ? END, attempts = attempts + 1, '
+                    'attributes = ?, scraped = ? '
+                    'WHERE position = ? AND website = ? AND state = ? '
+                    'AND worker = ?',
+                    (self.max_attempts, PENDING, COMPLETE, attributes,
+                     task.scraped, task.index, task.website, LEASED,
+                     worker_id))
+            else:
+                self._connection.execute(
+                    'UPDATE tasks SET state = ?, attempts = attempts + 1, '
+                    'worker = ?, attributes = ?, scraped = ? '
+                    'WHERE position = ? AND website = ?',
+                    (COMPLETE, worker_id, attributes, task.scraped,
+                     task.index, task.website))
+
+    def count_unfinished(self):
+        '''Return the number of Tasks that are not complete.'''
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM tasks WHERE state != ?',
+                (COMPLETE,)).fetchone()[0]
+
+    def iter_complete(self):
+        '''Yield every complete Task in input order.'''
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT position, sku, name, category, organic, website, '
+                'attributes, scraped FROM tasks WHERE state = ? '
+                'ORDER BY position, website', (COMPLETE,))
+            rows = rows.fetchall()
+        for row in rows:
+            task = _create_task(*row[:6])
+            task.attributes = json.loads(row[6])
+            task.scraped = bool(row[7])
+            task.status = task.attributes.get('status')
+            yield task
+
+
+class Heartbeat(object):
+    '''The Heartbeat extends a worker's leases from a background thread.'''
+
+    def __init__(self, work_queue, worker_id, interval=None):
+        '''The Constructor sets the worker whose leases are extended.
+
+        :param work_queue: The queue holding the leases
+        :type work_queue: :class:`WorkQueue`
+        :param worker_id: The unique name of the worker
+        :type worker_id: str
+        :param interval: The number of seconds between heartbeats, defaults
+                         to a third of
+                         :data:`~settings.QUEUE_LEASE_TIMEOUT`
+        :type interval: float
+        :returns: :obj:`None`
+        '''
+        if interval is None:
+            interval = settings.QUEUE_LEASE_TIMEOUT / 3
+        self.work_queue = work_queue
+        self.worker_id = worker_id
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def _beat(self):
+        '''Send a heartbeat every ``interval`` seconds until stopped.'''
+        while not self._stopped.wait(self.interval):
+            self.work_queue.heartbeat(self.worker_id)
+
+
+def get_worker_id():
+    '''Return a name for this process that is unique across machines.'''
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+def run_worker(work_queue, process_pool, process_tasks, worker_id=None,
+               batch_size=None, batches_in_flight=None, poll_interval=None):
+    '''Lease & run batches of Tasks from the ``work_queue`` until every Task
+    in it is complete.
+
+    While other workers still hold leases, the queue is polled in case their
+    leases expire and their Tasks need running again.
+
+    :param work_queue: The queue to lease Tasks from
+    :type work_queue: :class:`WorkQueue`
+    :param process_pool: The pool of worker processes
+    :type process_pool: :class:`~multiprocessing.pool.Pool`
+    :param process_tasks: The function the workers use to run a batch of
+                          Tasks, returning the finished Tasks and the
+                          statistics they collected
+    :type process_tasks: function
+    :param worker_id: The unique name of the worker, defaults to the one
+                      returned by :func:`get_worker_id`
+    :type worker_id: str
+    :param batch_size: The maximum number of Tasks in a batch, defaults to
+                       :data:`~settings.TASKS_PER_WORKER_BATCH`
+    :type batch_size: int
+    :param batches_in_flight: The maximum number of leased batches that are
+                              not complete, defaults to
+                              :data:`~settings.QUEUE_BATCHES_IN_FLIGHT`
+    :type batches_in_flight: int
+    :param poll_interval: The number of seconds between checks for expired
+                          leases, defaults to
+                          :data:`~settings.QUEUE_POLL_INTERVAL`
+    :type poll_interval: float
+    :returns: The statistics collected by the worker processes
+    :rtype: :class:`~collections.Counter`
+    '''
+    if worker_id is None:
+        worker_id = get_worker_id()
+    if batch_size is None:
+        batch_size = settings.TASKS_PER_WORKER_BATCH
+    if batches_in_flight is None:
+        batches_in_flight = settings.QUEUE_BATCHES_IN_FLIGHT
+    if poll_interval is None:
+        poll_interval = settings.QUEUE_POLL_INTERVAL
+    slots = threading.BoundedSemaphore(batches_in_flight)
+
+    def lease_batches():
+        while True:
+            slots.acquire()
+            batch = work_queue.lease(worker_id, batch_size)
+            if batch:
+                yield batch
+                continue
+            slots.release()
+            if work_queue.count_unfinished() == 0:
+                return
+            time.sleep(poll_interval)
+
+    counts = collections.Counter()
+    with Heartbeat(work_queue, worker_id):
+        results = process_pool.imap_unordered(process_tasks,
+                                              lease_batches())
+        for tasks, batch_counts in results:
+            for task in tasks:
+                work_queue.complete(worker_id, task)
+            slots.release()
+            stats.merge(counts, batch_counts)
+    return counts
+
+
+def iter_complete_products(work_queue):
+    '''Yield every Product in the queue, in input order, with the results
+    of its Tasks added.
+
+    :param work_queue: The queue holding the results
+    :type work_queue: :class:`WorkQueue`
+    :returns: A generator of finished Products
+    :raises ValueError: If the queue still has unfinished Tasks
+    '''
+    unfinished = work_queue.count_unfinished()
+    if unfinished:
+        raise ValueError('The queue has {} unfinished Tasks'.format(
+            unfinished))
+    tasks = work_queue.iter_complete()
+    for _, product_tasks in itertools.groupby(tasks, lambda t: t.index):
+        product = None
+        for task in product_tasks:
+            if product is None:
+                product = Product(number=task.sku, name=task.sese_name,
+                                  category=task.sese_category,
+                                  organic=str(task.sese_organic))
+            product.add_task_result(task)
+        yield product
+
+
+def _create_task(position, sku, name, category, organic, website):
+    '''Rebuild a Task from a row of the queue.'''
+    product = Product(number=sku, name=name, category=category,
+                      organic=str(bool(organic)))
+    return Task(position, product, website)